@@ -2,12 +2,16 @@ from .components.file import File
 from .components.rinfo import RSA_Vector
 from .components.volume import Volume
 import numpy as np
-from GUI.components import QtMain
 import logging
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # // not imported at runtime, so that DATA is usable without the GUI
+    from GUI.components import QtMain
 
 
 class RSA_Components(object):
-    def __init__(self, parent: QtMain):
+    def __init__(self, parent: "QtMain"):
         super().__init__()
         self.main = parent
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -23,6 +27,10 @@ class RSA_Components(object):
     def volume(self):
         return self.__volumes[self.__current_volume_index]
 
+    @property
+    def volumes(self):
+        return self.__volumes.copy()
+
     def set_volumes(self, np_vols: list[np.ndarray], labels: list[str]):
         assert len(np_vols) == len(labels)
         assert len(np_vols) >= 1
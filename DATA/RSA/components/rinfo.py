@@ -1,31 +1,164 @@
-import glob
 import json
 import logging
 import os
-from typing import Generator, Iterator, List, Union
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Final, Generator, Iterator, List, Tuple, Union
 
 import numpy as np
 
 import config
+from modules.atomic_write import atomic_write
+from modules.lazy_import import lazy_import
+
+pl = lazy_import("polars")
+
+ROOT_TRAITS_FORMATS: Final[dict] = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".ipc": "arrow",
+    ".feather": "arrow",
+}
+
+
+def root_traits_format(file_name: Union[str, Path]) -> str:
+    # // csv, parquet, or arrow, by the file extension
+    suffix = Path(file_name).suffix.lower()
+    if suffix not in ROOT_TRAITS_FORMATS:
+        raise ValueError(f"Unknown file format: {file_name}")
+    return ROOT_TRAITS_FORMATS[suffix]
+
+
+def trait_series(label: str, values: list):
+    # // numeric columns, if possible; empty values are null
+    values = [None if isinstance(v, str) and v == "" else v for v in values]
+    present = [v for v in values if v is not None]
+    if all(
+        isinstance(v, (int, float, np.number)) and not isinstance(v, bool)
+        for v in present
+    ):
+        if all(isinstance(v, (int, np.integer)) for v in present):
+            return pl.Series(label, values, dtype=pl.Int64)
+        return pl.Series(label, values, dtype=pl.Float64)
+
+    return pl.Series(
+        label, [None if v is None else str(v) for v in values], dtype=pl.Utf8
+    )
 
 
 class RinfoFiles(object):
-    def __init__(self, files: List[str] = None):
+    # // rinfo files in the given files and directories
+    # // Directories are walked with os.scandir in a thread pool, and the
+    # // files are yielded as they are found. A file reached twice, e.g. by
+    # // overlapping directories or links, is yielded once, by its device
+    # // and inode. Hidden files and directories are skipped, as by glob.
+    # // include and exclude are fnmatch patterns matched against the file
+    # // name or the path; excluded directories are not walked.
+    def __init__(
+        self,
+        files: List[str] = None,
+        include: List[str] = None,
+        exclude: List[str] = None,
+        max_workers: int = None,
+    ):
         self.files = files or []
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        # // bound by the file system latency, rather than by the cores
+        self.max_workers = max_workers or min(16, (os.cpu_count() or 1) * 4)
 
-    def list_files(self) -> List[str]:
-        ret = []
-        for f in sorted(self.files):
-            if os.path.isfile(f) and f.endswith(".rinfo"):
-                ret.append(f)
+    @staticmethod
+    def __matches(path: str, patterns: List[str]):
+        name = os.path.basename(path)
+        return any(fnmatch(name, p) or fnmatch(path, p) for p in patterns)
 
+    def is_excluded(self, path: str):
+        return self.__matches(path, self.exclude)
+
+    def is_target(self, path: str):
+        if not path.endswith(".rinfo") or self.is_excluded(path):
+            return False
+        return len(self.include) == 0 or self.__matches(path, self.include)
+
+    def __scan(self, directory: str, walked: set, lock: threading.Lock):
+        # // ([(path, (device, inode))], subdirectories) of a directory
+        try:
+            stat = os.stat(directory)
+            with lock:
+                if (stat.st_dev, stat.st_ino) in walked:
+                    return [], []
+                walked.add((stat.st_dev, stat.st_ino))
+
+            files, directories = [], []
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir():
+                        if not self.is_excluded(entry.path):
+                            directories.append(entry.path)
+                    elif entry.is_file() and self.is_target(entry.path):
+                        # // the inode is known without a stat call, except
+                        # // for links
+                        if entry.is_symlink():
+                            s = entry.stat()
+                            key = (s.st_dev, s.st_ino)
+                        else:
+                            key = (stat.st_dev, entry.inode())
+                        files.append((entry.path, key))
+        except OSError:
+            return [], []
+
+        return files, directories
+
+    def iter_files(self) -> Iterator[str]:
+        # // in no particular order; see list_files()
+        found: set[Tuple[int, int]] = set()
+        walked: set[Tuple[int, int]] = set()
+        lock = threading.Lock()
+
+        directories = []
+        for f in sorted(str(f) for f in self.files):
             if os.path.isdir(f):
-                rinfo_list = sorted(
-                    glob.glob(f"{f}/**/*.rinfo", recursive=True)
-                )
-                ret.extend(rinfo_list)
+                if not self.is_excluded(f):
+                    directories.append(f)
+            elif os.path.isfile(f) and self.is_target(f):
+                stat = os.stat(f)
+                if (stat.st_dev, stat.st_ino) not in found:
+                    found.add((stat.st_dev, stat.st_ino))
+                    yield f
+
+        if len(directories) == 0:
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {
+                executor.submit(self.__scan, d, walked, lock)
+                for d in directories
+            }
+            try:
+                while len(pending) != 0:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        files, subdirectories = future.result()
+                        for d in subdirectories:
+                            pending.add(
+                                executor.submit(self.__scan, d, walked, lock)
+                            )
+                        for path, key in files:
+                            if key not in found:
+                                found.add(key)
+                                yield path
+            finally:
+                # // the walk is abandoned if the generator is closed
+                for future in pending:
+                    future.cancel()
 
-        return ret
+    def list_files(self) -> List[str]:
+        return sorted(self.iter_files())
 
 
 class ID_Object(str):
@@ -95,12 +228,15 @@ class Node(list):
 
         return self is other
 
-    def child_dictionary(self):
-        return {child.ID: child.dictionary() for child in self}
+    def child_dictionary(self, copy: bool = False):
+        return {child.ID: child.dictionary(copy=copy) for child in self}
 
-    def dictionary(self):
-        dictionary = {"#annotations": self.annotations}
-        dictionary.update(self.child_dictionary())
+    def dictionary(self, copy: bool = False):
+        # // copy: the annotations are copied, e.g. for writing on another
+        # // thread; their values are replaced, not modified, on editing
+        annotations = dict(self.annotations) if copy else self.annotations
+        dictionary = {"#annotations": annotations}
+        dictionary.update(self.child_dictionary(copy=copy))
         return dictionary
 
     def next_id(self):
@@ -201,7 +337,8 @@ class RootNode(Node):
 
         self.__raw_polyline = []
         self.__interpolated_polyline = []
-        self.__completed_polyline = []
+        # // None until completed; completed_polyline() completes it lazily
+        self.__completed_polyline = None
 
     def __getitem__(self, key: str):
         for k, v in self.annotations.items():
@@ -232,6 +369,20 @@ class RootNode(Node):
 
         return ID_Object(node.annotations["ID_string"])
 
+    def extend_relays(self, annotations_list: List[dict]):
+        # // bulk construction, e.g. on loading; the raw polyline is ordered
+        # // once, and the saved interpolation is reused
+        for annotations in annotations_list:
+            relayID = ID_Object(annotations["ID_string"]).relayID()
+            super().append(
+                RelayNode(relayID, parent=self, annotations=annotations)
+            )
+
+        if len(annotations_list) != 0:
+            self.__update_registered_pos_list()
+            self.__interpolated_polyline = self.annotations["polyline"]
+        self.__completed_polyline = None
+
     def parent(self):
         return self.__parent
 
@@ -262,16 +413,22 @@ class RootNode(Node):
         return [node.annotations["ID_string"] for node in self]
 
     def __reorder_polyline(self, polyline: List[List[int]]):
-        ordered = []
-        ordered.append(polyline.pop(0))
-        while len(polyline) != 0:
-            ref_node = np.array(ordered[-1])
-            closest_index = np.argmin(
-                [np.sum((np.array(node) - ref_node) ** 2) for node in polyline]
-            )
-            ordered.append(polyline.pop(closest_index))
-
-        return ordered
+        # // nearest neighbor ordering from the first node; ties are broken
+        # // by the order of the nodes
+        points = np.array(polyline, dtype=np.int64).reshape(-1, 3)
+        distances = np.empty(len(points), dtype=np.int64)
+        used = np.zeros(len(points), dtype=bool)
+
+        order = [0]
+        used[0] = True
+        for _ in range(len(points) - 1):
+            np.sum((points - points[order[-1]]) ** 2, axis=1, out=distances)
+            distances[used] = np.iinfo(np.int64).max
+            closest_index = int(np.argmin(distances))
+            order.append(closest_index)
+            used[closest_index] = True
+
+        return [polyline[i] for i in order]
 
     def __update_registered_pos_list(self):
         pos_list = [self.base_node()["coordinate"]]
@@ -285,11 +442,20 @@ class RootNode(Node):
     def RSA_components(self):
         return self.base_node().parent().RSA_components()
 
+    def raw_polyline(self):
+        return self.__raw_polyline
+
     def interpolate_polyline(self, interpolation_cls):
-        self.__interpolated_polyline = interpolation_cls(
-            self.RSA_components()
-        ).interpolate(self.__raw_polyline)
+        self.set_interpolated_polyline(
+            interpolation_cls(self.RSA_components()).interpolate(
+                self.__raw_polyline
+            )
+        )
+
+    def set_interpolated_polyline(self, polyline: List[List[int]]):
+        self.__interpolated_polyline = polyline
         self.annotations.update({"polyline": self.__interpolated_polyline})
+        self.__completed_polyline = None
 
     def interpolated_polyline(self):
         return self.__interpolated_polyline
@@ -318,7 +484,13 @@ class RootNode(Node):
                 complete(polyline[i], polyline[i + 1])
             )
 
+    def set_completed_polyline(self, polyline):
+        # // e.g. restored from the edit history
+        self.__completed_polyline = polyline
+
     def completed_polyline(self):
+        if self.__completed_polyline is None:
+            self.complete_polyline()
         return self.__completed_polyline
 
     def tip_coordinate(self):
@@ -474,13 +646,22 @@ class RSA_Vector(Node):
     def register_RSA_components(self, RSA_components):
         self.__RSA_components = RSA_components
 
-    def load_from_file(self, fname: str):
+    def load_from_file(self, fname: str, complete_polylines: bool = True):
         with open(fname, "r") as f:
             trace_dict = json.load(f)
 
-        return self.load_from_dict(trace_dict=trace_dict, file=fname)
+        return self.load_from_dict(
+            trace_dict=trace_dict,
+            file=fname,
+            complete_polylines=complete_polylines,
+        )
 
-    def load_from_dict(self, trace_dict: dict = {}, file=""):
+    def load_from_dict(
+        self, trace_dict: dict = {}, file="", complete_polylines: bool = True
+    ):
+        # // all nodes of a root are built first, and its polyline is
+        # // ordered once. Completion is skipped if complete_polylines is
+        # // False; completed_polyline() then completes it when called.
         try:
             general_annotations = trace_dict["#annotations"]
 
@@ -531,18 +712,14 @@ class RSA_Vector(Node):
                         ]
                     )
 
-                    for relayID in relayID_list:
-                        relay_dict = root_dict[f"{relayID}"]
-                        ID_string = ID_Object(
-                            relay_dict["#annotations"]["ID_string"]
-                        )
-                        root_node.append(
-                            annotations=relay_dict["#annotations"],
-                            interpolation=False,
-                            relayID=ID_string.relayID(),
-                        )
-
-                    root_node.complete_polyline()
+                    root_node.extend_relays(
+                        [
+                            root_dict[f"{relayID}"]["#annotations"]
+                            for relayID in relayID_list
+                        ]
+                    )
+                    if complete_polylines:
+                        root_node.complete_polyline()
 
             self.logger.info(f"[Loading succeeded] {file}")
             return True
@@ -550,7 +727,12 @@ class RSA_Vector(Node):
             self.logger.error(f"[Format error] {file}")
             return False
 
-    def save(self, rinfo_file_name: str):
+    def snapshot(self):
+        # // the dictionary to be written, e.g. by a worker thread
+        return self.dictionary(copy=True)
+
+    @staticmethod
+    def write(f, dictionary: dict):
         class encoder(json.JSONEncoder):
             def default(self, obj):
                 if isinstance(obj, np.integer):  # type: ignore
@@ -560,15 +742,92 @@ class RSA_Vector(Node):
                 else:
                     return super().default(obj)
 
+        json.dump(dictionary, f, cls=encoder)
+
+    def save(self, rinfo_file_name: str):
+        dictionary = self.dictionary()
         try:
-            with open(rinfo_file_name, "w") as j:
-                json.dump(self.dictionary(), j, cls=encoder)
+            atomic_write(rinfo_file_name, lambda f: self.write(f, dictionary))
             self.logger.info(f"[Saving succeeded] {rinfo_file_name}")
             return True
         except:  # noqa: E722
             self.logger.error(f"[Saving failed] {rinfo_file_name}")
             return False
 
+    def root_traits_table(self, root_traits):
+        # // the exportable root traits of all roots, evaluated in one pass
+        # // over the roots, as a table with the ID strings in the first
+        # // column
+        classes = [c for c in root_traits.class_container if c.exportable]
+        columns = {"ID string": []}
+        for class_ in classes:
+            if len(class_.sublabels) == 0:
+                columns[class_.label] = []
+            for sublabel in class_.sublabels:
+                columns[f"{class_.label}_{sublabel}"] = []
+
+        for base_node in self:
+            for root_node in base_node:
+                ID_string = root_node.ID_string()
+                columns["ID string"].append(str(ID_string))
+                for class_ in classes:
+                    value = class_(self, ID_string).value
+                    if len(class_.sublabels) == 0:
+                        columns[class_.label].append(value)
+                    for i, sublabel in enumerate(class_.sublabels):
+                        columns[f"{class_.label}_{sublabel}"].append(
+                            None if value is None else value[i]
+                        )
+
+        return pl.DataFrame([trait_series(k, v) for k, v in columns.items()])
+
+    @staticmethod
+    def write_root_traits(
+        f, table, format: str, volume_name: str, resolution: float
+    ):
+        # // f: a binary file; the volume is noted in the comment lines of
+        # // csv files, and in the columns of the others
+        if format == "csv":
+            comments = (
+                "# This file is a summary of root traits measured by "
+                "RSAtrace3D.\n"
+                f"# Volume name: {volume_name}, Resolution: {resolution}\n"
+            )
+            f.write(comments.encode())
+            table.write_csv(f)
+            return
+
+        table = table.select(
+            [
+                pl.col("ID string"),
+                pl.lit(str(volume_name)).alias("volume name"),
+                pl.lit(float(resolution)).alias("resolution [mm/voxel]"),
+                pl.exclude("ID string"),
+            ]
+        )
+        if format == "parquet":
+            table.write_parquet(f)
+        elif format == "arrow":
+            table.write_ipc(f)
+        else:
+            raise ValueError(f"Unknown file format: {format}")
+
+    def export_root_traits(
+        self, file_name: Union[str, Path], root_traits, format: str = None
+    ):
+        # // written at once; the GUI writes the table on a worker thread
+        format = format or root_traits_format(file_name)
+        table = self.root_traits_table(root_traits)
+        volume_name = self.annotations.volume_name()
+        resolution = self.annotations.resolution()
+        atomic_write(
+            file_name,
+            lambda f: self.write_root_traits(
+                f, table, format, volume_name, resolution
+            ),
+            mode="wb",
+        )
+
     def iter_all(self) -> Generator[ID_Object, None, None]:
         for base_node in self:
             yield base_node.ID_string()
@@ -576,3 +835,23 @@ class RSA_Vector(Node):
                 yield root_node.ID_string()
                 for relay_node in root_node:
                     yield relay_node.ID_string()
+
+
+def RSA_traits_table(RSA_vectors: List[RSA_Vector], RSA_traits):
+    # // exportable RSA traits of RSA vectors, as in the RSA summary window
+    # // The values are typed as the root traits, not formatted for display.
+    columns = {}
+    for class_ in RSA_traits.class_container:
+        if class_.exportable is False:
+            continue
+
+        traits = [class_(RSA_vector) for RSA_vector in RSA_vectors]
+        if len(class_.sublabels) == 0:
+            columns[class_.label] = [t.value for t in traits]
+        else:
+            for i, sublabel in enumerate(class_.sublabels):
+                columns[f"{class_.label}_{sublabel}"] = [
+                    None if t.value is None else t.value[i] for t in traits
+                ]
+
+    return pl.DataFrame([trait_series(k, v) for k, v in columns.items()])
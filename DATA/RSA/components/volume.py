@@ -1,16 +1,29 @@
+import itertools
 import logging
+import threading
 
 import numpy as np
 
+from modules.root_radius import RootRadiusEstimator
+
+# // a new generation is given whenever the volume data is set, so that the
+# // results cached for the data, e.g. by interpolations, are invalidated
+_generations = itertools.count()
+
 
 class Volume(object):
     def __init__(self, parent):
         super().__init__()
         self.logger = logging.getLogger(self.__class__.__name__)
+        self.__windows = threading.local()
         self.clear()
 
     def clear(self):
         self.data = None
+        self.pyramid = None
+        self.projections = None
+        self.__radius_estimator = None
+        self.generation = next(_generations)
         self.logger.debug("The volume data cleared.")
 
     def is_empty(self):
@@ -22,8 +35,89 @@ class Volume(object):
 
     def init_from_volume(self, volume):
         self.data = volume
+        self.pyramid = None
+        self.projections = None
+        self.__radius_estimator = None
+        self.generation = next(_generations)
         self.logger.debug("The volume data initialized.")
 
+    def set_pyramid(self, pyramid):
+        # // downsampled copies used for display only
+        self.pyramid = pyramid
+
+    def set_projections(self, projections):
+        # // [along z, along y, along x], kept for switching volumes
+        self.projections = projections
+
+    def radius_estimator(self):
+        # // created on demand, with the tiles of the distance transform
+        if self.data is None:
+            return None
+        if self.__radius_estimator is None:
+            self.__radius_estimator = RootRadiusEstimator(self.data)
+        return self.__radius_estimator
+
+    def get_window(self, center, radius):
+        # // a cube around the center, zero-padded out of the volume
+        # // The buffer is reused by each thread, so that the window is valid
+        # // until the next call only.
+        S = radius * 2 + 1
+        buffers = self.__windows.__dict__.setdefault("buffers", {})
+        key = (S, self.data.dtype)
+        window = buffers.get(key, None)
+        if window is None:
+            window = np.zeros((S, S, S), dtype=self.data.dtype)
+            buffers[key] = window
+
+        pos = [int(round(i)) for i in center]
+        lower = [max(p - radius, 0) for p in pos]
+        upper = [min(p + radius + 1, s) for p, s in zip(pos, self.data.shape)]
+        if any(lo >= up for lo, up in zip(lower, upper)):
+            window.fill(0)
+            return window
+
+        src = tuple(slice(lo, up) for lo, up in zip(lower, upper))
+        dst = tuple(
+            slice(lo - p + radius, up - p + radius)
+            for lo, up, p in zip(lower, upper, pos)
+        )
+        if any(lo != p - radius for lo, p in zip(lower, pos)) or any(
+            up != p + radius + 1 for up, p in zip(upper, pos)
+        ):
+            window.fill(0)
+        window[dst] = self.data[src]
+
+        return window
+
+    def snap_to_center(self, coordinate, radius: int = 4, iterations: int = 5):
+        # // moves a clicked coordinate to the local intensity centroid
+        # // Voxels in a ball brighter than the threshold of the volume are
+        # // weighted, and the centroid is followed a few times.
+        if self.data is None:
+            return coordinate
+        threshold = self.radius_estimator().threshold()
+
+        S = radius * 2 + 1
+        offsets = np.indices((S, S, S)).reshape(3, -1).T - radius
+        in_ball = np.sum(offsets**2, axis=1) <= radius**2
+        offsets = offsets[in_ball]
+
+        upper = np.array(self.data.shape[:3]) - 1
+        pos = np.clip(np.array(coordinate, dtype=np.int64), 0, upper)
+        for _ in range(iterations):
+            window = self.get_window(pos, radius).reshape(-1)[in_ball]
+            weights = np.maximum(window.astype(np.float32) - threshold, 0)
+            total = weights.sum()
+            if total == 0:
+                break
+
+            shift = np.rint(weights @ offsets / total).astype(np.int64)
+            if not shift.any():
+                break
+            pos = np.clip(pos + shift, 0, upper)
+
+        return [int(v) for v in pos]
+
     def get_trimmed_volume(self, center, radius):
         if self.data is not None:
             S = radius * 2 + 1
@@ -1,14 +1,18 @@
 from pathlib import Path
 
+from PySide6.QtCore import QTimer
 from PySide6.QtWidgets import QApplication
 
 from .components import QtMain
 
 
-def start(volume_path: Path = None):
+def start(volume_path: Path = None, startup_profiler=None):
     app = QApplication([])
     main = QtMain()
     main.show()
+    if startup_profiler is not None:
+        # // reported once the event loop has drawn the main window
+        QTimer.singleShot(0, startup_profiler.report)
     if volume_path:
-        main.load_from(volume_path=volume_path)
+        main.load_from(vol_parent_path=volume_path)
     app.exec_()
@@ -0,0 +1,103 @@
+import logging
+import queue
+import threading
+from collections import deque
+from pathlib import Path
+from typing import IO, Callable
+
+from PySide6.QtCore import QThread, Signal
+
+from modules.atomic_write import atomic_write
+
+
+class WriteJob(object):
+    def __init__(
+        self,
+        path: Path,
+        write: Callable[[IO], None],
+        on_written: Callable[["WriteJob"], None] = None,
+        **open_kwargs,
+    ):
+        self.path = Path(path)
+        self.write = write
+        self.on_written = on_written
+        self.open_kwargs = open_kwargs
+        self.error = None
+
+
+class QtFileWriter(QThread):
+    # // writes files on a worker thread, in the order submitted
+    # // The data must be a snapshot, which is not modified afterward. Each
+    # // file is written atomically, and on_written is called on the GUI
+    # // thread with the job, whose error is None on success.
+    written = Signal()
+
+    def __init__(self, progressbar_signal: Signal):
+        super().__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.progressbar_signal = progressbar_signal
+        self.__queue: "queue.Queue[WriteJob]" = queue.Queue()
+        self.__done: "deque[WriteJob]" = deque()
+        self.__lock = threading.Lock()
+        self.__submitted = 0
+        self.__completed = 0
+        self.written.connect(self.__deliver)
+
+    def submit(
+        self,
+        path: Path,
+        write: Callable[[IO], None],
+        on_written: Callable[[WriteJob], None] = None,
+        **open_kwargs,
+    ):
+        with self.__lock:
+            self.__submitted += 1
+        self.__queue.put(WriteJob(path, write, on_written, **open_kwargs))
+        if not self.isRunning():
+            self.start()
+
+    def stop(self):
+        # // the pending files are written first
+        if self.isRunning():
+            self.__queue.put(None)
+            self.wait()
+        self.__deliver()
+
+    def run(self):
+        while True:
+            job = self.__queue.get()
+            if job is None:
+                return
+
+            with self.__lock:
+                i, total = self.__completed, self.__submitted
+            self.progressbar_signal.emit(
+                i, total, f"[saving] {job.path.name} ({i + 1} / {total})"
+            )
+            try:
+                atomic_write(job.path, job.write, **job.open_kwargs)
+            except Exception as e:
+                job.error = e
+
+            with self.__lock:
+                self.__completed += 1
+                i, total = self.__completed, self.__submitted
+                if i == total:
+                    self.__completed = self.__submitted = 0
+            result = "failed" if job.error else "succeeded"
+            self.progressbar_signal.emit(
+                i, total, f"[Saving {result}] {job.path.name}"
+            )
+
+            self.__done.append(job)
+            self.written.emit()
+
+    def __deliver(self):
+        while len(self.__done) != 0:
+            job = self.__done.popleft()
+            if job.error is None:
+                self.logger.info(f"[Saving succeeded] {job.path}")
+            else:
+                self.logger.error(f"[Saving failed] {job.path}: {job.error}")
+            if job.on_written is not None:
+                job.on_written(job)
@@ -1,23 +1,42 @@
 import json
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import numpy as np
-import polars as pl
 from PySide6.QtCore import QEvent, Qt, QThread, Signal
 from PySide6.QtGui import QColor, QKeyEvent
 from PySide6.QtWidgets import QApplication, QMainWindow, QMessageBox, QSplitter
-from skimage import io
 
 import config
 from DATA.RSA import RSA_Components
 from DATA.RSA.components.file import File
 from DATA.RSA.components.rinfo import ID_Object, RootNode
-from data_modules.df_for_drawing import get_dilate_df
+from data_modules.drawing_cache import DrawingCache, drawing_cache_path
+from data_modules.edit_history import EditHistory, EditState
+from data_modules.edit_journal import (
+    EditJournal,
+    file_fingerprint,
+    journal_path,
+    read_journal,
+    replay_journal,
+)
+from data_modules.render_state import RenderState
+from data_modules.root_voxels import RootVoxels
 from mod import Extensions, Interpolation, RootTraits, RSATraits
-from modules.volume import VolumeLoader
-
+from modules.projection import StreamingProjection, project
+from modules.pyramid import VolumePyramid
+from modules.skeleton import SkeletonGraph, VolumeSkeletonizer
+from modules.volume import (
+    allocate_shared_buffers,
+    default_worker_count,
+    get_volume_loader,
+    is_volume_file,
+)
+
+from .QtFileWriter import QtFileWriter
 from .QtMenubar import QtMenubar
 from .QtProjectionView import QtProjectionView
 from .QtSliceView import QtSliceView
@@ -49,10 +68,29 @@ class QtMain(QMainWindow):
         self.root_traits = RootTraits()
         self.RSA_traits = RSATraits()
         self.extensions = Extensions(parent=self)
-        self.df_dict_for_drawing: dict[str, pl.DataFrame] = {}
+        # // ID_string -> {"voxels": RootVoxels, "color": rgba, "key": str}
+        self.df_dict_for_drawing: dict[str, dict] = {}
+        self.volume_loader: QtVolumeLoader = None
+        # // raw polylines when tracing started, while the volume is loaded
+        self.raw_polylines_in_loading: dict = None
+        self.pyramid_builders: list[QtPyramidBuilder] = []
+        self.drawing_cache = DrawingCache()
+        self.geometry_builders: list[QtDrawingGeometryBuilder] = []
+        self.skeleton: SkeletonGraph = None
+        self.skeleton_builders: list[QtSkeletonBuilder] = []
+        self.render_state = RenderState()
+        self.edit_history = EditHistory()
+        self.journal = EditJournal()
+        # // set when the geometry changed without a color change
+        self.is_drawing_dirty = False
         self.__RSA_components = RSA_Components(parent=self)
         self.__GUI_components = GUI_Components(parent=self)
         self.setStatusBar(self.GUI_components().statusbar.widget)
+        self.file_writer = QtFileWriter(
+            progressbar_signal=(
+                self.GUI_components().statusbar.pyqtSignal_update_progressbar
+            )
+        )
 
         self.init_interface()
         self.setAcceptDrops(True)
@@ -84,9 +122,11 @@ class QtMain(QMainWindow):
         config_dict = config.load()
         resolution = float(config_dict.get("resolution", 0.3))
         interpolation_name = config_dict.get("interpolation", "Straigth")
+        snap_to_center = bool(config_dict.get("snap to root center", False))
 
         self.set_resolution(resolution=resolution)
         self.interpolation.set_selected_by(label=interpolation_name)
+        self.menubar.act_snap_to_center.setChecked(snap_to_center)
 
     def save_config(self):
         config_dict = {
@@ -94,6 +134,7 @@ class QtMain(QMainWindow):
                 self.GUI_components().toolbar.voxel_lineedit.text()
             ),
             "interpolation": self.interpolation.get_selected_label(),
+            "snap to root center": self.menubar.act_snap_to_center.isChecked(),
         }
         config.save(**config_dict)
 
@@ -168,26 +209,37 @@ class QtMain(QMainWindow):
             return False
 
         vol_parent_path = Path(flist[0])
-        if not vol_parent_path.is_dir():
-            self.logger.error("Indicate directory path.")
+        if not vol_parent_path.is_dir() and not is_volume_file(
+            vol_parent_path
+        ):
+            self.logger.error("Indicate directory path or volume file.")
             return False
 
         return self.load_from(vol_parent_path)
 
+    def is_loading(self):
+        return self.volume_loader is not None
+
     def load_from(self, vol_parent_path: Path, rinfo_dict: dict = {}):
-        self.set_control(locked=True)
         statusbar = self.GUI_components().statusbar
+        if self.is_loading():
+            self.logger.error("Another volume is being loaded.")
+            return False
 
-        vl = VolumeLoader(vol_parent_path)
+        vol_parent_path = Path(vol_parent_path)
         vol_paths: list[Path] = []
-        if vl.is_valid_volume():
+        if vol_parent_path.is_file():
+            if is_volume_file(vol_parent_path):
+                vl = get_volume_loader(vol_parent_path)
+                if vl.is_valid_volume():
+                    vol_paths = [vol_parent_path]
+        elif get_volume_loader(vol_parent_path).is_valid_volume():
             vol_paths = [vol_parent_path]
         else:
-            vol_paths: list[Path] = []
             for d in sorted(os.listdir(vol_parent_path)):
                 d = Path(vol_parent_path, d)
-                if d.is_dir():
-                    vl = VolumeLoader(d)
+                if d.is_dir() or is_volume_file(d):
+                    vl = get_volume_loader(d)
                     if vl.is_valid_volume():
                         vol_paths.append(d)
 
@@ -195,28 +247,74 @@ class QtMain(QMainWindow):
             self.logger.error("No volume directories.")
             return False
 
-        self.volume_loader = QtVolumeLoader(
-            volume_paths=vol_paths,
-            progressbar_signal=statusbar.pyqtSignal_update_progressbar,
-        )
+        self.set_control(locked=True)
 
         VolumeFile = File(volume_path=str(vol_parent_path))
         self.rinfo_dict = rinfo_dict
         self.close_volume()
         self.RSA_components().file = VolumeFile
 
+        self.volume_loader = QtVolumeLoader(
+            volume_paths=vol_paths,
+            progressbar_signal=statusbar.pyqtSignal_update_progressbar,
+        )
+        self.volume_loader.pyqtSignal_first_slices_loaded.connect(
+            self.on_first_slices_loaded
+        )
+        self.volume_loader.pyqtSignal_projections_updated.connect(
+            self.on_loading_projections_updated
+        )
         self.volume_loader.finished.connect(self.on_volume_loaded)
         self.volume_loader.start()
         self.menubar.history.add(str(vol_parent_path))
         self.menubar.history.update_menu()
 
+    def on_first_slices_loaded(self):
+        # // the first volume is shown and can be traced while the rest of
+        # // the slices are still being loaded
+        np_vol, vol_info, label = self.volume_loader.first_volume()
+        self.show_volume(
+            np_vol=np_vol,
+            vol_info=vol_info,
+            label=label,
+            projections=self.volume_loader.projections(index=0),
+        )
+
+    def on_loading_projections_updated(self):
+        if self.volume_loader is None:
+            return
+        if self.RSA_components().volume.is_empty():
+            return
+
+        projections = self.volume_loader.projections(index=0)
+        if projections is not None:
+            self.projectionview.refresh_projections(projections)
+        self.sliceview.refresh_slice()
+
     def on_volume_loaded(self):
-        file_instance = self.RSA_components().file
-        self.set_volume_name(file_instance.volume_name)
+        volume_loader = self.volume_loader
+        self.volume_loader = None
+
+        if volume_loader.error is not None:
+            # // the slices decoded so far are not kept, as the rest are
+            # // zeros
+            self.logger.error(
+                f"[Loading failed] {self.RSA_components().file.volume_path}:"
+                f" {volume_loader.error}"
+            )
+            self.close_volume()
+            self.set_control(locked=False)
+            self.show_default_msg_in_statusbar()
+            return
 
-        np_vols, vol_infos, labels = self.volume_loader.data()
-        self.set_resolution(vol_infos[0].get("mm_resolution", 0.3))
-        del self.volume_loader
+        np_vols, vol_infos, labels = volume_loader.data()
+        if self.RSA_components().volume.is_empty():
+            self.show_volume(
+                np_vol=np_vols[0],
+                vol_info=vol_infos[0],
+                label=labels[0],
+                projections=volume_loader.projections(index=0),
+            )
 
         self.logger.info(
             f"[Loading succeeded] {self.RSA_components().file.volume_path}"
@@ -226,8 +324,81 @@ class QtMain(QMainWindow):
             np_vols=np_vols,
             labels=labels,
         )
-        self.sliceview.set_volume(volume=np_vols[0])
-        self.projectionview.set_volume(volume=np_vols[0])
+        edited_ID_strings = self.roots_edited_in_loading()
+        for i, volume in enumerate(self.RSA_components().volumes):
+            volume.set_projections(volume_loader.projections(index=i))
+            volume.set_pyramid(volume_loader.pyramid(index=i))
+
+        projections = volume_loader.projections(index=0)
+        if projections is not None:
+            self.projectionview.refresh_projections(projections)
+        self.sliceview.refresh_slice()
+        self.build_pyramids()
+
+        if self.is_skeleton_shown():
+            self.build_skeleton()
+
+        # // the roots are drawn by their radii, once the volume is loaded
+        self.drawing_cache.radius_estimator = (
+            self.RSA_components().volumes[0].radius_estimator()
+        )
+        self.update_df_dict_for_drawing_all()
+        self.on_selected_item_changed(
+            selected_ID_string=self.selected_ID_string
+        )
+
+        # // the actions reading the volume are enabled
+        self.menubar.update()
+        self.show_default_msg_in_statusbar()
+
+        # // the roots traced over the slices not yet decoded are
+        # // interpolated again, with the interpolation they were traced with
+        interpolation_cls = self.RSA_vector.interpolation.get(
+            label=self.RSA_vector.annotations.interpolation()
+        )
+        if len(edited_ID_strings) != 0 and getattr(
+            interpolation_cls, "requires_volume", True
+        ):
+            self.logger.info(
+                f"[Re-interpolating] {len(edited_ID_strings)} roots traced"
+                " while loading"
+            )
+            self.menubar.reinterpolate(
+                interpolation_cls, ID_strings=edited_ID_strings
+            )
+
+    def raw_polylines(self):
+        return {
+            root_node.ID_string(): root_node.raw_polyline()
+            for base_node in self.RSA_vector
+            for root_node in base_node
+        }
+
+    def roots_edited_in_loading(self):
+        # // the roots added or changed since tracing started
+        if self.raw_polylines_in_loading is None:
+            return []
+
+        previous = self.raw_polylines_in_loading
+        self.raw_polylines_in_loading = None
+        return [
+            ID_string
+            for ID_string, raw_polyline in self.raw_polylines().items()
+            if previous.get(ID_string, None) != raw_polyline
+        ]
+
+    def show_volume(self, np_vol, vol_info: dict, label: str, projections):
+        file_instance = self.RSA_components().file
+        self.set_volume_name(file_instance.volume_name)
+        self.set_resolution(vol_info.get("mm_resolution", 0.3))
+
+        self.RSA_components().set_volumes(
+            np_vols=[np_vol],
+            labels=[label],
+        )
+        self.sliceview.set_volume(volume=np_vol)
+        self.projectionview.set_volume(volume=np_vol, projections=projections)
+        self.drawing_cache = DrawingCache(volume_shape=np_vol.shape[:3])
 
         loaded = False
         if self.rinfo_dict:
@@ -264,27 +435,111 @@ class QtMain(QMainWindow):
             self.RSA_vector.annotations.set_interpolation(
                 interpolation.get_selected_label()
             )
-            self.RSA_vector.annotations.set_volume_shape(np_vols[0].shape)
+            self.RSA_vector.annotations.set_volume_shape(np_vol.shape)
 
+        self.edit_history.reset(self.RSA_vector)
+        self.start_journal(rinfo_loaded=loaded and not self.rinfo_dict)
+        if self.is_loading():
+            self.raw_polylines_in_loading = self.raw_polylines()
         self.set_control(locked=False)
 
         self.show_default_msg_in_statusbar()
         self.setWindowTitle()
         self.menubar.update()
 
+    def build_pyramids(self):
+        # // downsampled volumes for zoomed-out navigation are built in
+        # // the background; full resolution is shown until they are ready
+        # // builders are kept until they finish, even if another volume
+        # // is opened in the meantime
+        builder = QtPyramidBuilder(volumes=self.RSA_components().volumes)
+        builder.finished.connect(self.on_pyramids_built)
+        self.pyramid_builders.append(builder)
+        builder.start()
+
+    def on_pyramids_built(self):
+        builder = self.sender()
+        if builder not in self.pyramid_builders:
+            return
+        self.pyramid_builders.remove(builder)
+
+        for volume, pyramid in zip(builder.volumes, builder.pyramids):
+            volume.set_pyramid(pyramid)
+
+        current_volume = self.RSA_components().volume
+        if current_volume in builder.volumes:
+            self.sliceview.set_pyramid(current_volume.pyramid)
+
+    def is_skeleton_shown(self):
+        return self.menubar.act_show_skeleton.isChecked()
+
+    def set_skeleton_shown(self, shown: bool):
+        if shown and self.skeleton is None:
+            self.build_skeleton()
+        self.sliceview.update_slice_layer()
+
+    def build_skeleton(self):
+        # // the skeleton of the first volume is built in the background,
+        # // once the volume is loaded
+        if self.is_loading() or self.RSA_components().volume.is_empty():
+            return
+
+        volume = self.RSA_components().volumes[0].data
+        for builder in self.skeleton_builders:
+            if builder.skeletonizer.volume is volume:
+                return
+
+        statusbar = self.GUI_components().statusbar
+        builder = QtSkeletonBuilder(
+            volume=volume,
+            progressbar_signal=statusbar.pyqtSignal_update_progressbar,
+        )
+        builder.finished.connect(self.on_skeleton_built)
+        self.skeleton_builders.append(builder)
+        builder.start()
+
+    def on_skeleton_built(self):
+        builder = self.sender()
+        if builder not in self.skeleton_builders:
+            return
+        self.skeleton_builders.remove(builder)
+
+        if builder.error is not None:
+            self.logger.error(f"[Skeletonization failed] {builder.error}")
+            return
+        if self.RSA_components().volume.is_empty():
+            return
+        if builder.skeletonizer.volume is not (
+            self.RSA_components().volumes[0].data
+        ):
+            return
+
+        self.skeleton = builder.skeletonizer.graph
+        self.logger.info(f"[Skeleton built] {len(self.skeleton)} voxels")
+        self.sliceview.update_slice_layer()
+
+    def snap_coordinate(self, coordinate):
+        # // clicks are snapped to the skeleton while it is shown, or else
+        # // to the root center if selected
+        if self.skeleton is not None and self.is_skeleton_shown():
+            node = self.skeleton.nearest_node(coordinate, max_distance=3)
+            if node is not None:
+                return node
+        # // not snapped while loading, as the threshold of the volume is not
+        # // known until then
+        if (
+            self.menubar.act_snap_to_center.isChecked()
+            and not self.is_loading()
+        ):
+            return self.RSA_components().volume.snap_to_center(coordinate)
+        return coordinate
+
     def load_rinfo_from_dict(self, rinfo_dict: dict, file: str = ""):
         ret = self.RSA_vector.load_from_dict(rinfo_dict, file=file)
         if ret is False:
             return False
 
-        for ID_string in self.RSA_vector.iter_all():
-            if ID_string.is_base():
-                self.treeview.add_base(ID_string=ID_string)
-            elif ID_string.is_root():
-                self.treeview.add_root(ID_string=ID_string)
-            else:
-                self.treeview.add_relay(ID_string=ID_string)
-
+        self.rebuild_treeview()
         self.set_volume_name(
             volume_name=self.RSA_vector.annotations.volume_name()
         )
@@ -292,6 +547,9 @@ class QtMain(QMainWindow):
             resolution=self.RSA_vector.annotations.resolution()
         )
 
+        self.drawing_cache.load(
+            drawing_cache_path(self.RSA_components().file.rinfo_file)
+        )
         self.update_df_dict_for_drawing_all()
         self.on_selected_item_changed(
             selected_ID_string=self.selected_ID_string
@@ -305,8 +563,117 @@ class QtMain(QMainWindow):
 
         return self.load_rinfo_from_dict(trace_dict, file=fname)
 
+    def rebuild_treeview(self):
+        self.treeview.clear()
+        for ID_string in self.RSA_vector.iter_all():
+            if ID_string.is_base():
+                self.treeview.add_base(ID_string=ID_string)
+            elif ID_string.is_root():
+                self.treeview.add_root(ID_string=ID_string)
+            else:
+                self.treeview.add_relay(ID_string=ID_string)
+
+    def record_edit(self, label: str):
+        # // called after each node operation
+        previous = self.edit_history.current()
+        self.edit_history.push(self.RSA_vector, label=label)
+        self.journal.record(previous, self.edit_history.current(), label)
+        self.menubar.update()
+
+    def undo(self):
+        previous = self.edit_history.current()
+        state, label = self.edit_history.undo()
+        if state is not None:
+            self.restore_edit_state(state, message=f"[Undo] {label}")
+            self.journal.record(previous, state, f"undo {label}")
+
+    def redo(self):
+        previous = self.edit_history.current()
+        state, label = self.edit_history.redo()
+        if state is not None:
+            self.restore_edit_state(state, message=f"[Redo] {label}")
+            self.journal.record(previous, state, f"redo {label}")
+
+    def start_journal(self, rinfo_loaded: bool):
+        # // the journal is based on the rinfo file if loaded from it
+        rinfo_file = self.RSA_components().file.rinfo_file
+        base = file_fingerprint(rinfo_file) if rinfo_loaded else None
+        path = journal_path(rinfo_file)
+        recovered = self.recover_journal(path, base=base)
+        self.journal.start(
+            path, self.edit_history.current(), base=base, append=recovered
+        )
+
+    def restart_journal(self, state: EditState):
+        # // after saving the state; the operations since then are kept
+        rinfo_file = self.RSA_components().file.rinfo_file
+        self.journal.start(
+            journal_path(rinfo_file),
+            state,
+            base=file_fingerprint(rinfo_file),
+        )
+
+    def recover_journal(self, path: Path, base) -> bool:
+        header, records = read_journal(path)
+        if header is None or len(records) == 0:
+            return False
+
+        # // a journal on top of another rinfo file is put aside
+        if header["base"] is not None and header["base"] != base:
+            os.replace(path, f"{path}.old")
+            self.logger.warning(f"[Journal outdated] {path}")
+            return False
+
+        if config.ALWAYS_YES:
+            recover = True
+        else:
+            ret = QMessageBox.information(
+                None,
+                "Information",
+                "Unsaved operations were found in the autosave journal. "
+                "Do you want to recover them?",
+                QMessageBox.Yes,
+                QMessageBox.No,
+            )
+            recover = ret == QMessageBox.Yes
+        if not recover:
+            return False
+
+        state = replay_journal(records, self.edit_history.current())
+        self.restore_edit_state(
+            state, message=f"[Recovery succeeded] {len(records)} in {path}"
+        )
+        self.edit_history.reset(self.RSA_vector)
+        return True
+
+    def restore_edit_state(self, state: EditState, message: str):
+        # // the polylines are restored without interpolation, and the
+        # // unchanged roots are drawn from the drawing cache
+        selected_ID_string = self.selected_ID_string
+        self.set_control(locked=True)
+        EditHistory.restore(self.RSA_vector, state)
+        self.rebuild_treeview()
+        if (
+            selected_ID_string is not None
+            and self.RSA_vector[selected_ID_string] is not None
+        ):
+            self.treeview.select(ID_string=selected_ID_string)
+
+        self.update_df_dict_for_drawing_all()
+        self.set_control(locked=False)
+        self.on_selected_item_changed(
+            selected_ID_string=self.selected_ID_string
+        )
+        self.menubar.update()
+        self.logger.info(message)
+
     def keyPressEvent(self, ev: QKeyEvent):
         ev.accept()
+        if ev.key() == Qt.Key_Escape and not ev.isAutoRepeat():
+            # // a running export can be cancelled while locked
+            self.menubar.cancel_export()
+            return
+
         if self.is_control_locked():
             return
 
@@ -344,6 +711,7 @@ class QtMain(QMainWindow):
                 self.treeview.select(ID_string=ID_string)
                 target_node.delete()
                 self.treeview.delete(ID_string=ID_string)
+                self.is_drawing_dirty = True
                 if ID_string.is_base():
                     target_ID_strings = [
                         ID_Object(k) for k in self.df_dict_for_drawing.keys()
@@ -355,7 +723,8 @@ class QtMain(QMainWindow):
                         ):
                             del self.df_dict_for_drawing[target_ID_string]
                 elif ID_string.is_root():
-                    del self.df_dict_for_drawing[ID_string]
+                    # // not drawn yet, if dilated in the background
+                    self.df_dict_for_drawing.pop(ID_string, None)
                 else:
                     self.update_df_dict_for_drawing(
                         target_ID_string=ID_string.to_root()
@@ -364,6 +733,7 @@ class QtMain(QMainWindow):
                 self.on_selected_item_changed(
                     selected_ID_string=self.selected_ID_string
                 )
+                self.record_edit("delete")
                 self.set_control(False)
 
         return
@@ -381,9 +751,15 @@ class QtMain(QMainWindow):
             self.logger.debug("[key released] Ctrl+Tab")
             if not self.RSA_components().volume.is_empty():
                 self.RSA_components().shift_current_volume()
-                self.sliceview.update_volume(self.RSA_components().volume.data)
+                volume = self.RSA_components().volume
+                # // projections are computed once per volume
+                if volume.projections is None:
+                    volume.set_projections(project(volume.data, "max"))
+                self.sliceview.update_volume(
+                    volume.data, pyramid=volume.pyramid
+                )
                 self.projectionview.update_volume(
-                    self.RSA_components().volume.data
+                    volume.data, projections=volume.projections
                 )
 
         if ev.key() == Qt.Key_Space and not ev.isAutoRepeat():
@@ -411,6 +787,19 @@ class QtMain(QMainWindow):
 
         self.extensions.destroy_instance()
 
+        if self.volume_loader is not None:
+            self.volume_loader.wait()
+        for builder in (
+            self.pyramid_builders
+            + self.geometry_builders
+            + self.skeleton_builders
+        ):
+            builder.wait()
+        if self.menubar.reinterpolator is not None:
+            self.menubar.reinterpolator.wait()
+        self.file_writer.stop()
+        self.journal.stop()
+
         self.GUI_components().statusbar.thread.quit()
         self.GUI_components().statusbar.thread.wait()
 
@@ -419,8 +808,17 @@ class QtMain(QMainWindow):
     def close_volume(self):
         if self.RSA_components().volume.is_empty():
             return
+        if self.is_loading():
+            self.logger.error("The volume is being loaded.")
+            return
 
         self.df_dict_for_drawing.clear()
+        self.drawing_cache = DrawingCache()
+        self.raw_polylines_in_loading = None
+        self.skeleton = None
+        self.render_state.clear()
+        self.edit_history.clear()
+        self.journal.stop()
         self.sliceview.update_slice_layer()
         self.RSA_components().clear()
         self.sliceview.clear()
@@ -453,132 +851,337 @@ class QtMain(QMainWindow):
             text = f"{text} - {volume_path}"
         super().setWindowTitle(text)
 
+    def drawing_size(self):
+        # // None for the root radii, which are available after loading
+        if self.drawing_cache.radius_estimator is None:
+            return 3
+        return None
+
     def update_df_dict_for_drawing_all(self):
+        # // cached roots are drawn at once, and the others are dilated in
+        # // the background, where the radii of all roots are measured
         self.df_dict_for_drawing.clear()
+        self.is_drawing_dirty = True
+        size = self.drawing_size()
+        polylines = {}
+        measured_polylines = []
         for base_node in self.RSA_vector:
             for root_node in base_node:
-                self.update_df_dict_for_drawing(
-                    target_ID_string=root_node.ID_string()
-                )
+                ID_string = root_node.ID_string()
+                polyline = root_node.completed_polyline()
+                key = self.drawing_cache.key_of(polyline, size=size)
+                voxels = self.drawing_cache.get(key)
+                if voxels is None:
+                    polylines[ID_string] = polyline
+                else:
+                    self.set_df_for_drawing(ID_string, key=key, voxels=voxels)
+                if size is None:
+                    measured_polylines.append(polyline)
+
+        if len(polylines) != 0 or len(measured_polylines) != 0:
+            statusbar = self.GUI_components().statusbar
+            builder = QtDrawingGeometryBuilder(
+                cache=self.drawing_cache,
+                polylines=polylines,
+                size=size,
+                measured_polylines=measured_polylines,
+                progressbar_signal=statusbar.pyqtSignal_update_progressbar,
+            )
+            builder.finished.connect(self.on_drawing_geometry_built)
+            self.geometry_builders.append(builder)
+            builder.start()
+
+    def on_drawing_geometry_built(self):
+        builder = self.sender()
+        if builder not in self.geometry_builders:
+            return
+        self.geometry_builders.remove(builder)
+        if builder.cache is not self.drawing_cache:
+            return
+
+        # // roots edited or deleted in the meantime are skipped
+        size = self.drawing_size()
+        results = {}
+        for ID_string, (key, voxels) in builder.results.items():
+            root_node = self.RSA_vector[ID_string]
+            if not isinstance(root_node, RootNode):
+                continue
+            polyline = root_node.completed_polyline()
+            if self.drawing_cache.key_of(polyline, size=size) == key:
+                results[ID_string] = {"key": key, "voxels": voxels}
+
+        # // the drawing order follows the rinfo
+        entries = self.df_dict_for_drawing.copy()
+        self.df_dict_for_drawing.clear()
+        for base_node in self.RSA_vector:
+            for root_node in base_node:
+                ID_string = root_node.ID_string()
+                if ID_string in entries:
+                    self.df_dict_for_drawing[ID_string] = entries[ID_string]
+                elif ID_string in results:
+                    self.set_df_for_drawing(ID_string, **results[ID_string])
+
+        self.save_drawing_cache()
+        if len(builder.measured_polylines) != 0:
+            self.treeview.update_all_text()
+        self.is_drawing_dirty = True
+        self.on_selected_item_changed(
+            selected_ID_string=self.selected_ID_string
+        )
+
+    def save_drawing_cache(self):
+        # // kept next to the rinfo file, for the roots currently drawn
+        rinfo_file = self.RSA_components().file.rinfo_file
+        if not os.path.isfile(rinfo_file):
+            return
+
+        keys = [vars["key"] for vars in self.df_dict_for_drawing.values()]
+        self.drawing_cache.save(drawing_cache_path(rinfo_file), keys=keys)
+        self.drawing_cache.compact(keys)
+
+    def set_df_for_drawing(
+        self, ID_string: ID_Object, key: str, voxels: RootVoxels
+    ):
+        # // the voxels are a view of the drawing cache, shared by the slice
+        # // view, the projection view, and the trace export
+        color = QColor("#8800ff00").getRgb()
+        self.df_dict_for_drawing.update(
+            {ID_string: {"voxels": voxels, "color": color, "key": key}}
+        )
+        self.is_drawing_dirty = True
+        self.logger.debug(f"df_dict_for_drawing was updated: {ID_string}")
 
     def update_df_dict_for_drawing(self, target_ID_string: ID_Object):
         target_node = self.RSA_vector[target_ID_string]
 
         if isinstance(target_node, RootNode):
-            polyline = np.array(target_node.completed_polyline())
-
-            z_array = polyline[:, 0]
-            y_array = polyline[:, 1]
-            x_array = polyline[:, 2]
-            size = 3
-            color = QColor("#8800ff00").getRgb()
-            df = pl.DataFrame(
-                (
-                    pl.Series("z", z_array, dtype=pl.Int64),
-                    pl.Series("y", y_array, dtype=pl.Int64),
-                    pl.Series("x", x_array, dtype=pl.Int64),
-                    pl.Series("size", [size] * len(x_array), dtype=pl.Int64),
-                )
-            )
-
-            df = get_dilate_df(df, self.RSA_components().volume.data)
-
-            self.df_dict_for_drawing.update(
-                {target_ID_string: {"df": df, "color": color}}
-            )
-            self.logger.debug(
-                f"df_dict_for_drawing was updated: {target_ID_string}"
+            polyline = target_node.completed_polyline()
+            key, voxels = self.drawing_cache.dilate(
+                polyline, size=self.drawing_size()
             )
+            self.set_df_for_drawing(target_ID_string, key=key, voxels=voxels)
 
     def on_selected_item_changed(self, selected_ID_string: ID_Object):
         self.logger.debug(f"selected item changed: {selected_ID_string}")
 
-        modified_df_dict = {}
-        for ID_string, vars in self.df_dict_for_drawing.items():
-            df = vars["df"]
-            ID_string = ID_Object(ID_string)
-            if ID_string.baseID() != selected_ID_string.baseID():
-                color = QColor(config.COLOR_SELECTED_ROOT).getRgb()[0:3] + (
-                    40,
-                )
-            elif (
-                not selected_ID_string.is_base()
-                and ID_string == selected_ID_string.to_root()
-            ):
-                color = QColor(config.COLOR_SELECTED_ROOT).getRgb()[0:3] + (
-                    150,
-                )
-            else:
-                color = QColor(config.COLOR_ROOT).getRgb()[0:3] + (150,)
-
-            modified_df_dict.update({ID_string: {"df": df, "color": color}})
-
-        self.df_dict_for_drawing.clear()
-        self.df_dict_for_drawing.update(modified_df_dict)
-
-        self.sliceview.update_slice_layer()
+        # // only the roots whose color changed are repainted
+        changed = self.render_state.select(
+            selected_ID_string, self.df_dict_for_drawing
+        )
+        if len(changed) != 0 or self.is_drawing_dirty:
+            self.is_drawing_dirty = False
+            self.sliceview.update_slice_layer()
+            self.projectionview.set_view_layer(self.df_dict_for_drawing)
 
-        self.projectionview.set_view_layer(self.df_dict_for_drawing)
         self.sliceview.pos_marks.draw(ID_string=selected_ID_string)
 
         if selected_ID_string is not None:
             if selected_ID_string.is_base():
-                projection_image = None
+                self.sliceview.isocurve.draw(ID_string=None)
             else:
                 selected_ID_string = selected_ID_string.to_root()
-                np_volume = self.RSA_components().volume.data
-                projection_image = np.zeros(
-                    shape=(np_volume.shape[1], np_volume.shape[2]),
-                    dtype=np.uint8,
+                vars = self.df_dict_for_drawing.get(selected_ID_string, None)
+                if vars is None:
+                    self.sliceview.isocurve.draw(ID_string=None)
+                else:
+                    self.sliceview.isocurve.draw(
+                        ID_string=selected_ID_string, voxels=vars["voxels"]
+                    )
+
+
+class QtPyramidBuilder(QThread):
+    def __init__(self, volumes: list):
+        super().__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.volumes = volumes
+        self.pyramids: list[VolumePyramid] = []
+
+    def run(self):
+        for volume in self.volumes:
+            if volume.is_empty() or volume.pyramid is not None:
+                # // e.g. a pyramid loaded from the volume cache
+                self.pyramids.append(volume.pyramid)
+                continue
+
+            pyramid = VolumePyramid().build(volume.data)
+            self.pyramids.append(pyramid)
+            self.logger.debug(
+                f"[pyramid built] levels: {sorted(pyramid.levels.keys())}"
+            )
+        self.quit()
+
+
+class QtSkeletonBuilder(QThread):
+    def __init__(self, volume, progressbar_signal: Signal):
+        super().__init__()
+        self.skeletonizer = VolumeSkeletonizer(volume)
+        self.progressbar_signal = progressbar_signal
+        self.error = None
+
+    def run(self):
+        try:
+            for i, total in self.skeletonizer.run_iterably():
+                self.progressbar_signal.emit(
+                    i, total, f"[skeleton] chunks ({i} / {total})"
                 )
-                vars = self.df_dict_for_drawing[selected_ID_string]
-                df_for_drawing = vars["df"]
-                y_array = df_for_drawing["y"].to_numpy()
-                x_array = df_for_drawing["x"].to_numpy()
+        except Exception as e:
+            self.error = e
+        self.quit()
 
-                if len(y_array) != 0:
-                    projection_image[y_array, x_array] = 255
 
-            # if selected_ID_string is not None:
-            self.sliceview.isocurve.draw(projection_image=projection_image)
+class QtDrawingGeometryBuilder(QThread):
+    # // measures the root radii, and dilates the polylines missing from the
+    # // drawing cache
+    def __init__(
+        self,
+        cache: DrawingCache,
+        polylines: dict,
+        progressbar_signal: Signal,
+        size: int = 3,
+        measured_polylines: list = None,
+    ):
+        super().__init__()
+        self.cache = cache
+        self.polylines = polylines
+        self.size = size
+        self.measured_polylines = measured_polylines or []
+        self.progressbar_signal = progressbar_signal
+        self.results: dict = {}
+
+    def run(self):
+        if len(self.measured_polylines) != 0:
+            # // the distance transform tiles are computed in parallel
+            self.cache.radius_estimator.measure(
+                self.measured_polylines,
+                on_tile=lambda i, total: self.progressbar_signal.emit(
+                    i, total, f"[root radius] tiles ({i} / {total})"
+                ),
+            )
+
+        total = len(self.polylines)
+        for i, (ID_string, polyline) in enumerate(self.polylines.items()):
+            self.results[ID_string] = self.cache.dilate(
+                polyline, size=self.size
+            )
+            self.progressbar_signal.emit(
+                i + 1, total, f"[drawing] {ID_string} ({i + 1} / {total})"
+            )
+        self.quit()
 
 
 class QtVolumeLoader(QThread):
-    def __init__(self, volume_paths: list[Path], progressbar_signal: Signal):
+    # // the first volume is handed over after its first slices
+    pyqtSignal_first_slices_loaded = Signal()
+    pyqtSignal_projections_updated = Signal()
+
+    def __init__(
+        self,
+        volume_paths: list[Path],
+        progressbar_signal: Signal,
+        early_display_slices: int = 32,
+        update_interval: float = 0.5,
+    ):
         super().__init__()
         self.volume_paths = volume_paths.copy()
         self.progressbar_signal = progressbar_signal
+        self.early_display_slices = early_display_slices
+        self.update_interval = update_interval
+
+        self.__first_volume = None
+        self.__loaders = [None] * len(self.volume_paths)
+        self.__streaming: list[StreamingProjection] = [None] * len(
+            self.volume_paths
+        )
+        self.__np_volume = None
+        self.__volume_info = None
+        self.__labels = None
+        self.error = None
 
     @property
     def volume_number(self):
         return len(self.volume_paths)
 
     def run(self):
-        self.__np_volume: list[np.ndarray] = []
-        self.__volume_info: list[dict] = []
-        self.__labels: list[str] = []
-        for i, volume_path in enumerate(self.volume_paths):
-            volume_path = Path(volume_path)
-            vl = VolumeLoader(volume_path)
-            img_paths = vl.image_files
-
-            imgs = []
-            for j, p in enumerate(img_paths):
-                imgs.append(io.imread(p))
+        try:
+            self.__load()
+        except Exception as e:
+            self.error = e
+        self.quit()
+
+    def __load(self):
+        # // the volumes are loaded concurrently, sharing the decoding
+        # // threads; volumes of equal shape are decoded into one stacked
+        # // buffer
+        loaders = [get_volume_loader(Path(p)) for p in self.volume_paths]
+        self.__loaders = loaders
+        specs = [vl.probe() for vl in loaders]
+        buffers = allocate_shared_buffers(specs)
+        for i, spec in enumerate(specs):
+            if spec is not None:
+                self.__streaming[i] = StreamingProjection(*spec)
+
+        totals = [vl.image_file_number for vl in loaders]
+        progress = [0] * self.volume_number
+        lock = threading.Lock()
+        max_workers = max(1, default_worker_count() // self.volume_number)
+
+        def load(i: int):
+            vl = loaders[i]
+            name = Path(self.volume_paths[i]).name
+            streaming = self.__streaming[i]
+            on_slice = streaming.add_slice if streaming is not None else None
+
+            updated = time.perf_counter()
+            for j, total in vl.load_iterably(
+                max_workers=max_workers, on_slice=on_slice, out=buffers[i]
+            ):
+                with lock:
+                    progress[i] = j
+                    done = sum(progress)
                 self.progressbar_signal.emit(
-                    i * len(img_paths) + j + 1,
-                    len(img_paths) * self.volume_number,
-                    f"[loading] {volume_path.name} ({j+1} / {len(img_paths)})",
+                    done, sum(totals), f"[loading] {name} ({j} / {total})"
                 )
+                if i != 0:
+                    continue
+
+                if self.__first_volume is None:
+                    if j >= min(self.early_display_slices, total):
+                        self.__first_volume = (
+                            vl.np_volume,
+                            vl.load_volume_info(),
+                            str(name),
+                        )
+                        self.pyqtSignal_first_slices_loaded.emit()
+                elif time.perf_counter() - updated > self.update_interval:
+                    updated = time.perf_counter()
+                    self.pyqtSignal_projections_updated.emit()
 
-            self.__np_volume.append(np.asarray(imgs))
-            self.__volume_info.append(vl.load_volume_info())
-            self.__labels.append(str(volume_path.name))
-        self.quit()
+        with ThreadPoolExecutor(max_workers=self.volume_number) as executor:
+            list(executor.map(load, range(self.volume_number)))
+
+        self.__np_volume = [vl.np_volume for vl in loaders]
+        self.__volume_info = [vl.load_volume_info() for vl in loaders]
+        self.__labels = [Path(p).name for p in self.volume_paths]
 
     def is_valid_volume(self):
-        vl = VolumeLoader(self.volume_path)
-        return vl.is_valid_volume()
+        return all(
+            get_volume_loader(p).is_valid_volume() for p in self.volume_paths
+        )
+
+    def first_volume(self):
+        return self.__first_volume
+
+    def projections(self, index: int):
+        # // None if the volume is not decoded slice by slice, nor cached
+        streaming = self.__streaming[index]
+        if streaming is None:
+            loader = self.__loaders[index]
+            return loader.cached_projections() if loader else None
+        return streaming.projections()
+
+    def pyramid(self, index: int):
+        loader = self.__loaders[index]
+        return loader.cached_pyramid() if loader else None
 
     def data(self):
         return (self.__np_volume, self.__volume_info, self.__labels)
@@ -1,9 +1,8 @@
 import logging
 import os
+from pathlib import Path
 
-import imageio.v3 as imageio
-import numpy as np
-from PySide6.QtCore import QObject
+from PySide6.QtCore import QObject, QThread, Signal
 from PySide6.QtGui import QAction, QColor
 from PySide6.QtWidgets import (
     QColorDialog,
@@ -15,13 +14,25 @@ from PySide6.QtWidgets import (
 
 import config
 from config.history import History
+from DATA.RSA.components.rinfo import root_traits_format
+from data_modules.reinterpolation import RootReinterpolation
+from data_modules.trace_export import (
+    TraceImageExporter,
+    points_from_RSA_vector,
+)
 from GUI.components import QtMain
-from modules.volume import VolumeSaver
+from modules.lazy_import import lazy_import
+
+imageio = lazy_import("imageio.v3")
 
 
 class QtAction(QAction):
+    # // auto_enable_volume: enabled while a volume is open
+    # // available_in_loading: enabled while the volume is being loaded too,
+    # // e.g. node operations, which do not read the volume
     def __init__(self, *args, **kwargs):
         self.auto_enable_volume = kwargs.pop("auto_enable_volume", False)
+        self.available_in_loading = kwargs.pop("available_in_loading", False)
         super().__init__(*args, **kwargs)
 
 
@@ -32,6 +43,8 @@ class QtMenubar(QMenuBar):
         self.__parent = parent
         self.history = History(max_count=10, menu_label="Recent")
         self.history.load(file_name="recent.json")
+        self.trace_exporter: QtTraceImageExporter = None
+        self.reinterpolator: QtReinterpolator = None
 
     @property
     def main_window(self) -> QtMain:
@@ -71,6 +84,15 @@ class QtMenubar(QMenuBar):
         )
         self.menu_file.addAction(self.act_open_volume)
 
+        self.act_open_volume_file = QtAction(
+            text="Open volume file",
+            parent=self,
+            shortcut="Ctrl+Shift+O",
+            statusTip="Open volume file (tar.gz slice bundle or multi-page TIFF)",
+            triggered=self.on_act_open_volume_file,
+        )
+        self.menu_file.addAction(self.act_open_volume_file)
+
         self.menu_history = self.history.build_menu(
             parent=self, triggered=self.on_menu_history
         )
@@ -94,6 +116,7 @@ class QtMenubar(QMenuBar):
             statusTip="Save rinfo file",
             triggered=self.on_act_save_rinfo,
             auto_enable_volume=True,
+            available_in_loading=True,
         )
         self.menu_file.addAction(self.act_save_rinfo)
 
@@ -126,6 +149,14 @@ class QtMenubar(QMenuBar):
         )
         self.menu_file.addAction(self.act_export_root_csv)
 
+        self.act_export_root_traits = QtAction(
+            text="Export root traits as...",
+            statusTip="Export root traits (csv, parquet, or arrow)",
+            triggered=self.on_act_export_root_traits,
+            auto_enable_volume=True,
+        )
+        self.menu_file.addAction(self.act_export_root_traits)
+
         self.menu_file.addSeparator()
         self.act_exit = QtAction(
             text="Exit",
@@ -136,6 +167,31 @@ class QtMenubar(QMenuBar):
         )
         self.menu_file.addAction(self.act_exit)
 
+        # // edit menu
+        self.menu_edit = QMenu("&Edit")
+        self.addMenu(self.menu_edit)
+        self.act_undo = QtAction(
+            text="Undo",
+            parent=self,
+            shortcut="Ctrl+Z",
+            statusTip="Undo the last node operation",
+            triggered=self.main_window.undo,
+            auto_enable_volume=True,
+            available_in_loading=True,
+        )
+        self.menu_edit.addAction(self.act_undo)
+
+        self.act_redo = QtAction(
+            text="Redo",
+            parent=self,
+            shortcut="Ctrl+Y",
+            statusTip="Redo the node operation undone",
+            triggered=self.main_window.redo,
+            auto_enable_volume=True,
+            available_in_loading=True,
+        )
+        self.menu_edit.addAction(self.act_redo)
+
         # // interpolation menu
         interpolation = self.RSA_vector.interpolation
         self.menu_interpolation = interpolation.build_menu(
@@ -144,6 +200,15 @@ class QtMenubar(QMenuBar):
         self.RSA_vector.annotations.set_interpolation(
             interpolation.get_selected_label()
         )
+        self.menu_interpolation.addSeparator()
+        self.act_reinterpolate = QtAction(
+            text="Re-interpolate all roots",
+            parent=self,
+            statusTip="Re-interpolate all roots with the selected method",
+            triggered=self.on_act_reinterpolate,
+            auto_enable_volume=True,
+        )
+        self.menu_interpolation.addAction(self.act_reinterpolate)
         self.addMenu(self.menu_interpolation)
 
         # // extension menu
@@ -184,6 +249,25 @@ class QtMenubar(QMenuBar):
         )
         self.menu_color.addAction(self.act_reset_color)
 
+        self.menu_setting.addSeparator()
+        self.act_show_skeleton = QtAction(
+            text="Skeleton layer",
+            parent=self,
+            checkable=True,
+            statusTip="show the volume skeleton, and snap clicks to it.",
+            triggered=self.on_act_show_skeleton,
+            auto_enable_volume=True,
+        )
+        self.menu_setting.addAction(self.act_show_skeleton)
+
+        self.act_snap_to_center = QtAction(
+            text="Snap to root center",
+            parent=self,
+            checkable=True,
+            statusTip="move clicked nodes to the local intensity centroid.",
+        )
+        self.menu_setting.addAction(self.act_snap_to_center)
+
         # // Help
         self.menu_help = QMenu("&Help")
         self.addMenu(self.menu_help)
@@ -204,15 +288,20 @@ class QtMenubar(QMenuBar):
         if self.main_window.is_control_locked():
             return
 
+        # // actions reading the volume wait until all slices are loaded
+        is_loading = self.main_window.is_loading()
         for m, item in self.__dict__.items():
             if m.lower().startswith(("act_", "menu_")):
                 if hasattr(item, "auto_enable_volume"):
                     if item.auto_enable_volume is True:
                         item.setEnabled(
                             self.RSA_components.volume.is_empty() is False
+                            and (not is_loading or item.available_in_loading)
                         )
 
         self.menu_history.setEnabled(len(self.menu_history.actions()) != 0)
+        self.act_undo.setEnabled(self.main_window.edit_history.can_undo())
+        self.act_redo.setEnabled(self.main_window.edit_history.can_redo())
 
     def on_act_open_volume(self):
         directory = QFileDialog.getExistingDirectory(
@@ -223,6 +312,18 @@ class QtMenubar(QMenuBar):
 
         self.main_window.load_from(vol_parent_path=directory)
 
+    def on_act_open_volume_file(self):
+        file_name = QFileDialog.getOpenFileName(
+            self,
+            "Volume file",
+            os.path.expanduser("~"),
+            "Volume files (*.tar.gz *.tgz *.tar *.tif *.tiff)",
+        )[0]
+        if file_name == "":
+            return False
+
+        self.main_window.load_from(vol_parent_path=file_name)
+
     def on_menu_history(self):
         obj = QObject.sender(self)
         name = obj.data()
@@ -233,41 +334,64 @@ class QtMenubar(QMenuBar):
         self.main_window.close_volume()
 
     def on_act_save_rinfo(self):
+        # // written on the file writer thread from a snapshot
         rinfo_file_name = self.RSA_components.file.rinfo_file
-        self.RSA_vector.save(rinfo_file_name)
+        dictionary = self.RSA_vector.snapshot()
+        state = self.main_window.edit_history.current()
+        self.main_window.file_writer.submit(
+            rinfo_file_name,
+            lambda f: self.RSA_vector.write(f, dictionary),
+            on_written=lambda job: self.on_rinfo_saved(job, state),
+        )
+
+    def on_rinfo_saved(self, job, state):
+        # // skipped if the volume was closed in the meantime
+        if job.error is not None:
+            return
+        if job.path != self.RSA_components.file.rinfo_file:
+            return
+
+        self.main_window.restart_journal(state)
+        self.main_window.save_drawing_cache()
 
     def on_act_export_root_csv(self):
-        df = self.treeview.to_pandas_df()
         csv_fname = self.RSA_components.file.root_traits_file
+        self.export_root_traits(csv_fname)
+
+    def on_act_export_root_traits(self):
+        file_name, selected_filter = QFileDialog.getSaveFileName(
+            self,
+            "Export root traits",
+            str(self.RSA_components.file.root_traits_file),
+            "CSV (*.csv);;Parquet (*.parquet);;Arrow IPC (*.arrow)",
+        )
+        if file_name == "":
+            return
+
+        # // the extension of the selected filter, if not given
+        suffix = selected_filter[selected_filter.index("*") + 1 : -1]
+        if Path(file_name).suffix.lower() != suffix:
+            file_name += suffix
+        self.export_root_traits(file_name)
+
+    def export_root_traits(self, file_name):
+        # // the traits are evaluated here, and written on the worker thread
+        format = root_traits_format(file_name)
+        table = self.RSA_vector.root_traits_table(self.main_window.root_traits)
         volume_name = self.RSA_vector.annotations.volume_name()
         resolution = self.RSA_vector.annotations.resolution()
-        with open(csv_fname, "w", newline="") as f:
-            f.write(
-                "# This file is a summary of root traits measured by RSAtrace3D.\n"
-            )
-            f.write(
-                f"# Volume name: {volume_name}, Resolution: {resolution}\n"
-            )
-            df.to_csv(f)
-            self.logger.info(f"[Saving succeeded] {csv_fname}")
+        self.main_window.file_writer.submit(
+            file_name,
+            lambda f: self.RSA_vector.write_root_traits(
+                f, table, format, volume_name, resolution
+            ),
+            mode="wb",
+        )
 
     def on_act_export_projections(self):
         for i in range(3):
-            view = self.projectionview.sub_view_widgets[i].view
-            projection_image = view.projection_image.image
-            trace_image = view.trace_image.image
-            alpha = trace_image[[..., 3]] / 255
-            alpha = np.array(np.stack([alpha, alpha, alpha], axis=2))
-            out_image = np.zeros(projection_image.shape + (3,))
-            out_image = np.stack(
-                [projection_image, projection_image, projection_image],
-                axis=2,
-            )
-
-            out_image = np.array(
-                out_image * (1 - alpha) + trace_image[..., 0:3] * alpha,
-                dtype=np.uint8,
-            ).transpose(1, 0, 2)
+            # // composited from the cached trace layers
+            out_image = self.projectionview.composite_image(i)
             volume_stem = self.RSA_components.file.volume_stem
             out_file = f"{volume_stem}_projection{i+1}.png"
 
@@ -276,48 +400,107 @@ class QtMenubar(QMenuBar):
 
     def on_act_export_trace_images(self):
         np_volume = self.RSA_components.volume.data
-        df_dict_for_drawing = self.main_window.df_dict_for_drawing
-        df_list = [v["df"] for v in df_dict_for_drawing.values()]
-        trace_object = np.zeros((np_volume.shape[0:3]), dtype=np.uint8)
-
-        for df in df_list:
-            z_array = df["z"].to_numpy()
-            y_array = df["y"].to_numpy()
-            x_array = df["x"].to_numpy()
-
-            if len(z_array) != 0:
-                trace_object[z_array, y_array, x_array] = 255
 
-        self.main_window.set_control(locked=True)
         trace_directory = self.RSA_components.file.trace_directory
-
-        if trace_directory.is_dir():
+        if trace_directory.exists():
             self.logger.error(
                 f"[Saving failed] {trace_directory} already exists."
             )
             return
 
-        os.mkdir(trace_directory)
-
-        progressbar_signal = (
-            self.GUI_components.statusbar.pyqtSignal_update_progressbar
+        # // slices are rasterized from the sorted voxels on export threads
+        # // The roots are dilated by the fixed dot size, as without the
+        # // GUI, not by the radii they are drawn with.
+        points = points_from_RSA_vector(self.RSA_vector, np_volume.shape[:3])
+        self.trace_exporter = QtTraceImageExporter(
+            exporter=TraceImageExporter(
+                points=points, volume_shape=np_volume.shape[:3]
+            ),
+            dst_path=trace_directory,
+            progressbar_signal=(
+                self.GUI_components.statusbar.pyqtSignal_update_progressbar
+            ),
         )
-        volume_saver = VolumeSaver(trace_object, {})
-        for i, total in volume_saver.save_iterably(
-            trace_directory, extension="png"
-        ):
-            progressbar_signal.emit(i + 1, total, "File saving")
+        self.trace_exporter.finished.connect(self.on_trace_images_exported)
+
+        self.main_window.set_control(locked=True)
+        self.trace_exporter.start()
 
-        self.logger.info(f"[Saving succeeded] {trace_directory}")
+    def on_trace_images_exported(self):
+        trace_exporter = self.trace_exporter
+        self.trace_exporter = None
+
+        dst_path = trace_exporter.dst_path
+        if trace_exporter.exporter.is_cancelled():
+            self.logger.info(f"[Saving canceled] {dst_path}")
+        elif trace_exporter.error is not None:
+            self.logger.error(f"[Saving failed] {trace_exporter.error}")
+        else:
+            self.logger.info(f"[Saving succeeded] {dst_path}")
 
         self.main_window.set_control(locked=False)
         self.main_window.show_default_msg_in_statusbar()
 
+    def cancel_export(self):
+        if self.trace_exporter is not None:
+            self.trace_exporter.exporter.cancel()
+
     def on_menu_interpolation(self):
         obj = QObject.sender(self)
         name = obj.data()
         self.RSA_vector.annotations.set_interpolation(interpolation=name)
 
+    def on_act_reinterpolate(self):
+        interpolation = self.RSA_vector.interpolation
+        self.reinterpolate(
+            interpolation.get(label=interpolation.get_selected_label())
+        )
+
+    def reinterpolate(self, interpolation_cls, ID_strings: list = None):
+        # // roots are re-interpolated in a process pool, one run at a time
+        if self.reinterpolator is not None:
+            self.logger.error("Roots are being re-interpolated.")
+            return False
+
+        self.reinterpolator = QtReinterpolator(
+            reinterpolation=RootReinterpolation(
+                self.RSA_vector,
+                interpolation_cls,
+                volume=self.RSA_components.volume.data,
+                ID_strings=ID_strings,
+            ),
+            progressbar_signal=(
+                self.GUI_components.statusbar.pyqtSignal_update_progressbar
+            ),
+        )
+        self.reinterpolator.finished.connect(self.on_reinterpolated)
+
+        self.main_window.set_control(locked=True)
+        self.reinterpolator.start()
+
+    def on_reinterpolated(self):
+        reinterpolator = self.reinterpolator
+        self.reinterpolator = None
+
+        reinterpolation = reinterpolator.reinterpolation
+        label = reinterpolation.interpolation_cls.label
+        if reinterpolator.error is not None:
+            self.logger.error(
+                f"[Re-interpolation failed] {reinterpolator.error}"
+            )
+        else:
+            reinterpolation.apply()
+            self.main_window.record_edit("re-interpolate")
+            self.main_window.update_df_dict_for_drawing_all()
+            self.treeview.update_all_text()
+            self.main_window.on_selected_item_changed(
+                selected_ID_string=self.treeview.get_selected_ID_string()
+            )
+            self.logger.info(f"[Re-interpolation succeeded] {label}")
+
+        self.main_window.set_control(locked=False)
+        self.main_window.show_default_msg_in_statusbar()
+
     def on_menu_extensions(self):
         obj = QObject.sender(self)
         name = obj.data()
@@ -352,6 +535,9 @@ class QtMenubar(QMenuBar):
             selected_ID_string=self.treeview.get_selected_ID_string()
         )
 
+    def on_act_show_skeleton(self):
+        self.main_window.set_skeleton_shown(self.act_show_skeleton.isChecked())
+
     def on_act_about(self):
         app_name = config.application_name
         ver = config.version
@@ -363,3 +549,51 @@ class QtMenubar(QMenuBar):
         )
         msg += "Author: Shota Teramoto"
         QMessageBox.information(None, config.application_name, msg)
+
+
+class QtTraceImageExporter(QThread):
+    def __init__(
+        self,
+        exporter: TraceImageExporter,
+        dst_path: Path,
+        progressbar_signal: Signal,
+    ):
+        super().__init__()
+        self.exporter = exporter
+        self.dst_path = dst_path
+        self.progressbar_signal = progressbar_signal
+        self.error = None
+
+    def run(self):
+        try:
+            for i, total in self.exporter.export_iterably(self.dst_path):
+                self.progressbar_signal.emit(
+                    i,
+                    total,
+                    f"[exporting] trace images ({i} / {total}), Esc to cancel",
+                )
+        except Exception as e:
+            self.error = e
+        self.quit()
+
+
+class QtReinterpolator(QThread):
+    def __init__(
+        self,
+        reinterpolation: RootReinterpolation,
+        progressbar_signal: Signal,
+    ):
+        super().__init__()
+        self.reinterpolation = reinterpolation
+        self.progressbar_signal = progressbar_signal
+        self.error = None
+
+    def run(self):
+        try:
+            for i, total in self.reinterpolation.run_iterably():
+                self.progressbar_signal.emit(
+                    i, total, f"[re-interpolating] roots ({i} / {total})"
+                )
+        except Exception as e:
+            self.error = e
+        self.quit()
@@ -2,11 +2,14 @@ from __future__ import annotations
 
 import numpy as np
 from PySide6.QtCore import QObject, QPoint, QPointF, Qt, Signal
-from PySide6.QtGui import QAction, QActionGroup
+from PySide6.QtGui import QAction, QActionGroup, QTransform
 from PySide6.QtWidgets import QGridLayout, QMenu, QWidget
 
 import config
+from data_modules.projection_layer import ProjectionLayer
 from GUI.components import QtMain
+from modules.projection import project
+from modules.pyramid import build_image_pyramid, choose_level
 
 if True:
     from pyqtgraph import ImageItem, InfiniteLine, ViewBox, mkColor
@@ -65,10 +68,44 @@ class CoreViewWidget(GraphicsLayoutWidget):
         self.bg_color = mkColor("#000000")
         self.setBackground(self.bg_color)
 
-    def set_projection_image(self, img):
-        self.view.projection_image.setImage(img.transpose(1, 0))
+        # // full resolution projection and its downsampled copies
+        self.projection_levels: dict[int, np.ndarray] = {}
+        self.projection_factor = 1
+
+    @property
+    def projection(self) -> np.ndarray:
+        return self.projection_levels.get(1, None)
+
+    def set_projection_image(
+        self, img, levels: dict = None, auto_range: bool = True
+    ):
+        self.projection_levels = levels or build_image_pyramid(
+            img, method="max"
+        )
+        self.projection_factor = 0
+        if auto_range:
+            self.view.autoRange()
+        self.update_projection_level()
+
+    def update_projection_level(self):
+        # // a downsampled projection is shown while zoomed out
+        if self.projection is None:
+            return
+
+        factor = choose_level(
+            self.projection_levels.keys(), min(self.view.viewPixelSize())
+        )
+        if factor == self.projection_factor:
+            return
+
+        self.projection_factor = factor
+        self.view.projection_image.setImage(
+            self.projection_levels[factor].transpose(1, 0)
+        )
+        self.view.projection_image.setTransform(
+            QTransform.fromScale(factor, factor)
+        )
         self.on_projection_level_changed()
-        self.view.autoRange()
 
     def on_projection_level_changed(self):
         self.view.projection_image.setLevels(
@@ -81,6 +118,8 @@ class CoreViewWidget(GraphicsLayoutWidget):
         self.setBackground(self.bg_color)
 
     def clear_all(self):
+        self.projection_levels = {}
+        self.projection_factor = 1
         self.view.clear_all()
 
     def select_itself(self, flag):
@@ -132,6 +171,7 @@ class MainViewWidget(CoreViewWidget):
         self.infinite_line.hide()
         self.addItem(self.view)
         self.view.addItem(self.infinite_line)
+        self.view.sigRangeChanged.connect(self.update_projection_level)
 
 
 class SubViewWidget(CoreViewWidget):
@@ -142,6 +182,7 @@ class SubViewWidget(CoreViewWidget):
     def make_viewbox(self):
         self.view = SubViewBox(identifier=self.identifier)
         self.addItem(self.view)
+        self.view.sigRangeChanged.connect(self.update_projection_level)
 
 
 class QtProjectionView(QWidget):
@@ -170,6 +211,7 @@ class QtProjectionView(QWidget):
         self.setLayout(self.layout)
 
         self.current_view_index = -1
+        self.projection_layers: list[ProjectionLayer] = [None] * 3
 
         for w in self.all_widgets:
             w.view.pyqtSignal_mouseClickEvent.connect(self.on_mouse_clicked)
@@ -218,10 +260,13 @@ class QtProjectionView(QWidget):
             return
 
         # // update projection
-        view = self.sub_view_widgets[self.current_view_index].view
-        img = view.projection_image.image
+        sub_view_widget = self.sub_view_widgets[self.current_view_index]
+        view = sub_view_widget.view
+        img = sub_view_widget.projection
         if img is not None:
-            self.main_view_widget.set_projection_image(img=img.transpose(1, 0))
+            self.main_view_widget.set_projection_image(
+                img=img, levels=sub_view_widget.projection_levels
+            )
 
         # // update trace
         img = view.trace_image.image
@@ -284,20 +329,21 @@ class QtProjectionView(QWidget):
 
     def clear(self):
         self.current_view_index = -1
+        self.projection_layers = [None] * 3
         self.update_selected_items()
         self.main_view_widget.clear_all()
         for i in range(3):
             self.sub_view_widgets[i].clear_all()
         self.main_view_widget.infinite_line.hide()
 
-    def set_volume(self, volume: np.ndarray):
+    def set_volume(self, volume: np.ndarray, projections: list = None):
         if volume is None:
             return
 
-        for i in range(3):
-            self.sub_view_widgets[i].set_projection_image(
-                img=volume.max(axis=i)
-            )
+        # // the three projections are computed in one pass
+        projections = projections or project(volume, method="max")
+        for i, projection in enumerate(projections):
+            self.sub_view_widgets[i].set_projection_image(img=projection)
 
         self.current_view_index = 0
         self.update_selected_items()
@@ -308,59 +354,61 @@ class QtProjectionView(QWidget):
             (0, self.volume_shape[0])
         )
 
-    def update_volume(self, volume: np.ndarray):
+    def refresh_projections(self, projections: list):
+        # // projections of a volume being loaded; view ranges are kept
+        for i, projection in enumerate(projections):
+            self.sub_view_widgets[i].set_projection_image(
+                img=projection, auto_range=False
+            )
+
+        if self.current_view_index in [0, 1, 2]:
+            sub_view_widget = self.sub_view_widgets[self.current_view_index]
+            self.main_view_widget.set_projection_image(
+                img=sub_view_widget.projection,
+                levels=sub_view_widget.projection_levels,
+                auto_range=False,
+            )
+
+    def update_volume(self, volume: np.ndarray, projections: list = None):
         if volume is None:
             return
 
-        for i in range(3):
-            self.sub_view_widgets[i].set_projection_image(
-                img=volume.max(axis=i)
-            )
+        # // the three projections are computed in one pass
+        projections = projections or project(volume, method="max")
+        for i, projection in enumerate(projections):
+            self.sub_view_widgets[i].set_projection_image(img=projection)
 
         self.update_selected_items()
         self.update_main_widget()
 
     def set_view_layer(self, df_dict_for_drawing: dict[str, dict]):
-        if len(df_dict_for_drawing) == 0:
-            for i, dimension in enumerate([[1, 2], [0, 2], [0, 1]]):
-                sub_view_widget = self.sub_view_widgets[i]
-                projection_image = sub_view_widget.view.projection_image.image
-                if projection_image is None:
-                    continue
-                else:
-                    np_layer = np.zeros(
-                        projection_image.shape + (4,), dtype=np.uint8
-                    )
-                    sub_view_widget.set_trace_image(img=np_layer)
-
-            self.update_main_widget()
-            return
-
-        df_list = [v["df"] for v in df_dict_for_drawing.values()]
-        color_list = [v["color"] for v in df_dict_for_drawing.values()]
-
+        # // only the roots whose geometry or color changed are repainted
         for i, dimension in enumerate([[1, 2], [0, 2], [0, 1]]):
             sub_view_widget = self.sub_view_widgets[i]
-            projection_image = sub_view_widget.view.projection_image.image
+            projection_image = sub_view_widget.projection
             if projection_image is None:
                 continue
 
-            shape = (projection_image.shape[1], projection_image.shape[0], 4)
+            layer = self.projection_layers[i]
+            if layer is None or layer.shape != projection_image.shape:
+                layer = ProjectionLayer(
+                    shape=projection_image.shape, dimension=dimension
+                )
+                self.projection_layers[i] = layer
 
-            np_layer = np.zeros(shape, dtype=np.uint8)
-            for df, color in zip(df_list, color_list):
-                z_array = df["z"].to_numpy()
-                y_array = df["y"].to_numpy()
-                x_array = df["x"].to_numpy()
-                array_list = [z_array, y_array, x_array]
+            changed = layer.update(df_dict_for_drawing)
+            if changed or sub_view_widget.view.trace_image.image is None:
+                sub_view_widget.set_trace_image(img=layer.image())
 
-                np_layer[
-                    array_list[dimension[0]], array_list[dimension[1]]
-                ] = color
+        self.update_main_widget()
 
-            self.sub_view_widgets[i].set_trace_image(img=np_layer)
+    def composite_image(self, index: int):
+        projection_image = self.sub_view_widgets[index].projection
+        layer = self.projection_layers[index]
+        if layer is None:
+            return np.stack([projection_image] * 3, axis=2)
 
-        self.update_main_widget()
+        return layer.composite(projection_image)
 
     def __get_closest_distance(
         self, ref_coordinate: np.ndarray, from_polyline: np.ndarray, index: int
@@ -5,9 +5,8 @@ import time
 from typing import List
 
 import numpy as np
-import polars as pl
 from PySide6.QtCore import Qt
-from PySide6.QtGui import QBrush, QMouseEvent, QPen
+from PySide6.QtGui import QBrush, QMouseEvent, QPen, QTransform
 from PySide6.QtWidgets import QGraphicsSceneWheelEvent
 
 from DATA.RSA import RSA_Components
@@ -93,9 +92,15 @@ class QtSliceView(ImageView):
 
         self.timeLine.sigPositionChanged.connect(self.on_showing_slice_changed)
         self.view.sigRangeChangedManually.connect(self.onRangeChangedManually)
+        self.view.sigRangeChanged.connect(self.update_pyramid_level)
         self.x_range, self.y_range = ([], [])
         self.prev_click_time = -1
 
+        # // full resolution volume and its downsampled copies
+        self.full_volume = None
+        self.pyramid = None
+        self.pyramid_factor = 1
+
     def onRangeChangedManually(self, status):
         self.x_range, self.y_range = self.view.viewRange()
 
@@ -153,14 +158,18 @@ class QtSliceView(ImageView):
         if self.RSA_components().volume.is_empty():
             return
 
-        position = [self.currentIndex, int(ev.pos().y()), int(ev.pos().x())]
+        # // the image item is scaled when a pyramid level is shown
+        pos = self.imageItem.mapToParent(ev.pos())
+        position = [self.currentIndex, int(pos.y()), int(pos.x())]
 
         self.logger.debug(
             f"Mouse clicked: (x={position[2]}, y={position[1]}, z={self.currentIndex})"
         )
 
         if ev.button() == Qt.LeftButton:
-            annotations = {"coordinate": position}
+            annotations = {
+                "coordinate": self.main_window.snap_coordinate(position)
+            }
 
             if ev.modifiers() & Qt.ControlModifier:
                 # // add base node
@@ -168,6 +177,7 @@ class QtSliceView(ImageView):
                     self.main_window.set_control(locked=True)
                     self.add_base(annotations=annotations)
                     self.treeview.update_all_text()
+                    self.main_window.record_edit("add base")
                     self.main_window.set_control(locked=False)
                     self.main_window.show_default_msg_in_statusbar()
                 # // add relay node
@@ -175,6 +185,7 @@ class QtSliceView(ImageView):
                     self.main_window.set_control(locked=True)
                     self.add_relay(annotations=annotations)
                     self.treeview.update_all_text()
+                    self.main_window.record_edit("add relay")
                     self.main_window.set_control(locked=False)
                     self.main_window.show_default_msg_in_statusbar()
             else:
@@ -195,6 +206,7 @@ class QtSliceView(ImageView):
                     self.main_window.set_control(locked=True)
                     self.add_root(annotations=annotations)
                     self.treeview.update_all_text()
+                    self.main_window.record_edit("add root")
                     self.main_window.set_control(locked=False)
                     self.main_window.show_default_msg_in_statusbar()
 
@@ -289,18 +301,71 @@ class QtSliceView(ImageView):
             selected_ID_string=selected_ID_string
         )
 
-    def set_volume(self, volume):
+    def set_volume(self, volume, pyramid=None):
+        self.full_volume = volume
+        self.pyramid = pyramid
+        self.pyramid_factor = 1
         self.setImage(img=volume, axes={"t": 0, "x": 2, "y": 1, "c": None})
+        self.update_pyramid_level()
 
-    def update_volume(self, np_vol: np.ndarray):
+    def update_volume(self, np_vol: np.ndarray, pyramid=None):
+        self.full_volume = np_vol
+        self.pyramid = pyramid
+        self.pyramid_factor = 1
+        self.imageItem.setTransform(QTransform())
         self.image = np_vol
         self.imageDisp = None
         self.updateImage()
+        self.update_pyramid_level()
+
+    def refresh_slice(self):
+        # // redraws the current slice of a volume being loaded
+        if self.image is None:
+            return
+        self.updateImage(autoHistogramRange=False)
+
+    def set_pyramid(self, pyramid):
+        self.pyramid = pyramid
+        self.update_pyramid_level()
+
+    def update_pyramid_level(self):
+        # // a downsampled level is shown while zoomed out
+        if self.full_volume is None:
+            return
+
+        factor, level = 1, self.full_volume
+        if self.pyramid is not None and not self.pyramid.is_empty():
+            pixel_size = min(self.view.viewPixelSize())
+            factor, level = self.pyramid.level_for(pixel_size)
+            if level is None:
+                factor, level = 1, self.full_volume
+
+        if factor == self.pyramid_factor:
+            return
+
+        self.logger.debug(f"[pyramid level changed] 1/{factor}")
+        self.pyramid_factor = factor
+        self.image = level
+        self.imageDisp = None
+        self.imageItem.setTransform(QTransform.fromScale(factor, factor))
+        self.updateImage(autoHistogramRange=False)
+
+    def quickMinMax(self, data):
+        # // chunked volumes are not scanned entirely; the middle slice
+        # // is used for the levels instead
+        if not isinstance(data, np.ndarray):
+            data = data[data.shape[0] // 2]
+        return super().quickMinMax(data)
 
     def clear(self):
+        self.full_volume = None
+        self.pyramid = None
+        self.pyramid_factor = 1
+        self.imageItem.setTransform(QTransform())
         super().clear()
         self.pos_marks.hide()
         self.isocurve.hide()
+        self.isocurve.clear_cache()
 
     def on_mouse_wheeled(self, ev: QGraphicsSceneWheelEvent):
         ev.accept()
@@ -315,7 +380,7 @@ class QtSliceView(ImageView):
             return
 
         processed_image = self.getProcessedImage()
-        if not isinstance(processed_image, np.ndarray):
+        if processed_image is None:
             return
 
         index = (
@@ -328,19 +393,27 @@ class QtSliceView(ImageView):
     def update_slice_layer(self):
         np_volume = self.RSA_components().volume.data
         df_dict_for_drawing = self.__parent.df_dict_for_drawing
-        slice_layer = np.zeros((np_volume.shape[1:3] + (4,)), dtype=np.uint8)
+        if np_volume is None:
+            return
+
+        # // the layer is indexed by (x, y) like the image item
+        slice_layer = np.zeros(
+            (np_volume.shape[2], np_volume.shape[1], 4), dtype=np.uint8
+        )
 
-        df_list = [v["df"] for v in df_dict_for_drawing.values()]
-        color_list = [v["color"] for v in df_dict_for_drawing.values()]
+        # // the skeleton is drawn under the roots
+        skeleton = self.__parent.skeleton
+        if skeleton is not None and self.__parent.is_skeleton_shown():
+            y_array, x_array = skeleton.nodes_at(self.currentIndex)
+            slice_layer[x_array, y_array] = (0, 255, 255, 160)
 
-        for df, color in zip(df_list, color_list):
-            df = df.filter(pl.col("z") == self.currentIndex)
-            z_array = df["z"].to_numpy()
-            y_array = df["y"].to_numpy()
-            x_array = df["x"].to_numpy()
+        # // the voxels are sorted by z, so that those of the slice are
+        # // found by binary search
+        for vars in df_dict_for_drawing.values():
+            y_array, x_array = vars["voxels"].points_at(self.currentIndex)
 
-            if len(z_array) != 0:
-                slice_layer[x_array, y_array] = color
+            if len(y_array) != 0:
+                slice_layer[x_array, y_array] = vars["color"]
 
         self.slice_layer_item.setImage(slice_layer, autoLevels=False)
 
@@ -548,11 +621,42 @@ class _IsocurveItem(IsocurveItem):
         self.setLevel(255)
         self.setPen(mkPen([255, 255, 255, 64]))
 
-    def draw(self, projection_image: np.ndarray):
+        # // ID_string -> (voxels, cropped projection, offset)
+        self.__cache: dict = {}
+
+    def clear_cache(self):
+        self.__cache.clear()
+
+    def projection_of(self, ID_string: str, voxels):
+        # // the projection is cropped to the root with a margin of one
+        # // pixel, so that the curve is closed
+        cached = self.__cache.get(ID_string, None)
+        if cached is not None and cached[0] is voxels:
+            return cached[1], cached[2]
+
+        y_array, x_array = voxels.yx()
+        if len(y_array) == 0:
+            return None, (0, 0)
+
+        x0, y0 = x_array.min() - 1, y_array.min() - 1
+        projection_image = np.zeros(
+            (x_array.max() - x0 + 2, y_array.max() - y0 + 2), dtype=np.uint8
+        )
+        projection_image[x_array - x0, y_array - y0] = 255
+
+        self.__cache[ID_string] = (voxels, projection_image, (x0, y0))
+        return projection_image, (x0, y0)
+
+    def draw(self, ID_string: str = None, voxels=None):
+        projection_image = None
+        if ID_string is not None:
+            projection_image, offset = self.projection_of(ID_string, voxels)
+
         if projection_image is None:
             self.setData(None)
             return
 
         self.show()
 
-        self.setData(projection_image.transpose(1, 0))
+        self.setPos(*offset)
+        self.setData(projection_image)
@@ -1,8 +1,10 @@
-import psutil
 from DATA.RSA import RSA_Components
+from modules.lazy_import import lazy_import
 from PySide6.QtCore import QObject, QThread, QTimer, Signal
 from PySide6.QtWidgets import QLabel, QProgressBar, QSizePolicy, QStatusBar
 
+psutil = lazy_import("psutil")
+
 
 class QtStatusBarW(QObject):
     pyqtSignal_update_progressbar = Signal(int, int, str)
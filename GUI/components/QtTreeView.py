@@ -1,6 +1,5 @@
 import logging
 
-import pandas as pd
 from DATA.RSA import RSA_Components
 from DATA.RSA.components.rinfo import ID_Object
 from GUI.components import QtMain
@@ -305,51 +304,3 @@ class QtTreeView(QTreeView):
                 selected_ID_string=ID_string
             )
             self.GUI_components().sliceview.move_position(ID_string=ID_string)
-
-    def to_pandas_df(self):
-        labels = []
-        column_data = []
-
-        exportable_list = self.root_traits.class_container.expotable_list()
-        for ci in range(self.model.columnCount()):
-            if exportable_list[ci] is False:
-                continue
-
-            label = self.model.horizontalHeaderItem(ci).text()
-            cls_ = self.root_traits.get(label=label)
-
-            sublabels = cls_.sublabels
-            n_sublabel = len(sublabels)
-
-            if n_sublabel == 0:
-                labels.append(label)
-                ID_iter = self.model.get_iter_all_texts(column="ID string")
-                item_iter = self.model.get_iter_all_items(column=ci)
-
-                data = []
-                for ID_string, item in zip(ID_iter, item_iter):
-                    ID_string = ID_Object(ID_string)
-                    if ID_string.is_root():
-                        data.append(item.data().value)
-
-                column_data.append(data)
-            else:
-                for i in range(n_sublabel):
-                    labels.append(f"{label}_{sublabels[i]}")
-                    ID_iter = self.model.get_iter_all_texts(column="ID string")
-                    item_iter = self.model.get_iter_all_items(column=ci)
-
-                    data = []
-                    for ID_string, item in zip(ID_iter, item_iter):
-                        ID_string = ID_Object(ID_string)
-                        if ID_string.is_root():
-                            v = item.data().value
-                            v = v[i] if v is not None else ""
-                            data.append(v)
-
-                    column_data.append(data)
-
-        df = pd.DataFrame(column_data, index=labels)
-        df = df.transpose()
-
-        return df
@@ -1,3 +1,4 @@
+from .QtFileWriter import QtFileWriter
 from .QtMain import QtMain
 from .QtMenubar import QtMenubar
 from .QtProjectionView import QtProjectionView
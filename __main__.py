@@ -4,7 +4,6 @@ import warnings
 from pathlib import Path
 
 import config
-import GUI
 
 warnings.filterwarnings("ignore")
 
@@ -14,6 +13,31 @@ parser = argparse.ArgumentParser(
 parser.add_argument("-d", "--debug", action="store_true")
 parser.add_argument("-s", "--source", type=str, help="source volume path")
 parser.add_argument("--always_yes", action="store_true")
+parser.add_argument(
+    "-p",
+    "--profile_startup",
+    action="store_true",
+    help="report import cost per module at startup",
+)
+parser.add_argument(
+    "--watch",
+    type=str,
+    nargs="*",
+    metavar="ROOT",
+    help="build volume caches for new volumes under the roots, without GUI "
+    '(default: "watch roots" in config.json)',
+)
+parser.add_argument(
+    "--watch_interval", type=float, default=10.0, help="polling in seconds"
+)
+parser.add_argument(
+    "--watch_workers", type=int, default=None, help="volumes built at once"
+)
+parser.add_argument(
+    "--watch_once",
+    action="store_true",
+    help="build the volumes found once, and exit",
+)
 
 args = parser.parse_args()
 logger_level = logging.DEBUG if args.debug else logging.INFO
@@ -40,4 +64,27 @@ if __name__ == "__main__":
 
     config.ALWAYS_YES = args.always_yes
 
-    GUI.start(volume_path=volume_path)
+    if args.watch is not None:
+        roots = args.watch or config.load().get("watch roots", [])
+        if len(roots) == 0:
+            parser.error("No watch roots given.")
+
+        from data_modules.volume_watcher import watch
+
+        watch(
+            roots,
+            interval=args.watch_interval,
+            max_workers=args.watch_workers,
+            once=args.watch_once,
+        )
+        raise SystemExit(0)
+
+    startup_profiler = None
+    if args.profile_startup:
+        from modules.startup_profiler import StartupProfiler
+
+        startup_profiler = StartupProfiler().install()
+
+    import GUI
+
+    GUI.start(volume_path=volume_path, startup_profiler=startup_profiler)
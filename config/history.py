@@ -7,6 +7,7 @@ from PySide6.QtGui import QAction
 from PySide6.QtWidgets import QMenu
 
 import config
+from modules.volume import is_volume_file
 
 
 class History:
@@ -90,8 +91,7 @@ class History:
             act.setEnabled(
                 os.path.isdir(volume_path)
                 or (
-                    os.path.isfile(volume_path)
-                    and volume_path.lower().endswith(".tar.gz")
+                    os.path.isfile(volume_path) and is_volume_file(volume_path)
                 )
             )
             self.menu.addAction(act)
@@ -1,48 +1,90 @@
-from copy import deepcopy
+from __future__ import annotations
+
+from functools import lru_cache
 
 import numpy as np
-import polars as pl
-from skimage.morphology import ball
-
-
-def get_dilate_df(df: pl.DataFrame, target_np_volume: np.ndarray):
-    volume_shape = target_np_volume.shape[:3]
-
-    def get_ofset_list(radius: int):
-        b = ball(radius=radius)
-        b[1:-1, 1:-1, 1:-1][ball(radius=radius - 1) == 1] = 0
-        offset_list = np.array(np.where(b == 1))
-        offset_list = [
-            [z - b.shape[0] // 2, y - b.shape[1] // 2, x - b.shape[2] // 2]
-            for z, y, x in zip(*offset_list)
-        ]
-
-        return offset_list
-
-    resulting_df_list = [deepcopy(df)]
-
-    for target_size in range(1, df["size"].max() + 1):
-        for offset in get_ofset_list(radius=target_size):
-            offset_z, offset_y, offset_x = offset
-
-            offset_df_subset = (
-                df.filter(pl.col("size") >= target_size)
-                .with_columns(pl.col("z") + offset_z)
-                .with_columns(pl.col("y") + offset_y)
-                .with_columns(pl.col("x") + offset_x)
-            )
-
-            resulting_df_list.append(offset_df_subset)
-
-    resulting_df = (
-        pl.concat(resulting_df_list)
-        .unique(subset=["z", "y", "x"])
-        .filter(pl.col("z") >= 0)
-        .filter(pl.col("y") >= 0)
-        .filter(pl.col("x") >= 0)
-        .filter(pl.col("z") < volume_shape[0])
-        .filter(pl.col("y") < volume_shape[1])
-        .filter(pl.col("x") < volume_shape[2])
+
+from data_modules.root_voxels import voxel_index_dtype
+from modules.lazy_import import lazy_import
+
+pl = lazy_import("polars")
+morphology = lazy_import("skimage.morphology")
+
+
+def get_polyline_df(polyline, size=3):
+    # // size: the dilation radius, for all points or for each point
+    polyline = np.array(polyline)
+    sizes = np.broadcast_to(np.asarray(size, dtype=np.int64), len(polyline))
+
+    return pl.DataFrame(
+        (
+            pl.Series("z", polyline[:, 0], dtype=pl.Int64),
+            pl.Series("y", polyline[:, 1], dtype=pl.Int64),
+            pl.Series("x", polyline[:, 2], dtype=pl.Int64),
+            pl.Series("size", sizes, dtype=pl.Int64),
+        )
     )
 
-    return resulting_df
+
+@lru_cache(maxsize=None)
+def get_ball_offsets(radius: int):
+    b = morphology.ball(radius=radius)
+    return np.argwhere(b == 1) - radius
+
+
+def _dilate_points(points: np.ndarray, sizes: np.ndarray, volume_shape):
+    # // (sorted packed linear indexes, size of each voxel); each point is
+    # // dilated by a ball of its size
+    voxel_list, size_list = [points], [sizes]
+    for size in np.unique(sizes[sizes > 0]):
+        selected = points[sizes == size]
+        voxels = selected[:, None, :] + get_ball_offsets(int(size))
+        voxel_list.append(voxels.reshape(-1, 3))
+        size_list.append(np.full(len(voxel_list[-1]), size, dtype=np.int64))
+
+    voxels = np.concatenate(voxel_list)
+    sizes = np.concatenate(size_list)
+    inside = np.all((voxels >= 0) & (voxels < volume_shape), axis=1)
+    voxels, sizes = voxels[inside], sizes[inside]
+
+    indices, first = np.unique(
+        np.ravel_multi_index(voxels.T, volume_shape), return_index=True
+    )
+    return indices, sizes[first]
+
+
+def dilate_polyline(polyline, volume_shape: tuple, size=3) -> np.ndarray:
+    # // the sorted packed linear indexes of the dilated voxels
+    # // size: the dilation radius, for all points or for each point
+    volume_shape = tuple(volume_shape[:3])
+    points = np.asarray(polyline, dtype=np.int64).reshape(-1, 3)
+    sizes = np.broadcast_to(np.asarray(size, dtype=np.int64), len(points))
+
+    indices, _ = _dilate_points(points, sizes, volume_shape)
+    return indices.astype(voxel_index_dtype(volume_shape))
+
+
+def get_dilate_df(
+    df: pl.DataFrame,
+    target_np_volume: np.ndarray = None,
+    volume_shape: tuple = None,
+):
+    # // each point is dilated by a ball of its size
+    volume_shape = volume_shape or target_np_volume.shape[:3]
+
+    points = np.stack(
+        [df["z"].to_numpy(), df["y"].to_numpy(), df["x"].to_numpy()], axis=1
+    ).astype(np.int64)
+    sizes = df["size"].to_numpy().astype(np.int64)
+
+    indices, sizes = _dilate_points(points, sizes, volume_shape)
+    z, y, x = np.unravel_index(indices, volume_shape)
+
+    return pl.DataFrame(
+        (
+            pl.Series("z", z, dtype=pl.Int64),
+            pl.Series("y", y, dtype=pl.Int64),
+            pl.Series("x", x, dtype=pl.Int64),
+            pl.Series("size", sizes, dtype=pl.Int64),
+        )
+    )
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Final, Iterable, Optional, Tuple, Union
+
+import numpy as np
+
+from data_modules.df_for_drawing import dilate_polyline
+from data_modules.root_voxels import RootVoxels, voxel_index_dtype
+from modules.root_radius import ROOT_RADIUS_VERSION, RootRadiusEstimator
+
+DRAWING_CACHE_VERSION: Final[int] = 2
+DRAWING_CACHE_SUFFIX: Final[str] = ".drawing_cache.npz"
+MAX_DRAWING_SIZE: Final[int] = 6
+
+
+def drawing_cache_path(rinfo_file: Union[str, Path]) -> Path:
+    # // e.g. scan.rinfo -> scan.drawing_cache.npz
+    return Path(rinfo_file).with_suffix(DRAWING_CACHE_SUFFIX)
+
+
+def sizes_from_radii(radii, size: int = 3):
+    # // the dot size of each point; points out of the roots keep the size
+    sizes = np.clip(
+        np.rint(np.nan_to_num(radii, nan=size)), 1, MAX_DRAWING_SIZE
+    )
+    return sizes.astype(np.int64)
+
+
+class DrawingCache(object):
+    # // dilated voxels of the root polylines, for drawing
+    # // Entries are keyed by a hash of the polyline, the dot size, and the
+    # // volume shape, and are kept as sorted packed linear indexes in one
+    # // shared buffer, with the offsets of each entry. The buffer is only
+    # // appended to, or replaced on compaction, so that the RootVoxels
+    # // handed out stay valid. The cache is shared with the background
+    # // builder, so that it is locked.
+    # // A dot size of None means the root radius measured at each point.
+    def __init__(
+        self,
+        volume_shape: tuple = None,
+        radius_estimator: RootRadiusEstimator = None,
+    ):
+        self.volume_shape = volume_shape
+        self.radius_estimator = radius_estimator
+        self.dtype = voxel_index_dtype(volume_shape or (0,))
+        self.__buffer = np.zeros(0, dtype=self.dtype)
+        self.__used = 0
+        self.__entries: Dict[str, Tuple[int, int]] = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @property
+    def nbytes(self):
+        return self.__used * self.dtype.itemsize
+
+    def key_of(self, polyline, size: Optional[int] = 3) -> str:
+        if size is None:
+            size = -ROOT_RADIUS_VERSION
+        h = hashlib.sha1()
+        h.update(np.asarray(polyline, dtype=np.int64).tobytes())
+        h.update(
+            np.array(
+                tuple(self.volume_shape) + (size, DRAWING_CACHE_VERSION),
+                dtype=np.int64,
+            ).tobytes()
+        )
+        return h.hexdigest()
+
+    def __view(self, start: int, stop: int) -> RootVoxels:
+        indices = self.__buffer[start:stop]
+        indices.setflags(write=False)
+        return RootVoxels(indices, self.volume_shape)
+
+    def get(self, key: str) -> Optional[RootVoxels]:
+        with self.__lock:
+            entry = self.__entries.get(key, None)
+            if entry is None:
+                return None
+            return self.__view(*entry)
+
+    def __append(self, key: str, indices: np.ndarray):
+        # // the buffer is grown geometrically; a new buffer is allocated,
+        # // since views of the old one may be in use
+        stop = self.__used + len(indices)
+        if stop > len(self.__buffer):
+            buffer = np.empty(max(stop, 2 * len(self.__buffer)), self.dtype)
+            buffer[: self.__used] = self.__buffer[: self.__used]
+            self.__buffer = buffer
+        self.__buffer[self.__used : stop] = indices
+        self.__entries[key] = (self.__used, stop)
+        self.__used = stop
+
+    def put(self, key: str, indices: np.ndarray) -> RootVoxels:
+        # // indices: sorted packed linear indexes
+        with self.__lock:
+            if key not in self.__entries:
+                self.__append(key, np.asarray(indices, dtype=self.dtype))
+            return self.__view(*self.__entries[key])
+
+    def compact(self, keys: Iterable[str]):
+        # // only the given keys, e.g. those of the current roots, are kept,
+        # // if the others take most of the buffer
+        with self.__lock:
+            keys = [k for k in keys if k in self.__entries]
+            kept = sum(
+                stop - start for start, stop in map(self.__entries.get, keys)
+            )
+            if kept * 2 > self.__used:
+                return
+
+            entries = {k: self.__entries[k] for k in keys}
+            buffer = self.__buffer
+            self.__buffer = np.empty(kept, self.dtype)
+            self.__used = 0
+            self.__entries = {}
+            for key, (start, stop) in entries.items():
+                self.__append(key, buffer[start:stop])
+
+    def dilate(self, polyline, size: Optional[int] = 3):
+        # // (key, RootVoxels); the dilation is computed on a cache miss only
+        key = self.key_of(polyline, size=size)
+        sizes = size
+        if size is None:
+            # // measured even on a hit, since the radii are shared with the
+            # // root traits
+            sizes = sizes_from_radii(self.radius_estimator.radii(polyline))
+
+        voxels = self.get(key)
+        if voxels is None:
+            indices = dilate_polyline(
+                polyline, volume_shape=self.volume_shape, size=sizes
+            )
+            voxels = self.put(key, indices)
+
+        return key, voxels
+
+    def load(self, path: Union[str, Path]) -> bool:
+        if not os.path.isfile(path):
+            return False
+
+        try:
+            with np.load(path) as f:
+                if int(f["version"]) != DRAWING_CACHE_VERSION:
+                    return False
+                if tuple(f["volume_shape"]) != tuple(self.volume_shape):
+                    return False
+                keys, offsets, indices = f["keys"], f["offsets"], f["indices"]
+        except Exception:
+            return False
+
+        with self.__lock:
+            if self.__used == 0:
+                # // the loaded buffer is used as it is
+                self.__buffer = indices.astype(self.dtype, copy=False)
+                self.__used = len(indices)
+                self.__entries = {
+                    str(key): (int(offsets[i]), int(offsets[i + 1]))
+                    for i, key in enumerate(keys)
+                }
+                return True
+
+            for i, key in enumerate(keys):
+                if str(key) not in self.__entries:
+                    self.__append(
+                        str(key), indices[offsets[i] : offsets[i + 1]]
+                    )
+
+        return True
+
+    def save(self, path: Union[str, Path], keys: Iterable[str] = None):
+        # // only the given keys, e.g. those of the current roots, are saved
+        with self.__lock:
+            keys = self.__entries.keys() if keys is None else keys
+            keys = [k for k in keys if k in self.__entries]
+            arrays = [self.__buffer[slice(*self.__entries[k])] for k in keys]
+
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(a) for a in arrays])
+
+        # // written to a temporary file first, not to leave a broken cache
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            version=DRAWING_CACHE_VERSION,
+            volume_shape=np.array(self.volume_shape, dtype=np.int64),
+            keys=np.array(keys, dtype=str),
+            offsets=offsets,
+            indices=(
+                np.concatenate(arrays) if arrays else np.zeros(0, self.dtype)
+            ),
+        )
+        os.replace(tmp_path, path)
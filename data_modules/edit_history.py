@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+from copy import deepcopy
+from typing import Dict, Final, List, Tuple
+
+from DATA.RSA.components.rinfo import RootNode, RSA_Vector
+
+DEFAULT_MAX_STATES: Final[int] = 200
+DEFAULT_MAX_BYTES: Final[int] = 256 * 1024**2
+
+# // a rough size of a point in nested lists of python integers
+_POINT_BYTES: Final[int] = 200
+
+
+class RootSnapshot(object):
+    # // a root with its relays and derived polylines
+    # // Snapshots of unchanged roots are shared between the states, and
+    # // the polylines are restored as they are, without interpolation.
+    # // The completed polyline may be None, e.g. replayed from the journal.
+    def __init__(
+        self,
+        ID: int,
+        annotations: dict,
+        relays: Tuple,
+        interpolated: list,
+        completed: list = None,
+    ):
+        self.ID = ID
+        self.annotations = annotations
+        self.relays = relays
+        self.interpolated = interpolated
+        self.completed = completed
+        self.nbytes = (len(interpolated) + len(completed or [])) * (
+            _POINT_BYTES
+        )
+
+    @classmethod
+    def from_root_node(cls, root_node: RootNode, relays: Tuple):
+        annotations = deepcopy(root_node.annotations)
+        annotations.pop("polyline", None)
+
+        return cls(
+            root_node.ID,
+            annotations,
+            relays,
+            interpolated=root_node.interpolated_polyline(),
+            completed=root_node.completed_polyline(),
+        )
+
+    @staticmethod
+    def relays_of(root_node: RootNode):
+        return tuple(deepcopy(relay.annotations) for relay in root_node)
+
+    def is_same(self, root_node: RootNode, relays: Tuple):
+        return (
+            self.ID == root_node.ID
+            and self.interpolated is root_node.interpolated_polyline()
+            and self.relays == relays
+        )
+
+
+class BaseSnapshot(object):
+    def __init__(self, ID: int, annotations: dict, roots: Tuple):
+        self.ID = ID
+        self.annotations = annotations
+        self.roots = roots
+
+
+class EditState(object):
+    # // interpolation: the label of the interpolation of the RSA vector,
+    # // which is changed by re-interpolation
+    def __init__(
+        self,
+        bases: Tuple[BaseSnapshot, ...],
+        label: str,
+        interpolation: str = None,
+    ):
+        self.bases = bases
+        self.label = label
+        self.interpolation = interpolation
+
+    def root_snapshots(self):
+        return [root for base in self.bases for root in base.roots]
+
+
+class EditHistory(object):
+    # // undo and redo of the node operations by snapshots of the RSA vector
+    # // Memory is bounded by the number of states and by the bytes of the
+    # // distinct root snapshots; the oldest states are coalesced into the
+    # // first one when either is exceeded.
+    def __init__(
+        self,
+        max_states: int = DEFAULT_MAX_STATES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.max_states = max_states
+        self.max_bytes = max_bytes
+        self.__states: List[EditState] = []
+        self.__index = -1
+        self.__refcounts: Dict[int, int] = {}
+        self.__nbytes = 0
+
+    def __len__(self):
+        return len(self.__states)
+
+    def nbytes(self):
+        return self.__nbytes
+
+    def clear(self):
+        self.__states.clear()
+        self.__index = -1
+        self.__refcounts.clear()
+        self.__nbytes = 0
+
+    def reset(self, RSA_vector: RSA_Vector):
+        # // e.g. after loading; the current state can not be undone
+        self.clear()
+        self.push(RSA_vector, label="")
+
+    def snapshot(self, RSA_vector: RSA_Vector, label: str) -> EditState:
+        current = self.current()
+        previous = {}
+        if current is not None:
+            for base in current.bases:
+                for root in base.roots:
+                    previous[(base.ID, root.ID)] = root
+
+        bases = []
+        for base_node in RSA_vector:
+            roots = []
+            for root_node in base_node:
+                relays = RootSnapshot.relays_of(root_node)
+                root = previous.get((base_node.ID, root_node.ID), None)
+                if root is None or not root.is_same(root_node, relays):
+                    root = RootSnapshot.from_root_node(root_node, relays)
+                roots.append(root)
+
+            bases.append(
+                BaseSnapshot(
+                    base_node.ID,
+                    deepcopy(base_node.annotations),
+                    tuple(roots),
+                )
+            )
+
+        return EditState(
+            tuple(bases),
+            label=label,
+            interpolation=RSA_vector.annotations.interpolation(),
+        )
+
+    def is_unchanged(self, state: EditState):
+        current = self.current()
+        if current is None or len(current.bases) != len(state.bases):
+            return False
+        if current.interpolation != state.interpolation:
+            return False
+
+        for a, b in zip(current.bases, state.bases):
+            if a.ID != b.ID or a.annotations != b.annotations:
+                return False
+            if len(a.roots) != len(b.roots):
+                return False
+            if any(x is not y for x, y in zip(a.roots, b.roots)):
+                return False
+
+        return True
+
+    def push(self, RSA_vector: RSA_Vector, label: str):
+        state = self.snapshot(RSA_vector, label=label)
+
+        # // e.g. a relay node could not be added without a selected root
+        if self.is_unchanged(state):
+            return
+
+        # // the states undone are discarded
+        while len(self.__states) > self.__index + 1:
+            self.__release(self.__states.pop())
+
+        self.__states.append(state)
+        self.__index = len(self.__states) - 1
+        for root in state.root_snapshots():
+            count = self.__refcounts.get(id(root), 0)
+            if count == 0:
+                self.__nbytes += root.nbytes
+            self.__refcounts[id(root)] = count + 1
+
+        while len(self.__states) > 2 and (
+            len(self.__states) > self.max_states
+            or self.__nbytes > self.max_bytes
+        ):
+            self.__coalesce_oldest()
+
+    def __release(self, state: EditState):
+        for root in state.root_snapshots():
+            count = self.__refcounts[id(root)] - 1
+            if count == 0:
+                del self.__refcounts[id(root)]
+                self.__nbytes -= root.nbytes
+            else:
+                self.__refcounts[id(root)] = count
+
+    def __coalesce_oldest(self):
+        # // the second state becomes the first one, and the first one is
+        # // dropped with the roots referred to only by it
+        self.__release(self.__states.pop(0))
+        self.__states[0].label = ""
+        self.__index = max(self.__index - 1, 0)
+
+    def current(self):
+        if self.__index < 0:
+            return None
+        return self.__states[self.__index]
+
+    def can_undo(self):
+        return self.__index > 0
+
+    def can_redo(self):
+        return self.__index + 1 < len(self.__states)
+
+    def undo(self):
+        # // the state to be restored, and the label of the undone operation
+        if not self.can_undo():
+            return None, None
+        label = self.__states[self.__index].label
+        self.__index -= 1
+        return self.__states[self.__index], label
+
+    def redo(self):
+        if not self.can_redo():
+            return None, None
+        self.__index += 1
+        state = self.__states[self.__index]
+        return state, state.label
+
+    @staticmethod
+    def restore(RSA_vector: RSA_Vector, state: EditState):
+        # // the nodes are rebuilt with the polylines of the snapshots
+        if state.interpolation is not None:
+            RSA_vector.annotations.set_interpolation(state.interpolation)
+        list.clear(RSA_vector)
+        for base in state.bases:
+            RSA_vector.append(
+                annotations=deepcopy(base.annotations), baseID=base.ID
+            )
+            base_node = RSA_vector.base_node(baseID=base.ID)
+            for root in base.roots:
+                annotations = dict(root.annotations)
+                annotations["polyline"] = root.interpolated
+                ID_string = base_node.append(
+                    annotations=annotations, rootID=root.ID
+                )
+                root_node = RSA_vector.root_node(ID_string=ID_string)
+                root_node.extend_relays([dict(r) for r in root.relays])
+                root_node.set_interpolated_polyline(root.interpolated)
+                root_node.set_completed_polyline(root.completed)
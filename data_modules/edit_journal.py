@@ -0,0 +1,318 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import queue
+import threading
+from pathlib import Path
+from typing import Final, List, Optional, Tuple, Union
+
+import numpy as np
+
+from data_modules.edit_history import BaseSnapshot, EditState, RootSnapshot
+
+JOURNAL_VERSION: Final[int] = 1
+JOURNAL_SUFFIX: Final[str] = ".journal"
+DEFAULT_COMPACT_INTERVAL: Final[int] = 256
+
+
+def journal_path(rinfo_file: Union[str, Path]) -> Path:
+    # // e.g. scan.rinfo -> scan.journal
+    return Path(rinfo_file).with_suffix(JOURNAL_SUFFIX)
+
+
+def file_fingerprint(path: Union[str, Path]) -> Optional[dict]:
+    # // the rinfo file a journal is based on
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _default(obj):
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"{type(obj)} is not JSON serializable")
+
+
+def state_delta(
+    previous: Optional[EditState], state: EditState, label: str = ""
+) -> dict:
+    # // the bases and roots added, changed, or deleted
+    # // Roots are compared by identity, since the edit history shares the
+    # // unchanged ones between the states. Without the previous state, the
+    # // record resets the whole state.
+    record = {"label": label}
+    previous_bases, previous_roots = {}, {}
+    if previous is None or previous.interpolation != state.interpolation:
+        record["interpolation"] = state.interpolation
+    if previous is None:
+        record["reset"] = True
+    else:
+        for base in previous.bases:
+            previous_bases[base.ID] = base
+            for root in base.roots:
+                previous_roots[(base.ID, root.ID)] = root
+
+    bases, roots = [], []
+    current_bases, current_roots = set(), set()
+    for base in state.bases:
+        current_bases.add(base.ID)
+        previous_base = previous_bases.get(base.ID, None)
+        if (
+            previous_base is None
+            or previous_base.annotations != base.annotations
+        ):
+            bases.append([base.ID, base.annotations])
+
+        for root in base.roots:
+            current_roots.add((base.ID, root.ID))
+            if previous_roots.get((base.ID, root.ID), None) is not root:
+                roots.append(
+                    [
+                        base.ID,
+                        root.ID,
+                        root.annotations,
+                        list(root.relays),
+                        root.interpolated,
+                    ]
+                )
+
+    record["bases"] = bases
+    record["roots"] = roots
+    record["deleted_bases"] = sorted(set(previous_bases) - current_bases)
+    record["deleted_roots"] = [
+        list(key)
+        for key in sorted(set(previous_roots) - current_roots)
+        if key[0] in current_bases
+    ]
+    return record
+
+
+def is_empty_delta(record: dict) -> bool:
+    return (
+        not record.get("reset", False)
+        and "interpolation" not in record
+        and not any(
+            record[k]
+            for k in ("bases", "roots", "deleted_bases", "deleted_roots")
+        )
+    )
+
+
+def apply_delta(state: Optional[EditState], record: dict) -> EditState:
+    bases, roots = {}, {}
+    interpolation = state.interpolation if state is not None else None
+    if state is not None and not record.get("reset", False):
+        for base in state.bases:
+            bases[base.ID] = base.annotations
+            for root in base.roots:
+                roots[(base.ID, root.ID)] = root
+
+    for baseID in record["deleted_bases"]:
+        bases.pop(baseID, None)
+    for baseID, rootID in record["deleted_roots"]:
+        roots.pop((baseID, rootID), None)
+    for baseID, base_annotations in record["bases"]:
+        bases[baseID] = base_annotations
+    for baseID, rootID, root_annotations, relays, polyline in record["roots"]:
+        roots[(baseID, rootID)] = RootSnapshot(
+            rootID, root_annotations, tuple(relays), interpolated=polyline
+        )
+
+    # // in the order of the IDs, as loaded from rinfo files
+    return EditState(
+        tuple(
+            BaseSnapshot(
+                baseID,
+                bases[baseID],
+                tuple(roots[key] for key in sorted(roots) if key[0] == baseID),
+            )
+            for baseID in sorted(bases)
+        ),
+        label=record["label"],
+        interpolation=record.get("interpolation", interpolation),
+    )
+
+
+def _read_journal(path: Union[str, Path]):
+    # // (header, records, bytes of the valid records)
+    # // A record torn by a crash ends the journal.
+    logger = logging.getLogger("edit_journal")
+    if not os.path.isfile(path):
+        return None, [], 0
+
+    header, records, length = None, [], 0
+    with open(path, "rb") as f:
+        for i, line in enumerate(f):
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError
+                record = json.loads(line)
+            except ValueError:
+                logger.warning(f"[Journal truncated] {path} (line {i + 1})")
+                break
+            if header is None:
+                header = record
+            else:
+                records.append(record)
+            length += len(line)
+
+    if header is None or header.get("version", None) != JOURNAL_VERSION:
+        return None, [], 0
+
+    return header, records, length
+
+
+def read_journal(path: Union[str, Path]) -> Tuple[Optional[dict], List]:
+    # // (header, records)
+    header, records, _ = _read_journal(path)
+    return header, records
+
+
+def replay_journal(
+    records: List[dict], state: Optional[EditState]
+) -> EditState:
+    for record in records:
+        state = apply_delta(state, record)
+    return state
+
+
+class EditJournal(object):
+    # // crash-safe autosave as an append-only journal of the node operations
+    # // Each operation appends the roots it changed to the journal, on top
+    # // of the rinfo file it is based on. The records are computed and
+    # // written by a background thread, so that a click costs a queue put
+    # // only. The journal is compacted into a single record periodically.
+    def __init__(self, compact_interval: int = DEFAULT_COMPACT_INTERVAL):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.compact_interval = compact_interval
+        self.__queue: "queue.Queue[tuple]" = queue.Queue()
+        self.__thread: threading.Thread = None
+
+        # // owned by the writer thread
+        self.__path: Path = None
+        self.__base: Optional[dict] = None
+        self.__file = None
+        self.__state: Optional[EditState] = None
+        self.__count = 0
+
+    def start(
+        self,
+        path: Union[str, Path],
+        state: EditState,
+        base: Optional[dict] = None,
+        append: bool = False,
+    ):
+        # // base: the fingerprint of the rinfo file the state is loaded
+        # // from, or None. An existing journal is replaced unless appended.
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run, daemon=True)
+            self.__thread.start()
+        self.__queue.put(("start", Path(path), state, base, append))
+
+    def record(
+        self, previous: Optional[EditState], state: EditState, label: str
+    ):
+        if self.__thread is None or previous is state:
+            return
+        self.__queue.put(("record", previous, state, label))
+
+    def stop(self):
+        # // the journal is kept for recovery, if not removed by start()
+        if self.__thread is None:
+            return
+        self.__queue.put(("stop",))
+        self.__thread.join()
+        self.__thread = None
+
+    def __run(self):
+        while True:
+            command = self.__queue.get()
+            try:
+                if command[0] == "start":
+                    self.__start(*command[1:])
+                elif command[0] == "record":
+                    self.__record(*command[1:])
+                else:
+                    self.__close()
+                    return
+
+                if self.__file is not None and self.__queue.empty():
+                    self.__file.flush()
+                    os.fsync(self.__file.fileno())
+            except Exception as e:
+                self.logger.error(f"[Autosave failed] {self.__path}: {e}")
+
+    def __start(self, path: Path, state, base, append: bool):
+        # // the operations recorded after the state, e.g. while the rinfo
+        # // file was written, are carried over to the new journal
+        latest = self.__state if path == self.__path else None
+        self.__close()
+        self.__path = path
+        self.__base = base
+        self.__state = state
+        self.__count = 0
+        if append:
+            # // a torn record is cut, not to hide the records after it
+            _, records, length = _read_journal(path)
+            self.__count = len(records)
+            self.__file = open(path, "a")
+            self.__file.truncate(length)
+        else:
+            if os.path.isfile(path):
+                os.remove(path)
+            if latest is not None and latest is not state:
+                self.__record(state, latest, "unsaved")
+
+    def __close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def __write(self, f, record: dict):
+        f.write(json.dumps(record, default=_default) + "\n")
+
+    def __record(self, previous, state, label: str):
+        if self.__path is None:
+            return
+
+        if self.__file is None:
+            # // the journal is created on the first operation; without a
+            # // rinfo file to be based on, it starts with the whole state
+            self.__file = open(self.__path, "w")
+            header = {"version": JOURNAL_VERSION, "base": self.__base}
+            self.__write(self.__file, header)
+            if self.__base is None:
+                previous = None
+
+        record = state_delta(previous, state, label=label)
+        if is_empty_delta(record):
+            self.__state = state
+            return
+
+        self.__write(self.__file, record)
+        self.__state = state
+        self.__count += 1
+
+        if self.__count >= self.compact_interval:
+            self.__compact()
+
+    def __compact(self):
+        # // the whole state in one record, replaced atomically
+        tmp_path = f"{self.__path}.tmp"
+        with open(tmp_path, "w") as f:
+            self.__write(f, {"version": JOURNAL_VERSION, "base": None})
+            self.__write(f, state_delta(None, self.__state, label=""))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.__close()
+        os.replace(tmp_path, self.__path)
+        self.__file = open(self.__path, "a")
+        self.__base = None
+        self.__count = 1
+        self.logger.debug(f"The journal was compacted: {self.__path}")
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from data_modules.root_voxels import RootVoxels
+
+
+class ProjectionLayer(object):
+    # // RGBA trace layer of one projection axis
+    # // Each root is projected once into a footprint, i.e. packed linear
+    # // indexes of the 2D layer. The footprints are cached until the
+    # // root's voxels are replaced, and a color change repaints only the
+    # // pixels owned by the recolored root.
+    def __init__(self, shape: Tuple[int, int], dimension: List[int]):
+        self.shape = tuple(shape)
+        self.dimension = dimension
+        self.index_dtype = (
+            np.uint32 if self.shape[0] * self.shape[1] < 2**32 else np.uint64
+        )
+
+        self.__sources: Dict[str, object] = {}
+        self.__footprints: Dict[str, np.ndarray] = {}
+        self.__colors: Dict[str, tuple] = {}
+        self.__slots: List[str] = []
+
+        # // the index of the root drawn on top of each pixel
+        self.__owner = np.full(self.shape[0] * self.shape[1], -1, np.int32)
+        self.__rgba = np.zeros((self.shape[0] * self.shape[1], 4), np.uint8)
+
+    def footprint(self, voxels: RootVoxels) -> np.ndarray:
+        if list(self.dimension) == [1, 2]:
+            # // along z, the indexes within a slice
+            return np.unique(voxels.indices % voxels.plane_size).astype(
+                self.index_dtype
+            )
+
+        arrays = voxels.zyx()
+        a = arrays[self.dimension[0]].astype(self.index_dtype)
+        b = arrays[self.dimension[1]].astype(self.index_dtype)
+        return np.unique(a * self.shape[1] + b)
+
+    def update(self, df_dict_for_drawing: dict) -> bool:
+        # // returns True if any pixel was repainted
+        keys = list(df_dict_for_drawing.keys())
+        geometry_changed = keys != self.__slots
+
+        for key in keys:
+            voxels = df_dict_for_drawing[key]["voxels"]
+            if self.__sources.get(key, None) is not voxels:
+                self.__sources[key] = voxels
+                self.__footprints[key] = self.footprint(voxels)
+                geometry_changed = True
+
+        for key in set(self.__sources.keys()) - set(keys):
+            del self.__sources[key]
+            del self.__footprints[key]
+            self.__colors.pop(key, None)
+
+        if geometry_changed:
+            self.__slots = keys
+            self.__colors = {
+                k: tuple(df_dict_for_drawing[k]["color"]) for k in keys
+            }
+            self.__repaint_all()
+            return True
+
+        changed = False
+        for slot, key in enumerate(keys):
+            color = tuple(df_dict_for_drawing[key]["color"])
+            if self.__colors[key] != color:
+                self.__colors[key] = color
+                self.__repaint(slot, key)
+                changed = True
+
+        return changed
+
+    def __repaint_all(self):
+        # // later roots are drawn over earlier ones
+        self.__owner[:] = -1
+        for slot, key in enumerate(self.__slots):
+            self.__owner[self.__footprints[key]] = slot
+
+        color_table = np.zeros((len(self.__slots) + 1, 4), np.uint8)
+        for slot, key in enumerate(self.__slots):
+            color_table[slot] = self.__colors[key]
+        self.__rgba[:] = color_table[self.__owner]
+
+    def __repaint(self, slot: int, key: str):
+        footprint = self.__footprints[key]
+        visible = footprint[self.__owner[footprint] == slot]
+        self.__rgba[visible] = self.__colors[key]
+
+    def image(self) -> np.ndarray:
+        return self.__rgba.reshape(self.shape + (4,))
+
+    def composite(self, projection: np.ndarray) -> np.ndarray:
+        # // alpha blending in integer arithmetic
+        rgba = self.image()
+        alpha = rgba[..., 3:4].astype(np.uint16)
+        gray = projection[..., np.newaxis].astype(np.uint16)
+        blended = gray * (255 - alpha) + rgba[..., 0:3] * alpha
+        return ((blended + 127) // 255).astype(np.uint8)
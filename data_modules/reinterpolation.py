@@ -0,0 +1,294 @@
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from DATA.RSA.components.rinfo import (
+    ID_Object,
+    RinfoFiles,
+    RSA_traits_table,
+    RSA_Vector,
+)
+from DATA.RSA.components.volume import Volume
+from modules.atomic_write import atomic_write
+from modules.volume import (
+    TAR_EXTENSIONS,
+    TIFF_EXTENSIONS,
+    create_executor,
+    get_volume_loader,
+    is_volume_file,
+)
+
+
+class SharedVolume(object):
+    # // a volume shared read-only with the worker processes
+    # // The volume is written into a temporary .npy file, which the workers
+    # // open as a memmap. A volume loader is decoded directly into it.
+    def __init__(self, volume=None, loader=None, slab_depth: int = 16):
+        self.__directory = tempfile.mkdtemp(prefix="rsatrace_")
+        self.path = os.path.join(self.__directory, "volume.npy")
+
+        spec = loader.probe() if loader is not None else None
+        if spec is not None:
+            shape, dtype = spec
+            out = np.lib.format.open_memmap(
+                self.path, mode="w+", dtype=dtype, shape=shape
+            )
+            for _ in loader.load_iterably(out=out):
+                pass
+        else:
+            if loader is not None:
+                # // e.g. chunked volumes, copied slab by slab
+                volume = loader.load()
+            out = np.lib.format.open_memmap(
+                self.path, mode="w+", dtype=volume.dtype, shape=volume.shape
+            )
+            for z in range(0, volume.shape[0], slab_depth):
+                out[z : z + slab_depth] = volume[z : z + slab_depth]
+
+        out.flush()
+        del out
+
+    def close(self):
+        shutil.rmtree(self.__directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _WorkerComponents(object):
+    # // the part of RSA_Components read by the interpolation classes
+    def __init__(self, volume_path: str = None):
+        self.volume = Volume(parent=self)
+        if volume_path is not None:
+            self.volume.init_from_volume(np.load(volume_path, mmap_mode="r"))
+
+
+# // opened once for each worker process
+_worker_components: Dict[str, _WorkerComponents] = {}
+
+
+def _interpolate(task):
+    interpolation_cls, volume_path, raw_polyline = task
+    components = _worker_components.get(volume_path, None)
+    if components is None:
+        _worker_components.clear()
+        components = _WorkerComponents(volume_path)
+        _worker_components[volume_path] = components
+
+    return interpolation_cls(components).interpolate(raw_polyline)
+
+
+class RootReinterpolation(object):
+    # // re-interpolation of the roots of an RSA vector
+    # // The roots are distributed across a process pool. The results are
+    # // applied to the RSA vector by apply(), e.g. in the GUI thread.
+    # // ID_strings: the roots to re-interpolate, or None for all roots
+    def __init__(
+        self,
+        RSA_vector: RSA_Vector,
+        interpolation_cls,
+        volume=None,
+        volume_loader=None,
+        ID_strings: List[ID_Object] = None,
+    ):
+        self.RSA_vector = RSA_vector
+        self.interpolation_cls = interpolation_cls
+        self.volume = volume
+        self.volume_loader = volume_loader
+        self.ID_strings = None if ID_strings is None else set(ID_strings)
+        self.results: Dict[ID_Object, List[List[int]]] = {}
+
+    def root_nodes(self):
+        # // roots without relays have no polyline to interpolate
+        return [
+            root_node
+            for base_node in self.RSA_vector
+            for root_node in base_node
+            if len(root_node) != 0
+            and (
+                self.ID_strings is None
+                or root_node.ID_string() in self.ID_strings
+            )
+        ]
+
+    def __shared_volume(self):
+        if not getattr(self.interpolation_cls, "requires_volume", True):
+            return nullcontext(None)
+        if self.volume is None and self.volume_loader is None:
+            raise Exception(
+                f"{self.interpolation_cls.label} requires the volume."
+            )
+        return SharedVolume(volume=self.volume, loader=self.volume_loader)
+
+    def run_iterably(
+        self, executor: ProcessPoolExecutor = None
+    ) -> Iterator[Tuple[int, int]]:
+        root_nodes = self.root_nodes()
+        total = len(root_nodes)
+        self.results.clear()
+        if total == 0:
+            return
+
+        own_executor = executor is None
+        executor = executor or create_executor()
+        try:
+            with self.__shared_volume() as shared:
+                volume_path = shared.path if shared is not None else None
+                tasks = [
+                    (
+                        self.interpolation_cls,
+                        volume_path,
+                        root_node.raw_polyline(),
+                    )
+                    for root_node in root_nodes
+                ]
+                for i, polyline in enumerate(
+                    executor.map(_interpolate, tasks)
+                ):
+                    self.results[root_nodes[i].ID_string()] = polyline
+                    yield i + 1, total
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+    def run(self, executor: ProcessPoolExecutor = None):
+        for _ in self.run_iterably(executor=executor):
+            pass
+
+        return self
+
+    def apply(self):
+        for ID_string, polyline in self.results.items():
+            root_node = self.RSA_vector[ID_string]
+            if root_node is not None:
+                root_node.set_interpolated_polyline(polyline)
+
+        self.RSA_vector.annotations.set_interpolation(
+            self.interpolation_cls.label
+        )
+
+
+def find_volume_path(rinfo_file: Union[str, Path]) -> Union[Path, None]:
+    # // the volume saved beside the rinfo file (see DATA.RSA.components.file)
+    rinfo_file = Path(rinfo_file)
+    stem = Path(rinfo_file.parent, rinfo_file.name[: -len(".rinfo")])
+
+    if stem.is_dir():
+        if get_volume_loader(stem).is_valid_volume():
+            return stem
+        # // a directory of labeled volumes; the first one is used
+        for d in sorted(os.listdir(stem)):
+            d = Path(stem, d)
+            if d.is_dir() or is_volume_file(d):
+                if get_volume_loader(d).is_valid_volume():
+                    return d
+
+    for ext in TAR_EXTENSIONS + TIFF_EXTENSIONS:
+        path = Path(str(stem) + ext)
+        if path.is_file():
+            return path
+
+    return None
+
+
+def reinterpolate_rinfo_files_iterably(
+    rinfo_files: List[Union[str, Path]],
+    interpolation_cls,
+    output_directory: Union[str, Path] = None,
+    max_workers: int = None,
+):
+    # // yields (i, total, rinfo_file, RSA_vector or None); the rinfo files
+    # // are overwritten unless output_directory is given
+    logger = logging.getLogger("reinterpolation")
+    total = len(rinfo_files)
+
+    with create_executor(max_workers=max_workers) as executor:
+        for i, rinfo_file in enumerate(rinfo_files):
+            RSA_vector = RSA_Vector()
+            if not RSA_vector.load_from_file(
+                fname=str(rinfo_file), complete_polylines=False
+            ):
+                yield i + 1, total, rinfo_file, None
+                continue
+
+            volume_loader = None
+            if getattr(interpolation_cls, "requires_volume", True):
+                volume_path = find_volume_path(rinfo_file)
+                if volume_path is None:
+                    logger.error(f"[Volume not found] {rinfo_file}")
+                    yield i + 1, total, rinfo_file, None
+                    continue
+                volume_loader = get_volume_loader(volume_path)
+
+            reinterpolation = RootReinterpolation(
+                RSA_vector,
+                interpolation_cls,
+                volume_loader=volume_loader,
+            )
+            reinterpolation.run(executor=executor)
+            reinterpolation.apply()
+
+            dst_file = Path(rinfo_file)
+            if output_directory is not None:
+                os.makedirs(output_directory, exist_ok=True)
+                dst_file = Path(output_directory, dst_file.name)
+            RSA_vector.save(str(dst_file))
+
+            yield i + 1, total, rinfo_file, RSA_vector
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    from mod import Interpolation, RSATraits
+
+    interpolation = Interpolation()
+    labels = interpolation.class_container.labels()
+
+    parser = argparse.ArgumentParser(
+        description="Re-interpolate all roots of rinfo files."
+    )
+    parser.add_argument("method", type=str, help=f"one of {labels}")
+    parser.add_argument(
+        "src", type=str, nargs="+", help="rinfo files or directories"
+    )
+    parser.add_argument("-o", "--output", type=str, help="output directory")
+    parser.add_argument(
+        "--traits", type=str, help="csv file for the RSA traits"
+    )
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    interpolation_cls = interpolation.get(args.method)
+    if interpolation_cls is None:
+        parser.error(f"Unknown interpolation method: {args.method}")
+
+    RSA_vectors = []
+    rinfo_files = RinfoFiles(args.src).list_files()
+    for i, total, rinfo_file, RSA_vector in reinterpolate_rinfo_files_iterably(
+        rinfo_files,
+        interpolation_cls,
+        output_directory=args.output,
+        max_workers=args.workers,
+    ):
+        if RSA_vector is not None:
+            RSA_vectors.append(RSA_vector)
+            logging.info(f"[Re-interpolated] ({i} / {total}) {rinfo_file}")
+
+    if args.traits is not None and len(RSA_vectors) != 0:
+        table = RSA_traits_table(RSA_vectors, RSATraits())
+        atomic_write(args.traits, table.write_csv, mode="wb")
+        logging.info(f"[Saving succeeded] {args.traits}")
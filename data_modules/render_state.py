@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from typing import Dict, List
+
+import config
+from DATA.RSA.components.rinfo import ID_Object
+
+
+def _rgb(color_name: str):
+    # // "#rrggbb" -> (r, g, b)
+    return tuple(int(color_name[i : i + 2], 16) for i in (1, 3, 5))
+
+
+class RenderState(object):
+    # // colors of the drawn roots, kept apart from their geometry
+    # // (df_dict_for_drawing). A selection change is applied as a diff;
+    # // only the roots whose color depends on the old or new selection
+    # // are recolored.
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.selected_ID_string: ID_Object = None
+        self.__colors: Dict[str, tuple] = {}
+        self.__palette = None
+
+    def palette(self):
+        return (config.COLOR_ROOT, config.COLOR_SELECTED_ROOT)
+
+    def color_of(self, ID_string: ID_Object, selected_ID_string: ID_Object):
+        if selected_ID_string is None:
+            return _rgb(config.COLOR_ROOT) + (150,)
+        if ID_string.baseID() != selected_ID_string.baseID():
+            return _rgb(config.COLOR_SELECTED_ROOT) + (40,)
+        if (
+            not selected_ID_string.is_base()
+            and ID_string == selected_ID_string.to_root()
+        ):
+            return _rgb(config.COLOR_SELECTED_ROOT) + (150,)
+        return _rgb(config.COLOR_ROOT) + (150,)
+
+    def __is_affected(self, ID_string: ID_Object, previous, selected):
+        # // the color depends on the base of the selection only
+        for s in (previous, selected):
+            if s is None or ID_string.baseID() == s.baseID():
+                return True
+        return False
+
+    def select(
+        self, selected_ID_string: ID_Object, df_dict_for_drawing: dict
+    ) -> List[str]:
+        # // recolors the entries of df_dict_for_drawing in place, and
+        # // returns the recolored keys
+        previous = self.selected_ID_string
+        self.selected_ID_string = selected_ID_string
+
+        if self.__palette != self.palette():
+            self.__palette = self.palette()
+            self.__colors.clear()
+
+        changed = []
+        for key, vars in df_dict_for_drawing.items():
+            ID_string = ID_Object(key)
+            assigned = self.__colors.get(key, None)
+            if (
+                assigned is not None
+                and tuple(vars["color"]) == assigned
+                and not self.__is_affected(
+                    ID_string, previous, selected_ID_string
+                )
+            ):
+                continue
+
+            color = self.color_of(ID_string, selected_ID_string)
+            self.__colors[key] = color
+            if tuple(vars["color"]) != color:
+                vars["color"] = color
+                changed.append(key)
+
+        for key in set(self.__colors.keys()) - set(df_dict_for_drawing):
+            del self.__colors[key]
+
+        return changed
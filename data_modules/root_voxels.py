@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+from typing import List, Tuple
+
+import numpy as np
+
+
+def voxel_index_dtype(volume_shape: Tuple[int, ...]):
+    # // 4 bytes per voxel, unless the volume has 2**32 voxels or more
+    if int(np.prod(volume_shape[:3], dtype=np.uint64)) < 2**32:
+        return np.dtype(np.uint32)
+    return np.dtype(np.uint64)
+
+
+class RootVoxels(object):
+    # // voxels of a root as sorted packed linear indexes into the volume
+    # // Since z is the slowest axis, the voxels of a slice or of a z range
+    # // are found by a pair of binary searches. The indexes are usually a
+    # // read-only view of the buffer of a DrawingCache.
+    __slots__ = ("indices", "volume_shape")
+
+    def __init__(self, indices: np.ndarray, volume_shape: Tuple[int, ...]):
+        self.volume_shape = tuple(volume_shape[:3])
+        self.indices = indices
+
+    @classmethod
+    def union(cls, voxels_list: List[RootVoxels], volume_shape):
+        # // e.g. all roots, for the trace images
+        dtype = voxel_index_dtype(volume_shape)
+        if len(voxels_list) == 0:
+            return cls(np.zeros(0, dtype=dtype), volume_shape)
+        return cls(
+            np.unique(np.concatenate([v.indices for v in voxels_list])),
+            volume_shape,
+        )
+
+    def __len__(self):
+        return len(self.indices)
+
+    @property
+    def plane_size(self):
+        return self.volume_shape[1] * self.volume_shape[2]
+
+    def z_range(self, z_start: int, z_stop: int) -> np.ndarray:
+        # // the indexes of the voxels in [z_start, z_stop)
+        # // The bounds have the dtype of the indexes, not to cast and copy
+        # // the indexes on each search; they are clipped to fit the dtype.
+        z_start = min(max(z_start, 0), self.volume_shape[0])
+        z_stop = min(max(z_stop, z_start), self.volume_shape[0])
+        bounds = np.array(
+            [z_start * self.plane_size, z_stop * self.plane_size],
+            dtype=self.indices.dtype,
+        )
+        start, stop = np.searchsorted(self.indices, bounds)
+        return self.indices[start:stop]
+
+    def points_at(self, z: int) -> Tuple[np.ndarray, np.ndarray]:
+        # // (y, x) of the voxels in a slice, as signed coordinates
+        local = self.z_range(z, z + 1).astype(np.int64) - z * self.plane_size
+        return np.divmod(local, self.volume_shape[2])
+
+    def yx(self) -> Tuple[np.ndarray, np.ndarray]:
+        # // (y, x) of all voxels, i.e. projected along z
+        local = self.indices.astype(np.int64) % self.plane_size
+        return np.divmod(local, self.volume_shape[2])
+
+    def zyx(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return np.unravel_index(self.indices, self.volume_shape)
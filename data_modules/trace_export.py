@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Final, List, Tuple, Union
+
+import numpy as np
+
+from DATA.RSA.components.rinfo import RSA_Vector
+from data_modules.df_for_drawing import dilate_polyline
+from data_modules.root_voxels import RootVoxels
+from modules.lazy_import import lazy_import
+from modules.volume import default_worker_count
+
+imageio = lazy_import("imageio.v3")
+
+# // the dilation radius of the traced points, in the GUI and without it;
+# // the measured root radii are not used, since they need the volume
+TRACE_DOT_SIZE: Final[int] = 3
+
+
+class TraceImageExporter(object):
+    # // trace images are rasterized slice by slice, and encoded and
+    # // written by a thread pool
+    # // The full 3D mask is never materialized; the voxels of a slice are
+    # // found in the sorted indexes of all roots.
+    def __init__(
+        self,
+        points: RootVoxels,
+        volume_shape: Tuple[int, int, int],
+        digits: int = 4,
+        extension: str = "png",
+        max_workers: int = None,
+    ):
+        assert points.volume_shape == tuple(volume_shape[:3])
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.points = points
+        self.volume_shape = tuple(volume_shape)
+        self.digits = digits
+        self.extension = extension
+        self.max_workers = max_workers or default_worker_count()
+        self.__cancel_event = threading.Event()
+
+    def cancel(self):
+        self.__cancel_event.set()
+
+    def is_cancelled(self):
+        return self.__cancel_event.is_set()
+
+    def rasterize(self, z: int) -> np.ndarray:
+        img = np.zeros(self.volume_shape[1:3], dtype=np.uint8)
+        y_array, x_array = self.points.points_at(z)
+        img[y_array, x_array] = 255
+        return img
+
+    def slice_path(self, dst_path: Path, z: int):
+        return Path(
+            dst_path, f"img{str(z).zfill(self.digits)}.{self.extension}"
+        )
+
+    def __write_slice(self, dst_path: Path, z: int):
+        imageio.imwrite(self.slice_path(dst_path, z), self.rasterize(z))
+
+    def export_iterably(self, dst_path: Union[str, Path]):
+        # // the destination directory is removed when cancelled
+        dst_path = Path(dst_path)
+        if dst_path.exists():
+            raise Exception(f"{dst_path} already exists.")
+        os.makedirs(dst_path)
+
+        total = self.volume_shape[0]
+        max_pending = self.max_workers * 4
+        done = 0
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                pending = set()
+                for z in range(total):
+                    if self.is_cancelled():
+                        break
+
+                    pending.add(
+                        executor.submit(self.__write_slice, dst_path, z)
+                    )
+                    if len(pending) < max_pending:
+                        continue
+
+                    finished, pending = wait(
+                        pending, return_when=FIRST_COMPLETED
+                    )
+                    for future in finished:
+                        future.result()
+                        done += 1
+                        yield done, total
+
+                for future in pending:
+                    future.result()
+                    done += 1
+                    yield done, total
+        finally:
+            if self.is_cancelled() or done != total:
+                shutil.rmtree(dst_path, ignore_errors=True)
+
+    def export(self, dst_path: Union[str, Path]):
+        for _ in self.export_iterably(dst_path):
+            pass
+
+        return not self.is_cancelled()
+
+
+def points_from_RSA_vector(
+    RSA_vector,
+    volume_shape: Tuple[int, int, int],
+    size: int = TRACE_DOT_SIZE,
+):
+    voxels_list: List[RootVoxels] = []
+    for base_node in RSA_vector:
+        for root_node in base_node:
+            polyline = root_node.completed_polyline()
+            if len(polyline) == 0:
+                continue
+            indices = dilate_polyline(
+                polyline, volume_shape=volume_shape, size=size
+            )
+            voxels_list.append(RootVoxels(indices, volume_shape))
+
+    return RootVoxels.union(voxels_list, volume_shape)
+
+
+def export_trace_images_from_rinfo(
+    rinfo_path: Union[str, Path],
+    dst_path: Union[str, Path] = None,
+    volume_shape: Tuple[int, int, int] = None,
+    max_workers: int = None,
+):
+    # // headless export without the GUI
+    logger = logging.getLogger("export_trace_images")
+
+    RSA_vector = RSA_Vector()
+    if RSA_vector.load_from_file(fname=str(rinfo_path)) is False:
+        return False
+
+    volume_shape = volume_shape or RSA_vector.annotations.volume_shape()
+    if volume_shape is None:
+        logger.error(f"[Volume shape unknown] {rinfo_path}")
+        return False
+    volume_shape = tuple(volume_shape[:3])
+
+    if dst_path is None:
+        rinfo_path = Path(rinfo_path)
+        stem = rinfo_path.name[: -len(".rinfo")]
+        dst_path = Path(rinfo_path.parent, f"{stem}_trace")
+
+    exporter = TraceImageExporter(
+        points=points_from_RSA_vector(RSA_vector, volume_shape),
+        volume_shape=volume_shape,
+        max_workers=max_workers,
+    )
+    exporter.export(dst_path)
+    logger.info(f"[Saving succeeded] {dst_path}")
+    return True
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description="Export trace images of rinfo files."
+    )
+    parser.add_argument("src", type=str, nargs="+", help="rinfo files")
+    parser.add_argument("-o", "--output", type=str, help="output directory")
+    parser.add_argument(
+        "--shape", type=int, nargs=3, help="volume shape (z, y, x)"
+    )
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.output is not None and len(args.src) != 1:
+        parser.error("--output is available for a single rinfo file.")
+
+    for src in args.src:
+        export_trace_images_from_rinfo(
+            src,
+            dst_path=args.output,
+            volume_shape=args.shape,
+            max_workers=args.workers,
+        )
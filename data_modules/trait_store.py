@@ -0,0 +1,341 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Final, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from DATA.RSA.components.rinfo import (
+    RinfoFiles,
+    RSA_traits_table,
+    RSA_Vector,
+    root_traits_format,
+    trait_series,
+)
+from modules.atomic_write import atomic_write
+from modules.lazy_import import lazy_import
+from modules.volume import create_executor
+
+pl = lazy_import("polars")
+
+TRAIT_STORE_VERSION: Final[int] = 2
+TRAIT_STORE_FILE_NAME: Final[str] = "rsatrace_traits.sqlite"
+
+# // the trait classes, loaded once for each worker process
+_worker_traits = {}
+
+
+def _default(obj):
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"{type(obj)} is not JSON serializable")
+
+
+def _file_traits(rinfo_file: str):
+    # // (volume name, RSA traits, root traits) of a rinfo file, or None
+    if len(_worker_traits) == 0:
+        from mod import RootTraits, RSATraits
+
+        _worker_traits["RSA"] = RSATraits()
+        _worker_traits["root"] = RootTraits()
+
+    RSA_vector = RSA_Vector()
+    try:
+        if not RSA_vector.load_from_file(rinfo_file, complete_polylines=False):
+            return None
+    except (OSError, ValueError):
+        return None
+
+    RSA_row = RSA_traits_table([RSA_vector], _worker_traits["RSA"])
+    root_table = RSA_vector.root_traits_table(_worker_traits["root"])
+    return (
+        str(RSA_vector.annotations.volume_name()),
+        json.dumps(RSA_row.to_dict(as_series=False), default=_default),
+        json.dumps(root_table.to_dict(as_series=False), default=_default),
+    )
+
+
+def _source_digest(class_) -> str:
+    # // the source files of a trait class and of its bases, e.g. the
+    # // backbone; the version of a trait class is the RSAtrace version it
+    # // requires, and does not change with the calculation
+    digest = hashlib.sha1()
+    for cls in class_.__mro__:
+        if cls is object:
+            continue
+        try:
+            with open(inspect.getsourcefile(cls), "rb") as f:
+                digest.update(f.read())
+        except (OSError, TypeError):
+            digest.update(cls.__qualname__.encode())
+    return digest.hexdigest()
+
+
+def traits_signature(RSA_traits, root_traits) -> str:
+    # // the stored traits are recomputed if the source of a trait module
+    # // changes. Changes elsewhere, e.g. in how rinfo files are loaded,
+    # // need TRAIT_STORE_VERSION to be bumped, or the store to be deleted.
+    return json.dumps(
+        [TRAIT_STORE_VERSION]
+        + [[c.label, _source_digest(c)] for c in RSA_traits.class_container]
+        + [[c.label, _source_digest(c)] for c in root_traits.class_container]
+    )
+
+
+class TraitStore(object):
+    # // RSA and root traits of a cohort of rinfo files in a SQLite database
+    # // The files are indexed by path, size, and mtime, and the traits are
+    # // recomputed for new or changed files only, in worker processes.
+    # // Summaries and exports are read from the database.
+    def __init__(self, path: Union[str, Path], RSA_traits, root_traits):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        path = Path(path)
+        if path.is_dir():
+            path = Path(path, TRAIT_STORE_FILE_NAME)
+        self.path = path
+
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY, value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                volume_name TEXT,
+                RSA_traits TEXT,
+                root_traits TEXT
+            );
+            """)
+
+        signature = traits_signature(RSA_traits, root_traits)
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'traits'"
+        ).fetchone()
+        if row is None or row[0] != signature:
+            with self.connection:
+                self.connection.execute("DELETE FROM files")
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('traits', ?)",
+                    (signature,),
+                )
+
+    def __len__(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM files WHERE RSA_traits IS NOT NULL"
+        ).fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def changed_files(self, rinfo_files: List[str]) -> List[Tuple]:
+        # // (path, size, mtime_ns) of the new or changed files
+        known: Dict[str, Tuple[int, int]] = {
+            path: (size, mtime_ns)
+            for path, size, mtime_ns in self.connection.execute(
+                "SELECT path, size, mtime_ns FROM files"
+            )
+        }
+
+        changed = []
+        for rinfo_file in rinfo_files:
+            path = os.path.abspath(rinfo_file)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if known.get(path, None) != (stat.st_size, stat.st_mtime_ns):
+                changed.append((path, stat.st_size, stat.st_mtime_ns))
+
+        return changed
+
+    def prune(self):
+        # // the files deleted from the disk are dropped
+        paths = [
+            path
+            for (path,) in self.connection.execute("SELECT path FROM files")
+            if not os.path.isfile(path)
+        ]
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM files WHERE path = ?", [(p,) for p in paths]
+            )
+        return len(paths)
+
+    def update_iterably(
+        self,
+        sources: List[str],
+        executor: ProcessPoolExecutor = None,
+        max_workers: int = None,
+    ) -> Iterator[Tuple[int, int, str]]:
+        # // sources: rinfo files or directories, as in the summary window
+        yield from self.update_files_iterably(
+            RinfoFiles(sources).list_files(),
+            executor=executor,
+            max_workers=max_workers,
+        )
+
+    def update_files_iterably(
+        self,
+        rinfo_files: List[str],
+        executor: ProcessPoolExecutor = None,
+        max_workers: int = None,
+    ) -> Iterator[Tuple[int, int, str]]:
+        # // yields (i, total, rinfo_file) for the files recomputed
+        self.prune()
+        changed = self.changed_files(rinfo_files)
+        total = len(changed)
+        if total == 0:
+            return
+
+        own_executor = executor is None and total > 1 and max_workers != 1
+        if own_executor:
+            executor = create_executor(max_workers=max_workers)
+        map_ = executor.map if executor is not None else map
+        try:
+            paths = [path for path, _, _ in changed]
+            for i, result in enumerate(map_(_file_traits, paths)):
+                path, size, mtime_ns = changed[i]
+                volume_name, RSA_traits, root_traits = result or (None,) * 3
+                if result is None:
+                    self.logger.error(f"[Loading failed] {path}")
+
+                # // failed files are not retried until changed
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        path,
+                        size,
+                        mtime_ns,
+                        volume_name,
+                        RSA_traits,
+                        root_traits,
+                    ),
+                )
+                if (i + 1) % 64 == 0:
+                    self.connection.commit()
+                yield i + 1, total, path
+        finally:
+            self.connection.commit()
+            if own_executor:
+                executor.shutdown()
+
+    def update(self, sources: List[str], max_workers: int = None) -> int:
+        count = 0
+        for count, _, _ in self.update_iterably(
+            sources, max_workers=max_workers
+        ):
+            pass
+
+        return count
+
+    def __rows(self, column: str, paths: List[str] = None):
+        rows = self.connection.execute(
+            f"SELECT path, volume_name, {column} FROM files "
+            "WHERE RSA_traits IS NOT NULL ORDER BY path"
+        )
+        if paths is not None:
+            paths = {os.path.abspath(p) for p in paths}
+            rows = [row for row in rows if row[0] in paths]
+        return rows
+
+    def __table(self, column: str, paths: List[str], volume_name: bool):
+        # // the tables of the files are concatenated, and each column is
+        # // typed once over the cohort
+        columns = {"file": []}
+        if volume_name:
+            columns["volume name"] = []
+        count = 0
+        for path, name, traits in self.__rows(column, paths):
+            table = json.loads(traits)
+            n = max((len(v) for v in table.values()), default=0)
+            columns["file"].extend([path] * n)
+            if volume_name:
+                columns["volume name"].extend([name] * n)
+            for label, values in table.items():
+                columns.setdefault(label, [None] * count).extend(values)
+            count += n
+            for values in columns.values():
+                values.extend([None] * (count - len(values)))
+
+        return pl.DataFrame([trait_series(k, v) for k, v in columns.items()])
+
+    def RSA_traits_table(self, paths: List[str] = None):
+        # // a row for each file, as in the RSA summary window
+        return self.__table("RSA_traits", paths, volume_name=False)
+
+    def root_traits_table(self, paths: List[str] = None):
+        # // a row for each root, with the file and volume name columns
+        return self.__table("root_traits", paths, volume_name=True)
+
+
+def write_table(file_name: Union[str, Path], table):
+    # // csv, parquet, or arrow, by the file extension
+    format = root_traits_format(file_name)
+
+    def write(f):
+        if format == "csv":
+            table.write_csv(f)
+        elif format == "parquet":
+            table.write_parquet(f)
+        else:
+            table.write_ipc(f)
+
+    atomic_write(file_name, write, mode="wb")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    from mod import RootTraits, RSATraits
+
+    parser = argparse.ArgumentParser(
+        description="Update a trait store of rinfo files, and export it."
+    )
+    parser.add_argument(
+        "store", type=str, help="SQLite file or project directory"
+    )
+    parser.add_argument(
+        "src", type=str, nargs="*", help="rinfo files or directories"
+    )
+    parser.add_argument(
+        "--RSA-traits", type=str, help="csv, parquet, or arrow file"
+    )
+    parser.add_argument(
+        "--root-traits", type=str, help="csv, parquet, or arrow file"
+    )
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    with TraitStore(args.store, RSATraits(), RootTraits()) as store:
+        for i, total, rinfo_file in store.update_iterably(
+            args.src, max_workers=args.workers
+        ):
+            logging.info(f"[Traits updated] ({i} / {total}) {rinfo_file}")
+        logging.info(f"[Trait store] {len(store)} files in {store.path}")
+
+        if args.RSA_traits is not None:
+            write_table(args.RSA_traits, store.RSA_traits_table())
+            logging.info(f"[Saving succeeded] {args.RSA_traits}")
+        if args.root_traits is not None:
+            write_table(args.root_traits, store.root_traits_table())
+            logging.info(f"[Saving succeeded] {args.root_traits}")
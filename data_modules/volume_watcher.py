@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import logging
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple, Union
+
+from modules.chunked_volume import is_chunked_volume
+from modules.volume import (
+    VolumeLoader,
+    create_executor,
+    default_worker_count,
+    get_volume_loader,
+    is_volume_file,
+)
+from modules.volume_cache import (
+    build_volume_cache,
+    is_volume_cache,
+    load_cache_info,
+    source_fingerprint,
+    volume_cache_path,
+)
+
+
+def _build(volume_path: str, max_workers: int):
+    return str(build_volume_cache(volume_path, max_workers=max_workers))
+
+
+class VolumeWatcher(object):
+    # // polls watch roots for new volumes, and builds their caches (see
+    # // modules.volume_cache) in a process pool
+    # // A volume is built once its slice files are unchanged for
+    # // settle_polls polls, so that volumes still being written by the
+    # // scanner are left alone. Volumes are rebuilt when they change.
+    def __init__(
+        self,
+        roots: List[Union[str, Path]],
+        max_workers: int = None,
+        settle_polls: int = 2,
+    ):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.roots = [Path(r).resolve() for r in roots]
+        self.max_workers = max_workers or max(1, default_worker_count() // 4)
+        self.settle_polls = settle_polls
+
+        # // path -> (fingerprint, number of polls unchanged)
+        self.__observed: Dict[Path, Tuple[Dict, int]] = {}
+        # // path -> fingerprint built, or failed to be built
+        self.__handled: Dict[Path, Dict] = {}
+        self.__pending: Dict[Future, Tuple[Path, Dict]] = {}
+
+    def find_volumes(self) -> List[Path]:
+        # // slice directories and volume files; chunked volumes are loaded
+        # // on demand, and are not cached
+        found = []
+        for root in self.roots:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirpath = Path(dirpath)
+                dirnames[:] = sorted(
+                    d
+                    for d in dirnames
+                    if not d.startswith(".") and not is_volume_cache(d)
+                )
+                if is_chunked_volume(dirpath):
+                    dirnames[:] = []
+                    continue
+                if VolumeLoader(dirpath).is_valid_volume():
+                    dirnames[:] = []
+                    found.append(dirpath)
+                    continue
+                found.extend(
+                    Path(dirpath, f)
+                    for f in sorted(filenames)
+                    if is_volume_file(f) and not f.startswith(".")
+                )
+
+        return found
+
+    def __settled(self, volume_path: Path):
+        # // the fingerprint if unchanged for settle_polls polls, else None
+        try:
+            fingerprint = source_fingerprint(volume_path)
+        except OSError:
+            self.__observed.pop(volume_path, None)
+            return None
+
+        previous, count = self.__observed.get(volume_path, (None, 0))
+        count = count + 1 if previous == fingerprint else 1
+        self.__observed[volume_path] = (fingerprint, count)
+
+        return fingerprint if count >= self.settle_polls else None
+
+    def collect(self, wait: bool = False) -> Iterator[Tuple[str, Path, str]]:
+        # // yields (status, volume path, message) of the builds finished
+        for future in list(self.__pending.keys()):
+            if not wait and not future.done():
+                continue
+
+            volume_path, fingerprint = self.__pending.pop(future)
+            self.__handled[volume_path] = fingerprint
+            try:
+                yield "ready", volume_path, future.result()
+            except Exception as e:
+                yield "failed", volume_path, str(e)
+
+    def poll(
+        self, executor: ProcessPoolExecutor
+    ) -> Iterator[Tuple[str, Path, str]]:
+        yield from self.collect()
+
+        # // a cache is never built by two processes at once
+        building = {volume_cache_path(p) for p, _ in self.__pending.values()}
+        volume_paths = self.find_volumes()
+        for volume_path in volume_paths:
+            cache_path = volume_cache_path(volume_path)
+            if cache_path in building:
+                continue
+
+            fingerprint = self.__settled(volume_path)
+            if fingerprint is None:
+                continue
+            if self.__handled.get(volume_path, None) == fingerprint:
+                continue
+
+            # // e.g. built before the watcher was restarted
+            info = load_cache_info(volume_path)
+            if info is not None and info["source"] == fingerprint:
+                self.__handled[volume_path] = fingerprint
+                continue
+
+            try:
+                valid = get_volume_loader(
+                    volume_path, use_cache=False
+                ).is_valid_volume()
+            except Exception:
+                valid = False
+            if not valid:
+                self.__handled[volume_path] = fingerprint
+                yield "invalid", volume_path, ""
+                continue
+
+            threads = max(1, default_worker_count() // self.max_workers)
+            future = executor.submit(_build, str(volume_path), threads)
+            self.__pending[future] = (volume_path, fingerprint)
+            building.add(cache_path)
+            yield "queued", volume_path, ""
+
+        # // volumes removed from the roots are forgotten
+        for volume_path in set(self.__observed) - set(volume_paths):
+            self.__observed.pop(volume_path)
+            self.__handled.pop(volume_path, None)
+
+    def watch_iterably(
+        self, interval: float = 10.0, once: bool = False
+    ) -> Iterator[Tuple[str, Path, str]]:
+        # // once: the volumes found are built, without waiting to settle
+        if once:
+            self.settle_polls = 1
+
+        with create_executor(max_workers=self.max_workers) as executor:
+            while True:
+                yield from self.poll(executor)
+                if once:
+                    yield from self.collect(wait=True)
+                    return
+                time.sleep(interval)
+
+
+def watch(
+    roots: List[Union[str, Path]],
+    interval: float = 10.0,
+    max_workers: int = None,
+    once: bool = False,
+):
+    logger = logging.getLogger("VolumeWatcher")
+    watcher = VolumeWatcher(roots, max_workers=max_workers)
+    for root in watcher.roots:
+        logger.info(f"[Watching] {root}")
+
+    messages = {
+        "queued": "[Caching]",
+        "ready": "[Caching succeeded]",
+        "failed": "[Caching failed]",
+        "invalid": "[Invalid volume]",
+    }
+    try:
+        for status, volume_path, message in watcher.watch_iterably(
+            interval=interval, once=once
+        ):
+            log = logger.error if status == "failed" else logger.info
+            log(f"{messages[status]} {volume_path} {message}".rstrip())
+    except KeyboardInterrupt:
+        logger.info("[Watching stopped]")
@@ -1,9 +1,13 @@
 import logging
+import os
 from typing import List
 
-import pandas as pd
+import config
 from DATA import RinfoFiles, RSA_Vector
+from data_modules.trait_store import TRAIT_STORE_FILE_NAME, TraitStore
 from GUI import QtMain
+from GUI.components.QtFileWriter import QtFileWriter
+from modules.lazy_import import lazy_import
 from PySide6.QtCore import QObject, Qt, QThread, Signal
 from PySide6.QtGui import QAction, QStandardItemModel
 from PySide6.QtWidgets import (
@@ -22,6 +26,11 @@ from PySide6.QtWidgets import (
 
 from .__backbone__ import ExtensionBackbone
 
+pl = lazy_import("polars")
+
+# // the rinfo file of a row, kept in its first item
+_FILE_ROLE = Qt.UserRole + 2
+
 
 class RSA_summary_window(QMainWindow, ExtensionBackbone):
     built_in = True
@@ -43,6 +52,9 @@ class RSA_summary_window(QMainWindow, ExtensionBackbone):
 
         self.statusbar = QtStatusBarW(parent=self)
         self.setStatusBar(self.statusbar.widget)
+        self.file_writer = QtFileWriter(
+            progressbar_signal=self.statusbar.pyqtSignal_update_progressbar
+        )
 
         self.menubar = QtMenubar(parent=self)
         self.setMenuBar(self.menubar)
@@ -51,6 +63,7 @@ class RSA_summary_window(QMainWindow, ExtensionBackbone):
         self.show_default_msg_in_statusbar()
 
     def destroy_instance(self):
+        self.file_writer.stop()
         self.statusbar.thread.quit()
         self.statusbar.thread.wait()
 
@@ -91,49 +104,88 @@ class RSA_summary_window(QMainWindow, ExtensionBackbone):
 
     def generate_RSA_Vector(self, file_name: str):
         RSA_vector = RSA_Vector()
-        RSA_vector.load_from_file(fname=file_name)
+        # // polylines are completed only if a trait needs them
+        RSA_vector.load_from_file(fname=file_name, complete_polylines=False)
 
         return RSA_vector
 
-    def create_row(self, RSA_vector: RSA_Vector):
+    def trait_store_path(self):
+        return os.path.join(config.config_dir, TRAIT_STORE_FILE_NAME)
+
+    def open_trait_store(self):
+        # // opened in each thread, as SQLite connections are not shared
+        return TraitStore(
+            self.trait_store_path(),
+            self.RSA_traits(),
+            self.parent().root_traits,
+        )
+
+    def create_row(self, traits: dict):
+        # // traits: a row of the RSA traits table of the trait store
         row = []
         for class_ in self.RSA_traits().class_container:
-            ret = class_(RSA_vector).QStandardItem()
-            row.append(ret)
+            if len(class_.sublabels) == 0:
+                value = traits.get(class_.label, None)
+                value = "" if value is None else value
+            else:
+                value = [
+                    traits.get(f"{class_.label}_{sublabel}", None)
+                    for sublabel in class_.sublabels
+                ]
+            row.append(class_.from_value(value).QStandardItem())
 
+        row[0].setData(traits["file"], _FILE_ROLE)
         return row
 
-    def add_item(self, RSA_vector: RSA_Vector):
-        row = self.create_row(RSA_vector=RSA_vector)
+    def add_item(self, traits: dict):
+        row = self.create_row(traits=traits)
         self.tableview.model.appendRow(row)
 
+    def RSA_traits_table(self):
+        # // the rows shown, in their order, read from the trait store
+        model = self.tableview.model
+        files = [
+            model.item(ri, 0).data(_FILE_ROLE)
+            for ri in range(model.rowCount())
+        ]
+        with self.open_trait_store() as store:
+            table = store.RSA_traits_table(files)
+
+        rows = pl.DataFrame([pl.Series("file", files, dtype=pl.Utf8)])
+        return rows.join(table, on="file", how="left")
+
     def show_default_msg_in_statusbar(self):
         msg = "Add rinfo files."
         self.statusbar.set_main_message(msg)
 
     def add_from_files(self, files: List[str]):
-        rinfo_files = RinfoFiles(files=files).list_files()
-
-        if len(rinfo_files) == 0:
-            self.logger().error("There is no .rinfo files.")
-            return
-
+        # // the directories are scanned in the loader thread, and then the
+        # // traits of the new or changed files are calculated
         self.set_control(locked=True)
         self.rinfo_loader = RinfoLoader(
             parent=self,
-            files=rinfo_files,
+            files=RinfoFiles(files=files).iter_files(),
             progressbar_signal=self.statusbar.pyqtSignal_update_progressbar,
         )
         self.rinfo_loader.finished.connect(self.on_rinfo_list_loaded)
         self.rinfo_loader.start()
 
     def on_rinfo_list_loaded(self):
-        RSA_vector_list = self.rinfo_loader.RSA_vector_list
+        rinfo_files = self.rinfo_loader.rinfo_files
+        found = self.rinfo_loader.found
+        error = self.rinfo_loader.error
         del self.rinfo_loader
-        for RSA_vector in RSA_vector_list:
-            self.add_item(RSA_vector=RSA_vector)
+        if error is not None:
+            self.logger().error(f"[Loading failed] {error}")
+        elif found == 0:
+            self.logger().error("There is no .rinfo files.")
+
+        with self.open_trait_store() as store:
+            table = store.RSA_traits_table(rinfo_files)
+        for traits in table.iter_rows(named=True):
+            self.add_item(traits=traits)
 
-        if len(RSA_vector_list):
+        if table.height != 0:
             self.tableview.selectRow(self.tableview.model.rowCount() - 1)
             self.tableview.repaint()
             self.tableview.setFocus()
@@ -190,43 +242,6 @@ class SummaryTableview(QTableView):
             pass
         return super().selectionChanged(selected, deselected)
 
-    def to_pandas_df(self):
-        labels = []
-        sublabels = []
-        column_data = []
-
-        exportable_list = self.RSA_traits().class_container.expotable_list()
-        for ci in range(self.model.columnCount()):
-            if exportable_list[ci] is False:
-                continue
-
-            label = self.model.horizontalHeaderItem(ci).text()
-            cls_ = self.RSA_traits().get(label=label)
-
-            sublabels = cls_.sublabels
-            n_sublabel = len(sublabels)
-
-            if n_sublabel == 0:
-                labels.append(label)
-                data = []
-                for ri in range(self.model.rowCount()):
-                    item = self.model.item(ri, ci)
-                    data.append(item.text())
-                column_data.append(data)
-            else:
-                for i in range(n_sublabel):
-                    labels.append(f"{label}_{sublabels[i]}")
-                    data = []
-                    for ri in range(self.model.rowCount()):
-                        item = self.model.item(ri, ci)
-                        data.append(item.data().value[i])
-                    column_data.append(data)
-
-        df = pd.DataFrame(column_data, index=labels)
-        df = df.transpose()
-
-        return df
-
 
 class QtStatusBarW(QObject):
     pyqtSignal_update_progressbar = Signal(int, int, str)
@@ -395,16 +410,12 @@ class QtMenubar(QMenuBar):
             None, "Save file", "", "*.csv"
         )[0]
         if csv_fname:
-            try:
-                if not csv_fname.lower().endswith(".csv"):
-                    csv_fname += ".csv"
-                df = self.parent().tableview.to_pandas_df()
-                with open(csv_fname, "w", newline="") as f:
-                    df.to_csv(f)
-
-                self.logger().info(f"[Saving succeeded] {csv_fname}")
-            except:  # NOQA
-                self.logger().error(f"[Saving failed] {csv_fname}")
+            if not csv_fname.lower().endswith(".csv"):
+                csv_fname += ".csv"
+            table = self.parent().RSA_traits_table()
+            self.parent().file_writer.submit(
+                csv_fname, table.write_csv, mode="wb"
+            )
 
 
 class RinfoLoader(QThread):
@@ -418,13 +429,27 @@ class RinfoLoader(QThread):
         return self.__parent
 
     def run(self):
-        total = len(self.files)
-        self.RSA_vector_list = []
-        for i, f in enumerate(self.files):
-            self.progressbar_signal.emit(i, total, "File loading")
-            RSA_vector = RSA_Vector()
-            succeeded = RSA_vector.load_from_file(fname=f)
-            if succeeded is True:
-                self.RSA_vector_list.append(RSA_vector)
+        # // files: an iterator, e.g. RinfoFiles.iter_files(); the total is
+        # // the number of files found so far
+        # // The traits of the new or changed files are calculated into the
+        # // trait store, in worker processes; the others are read from it.
+        self.rinfo_files = []
+        self.found = 0
+        self.error = None
+        try:
+            for i, f in enumerate(self.files):
+                self.rinfo_files.append(f)
+                self.found = i + 1
+                self.progressbar_signal.emit(i, self.found, "File listing")
+
+            with self.parent().open_trait_store() as store:
+                for i, total, _ in store.update_files_iterably(
+                    self.rinfo_files
+                ):
+                    self.progressbar_signal.emit(
+                        i - 1, total, "Trait calculation"
+                    )
+        except Exception as e:
+            self.error = e
 
         self.quit()
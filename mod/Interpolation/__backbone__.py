@@ -7,6 +7,8 @@ class InterpolationBackbone(object):
     label = "Label name"
     index = 0
     version = 1
+    # // False if interpolate() never reads the volume
+    requires_volume = True
 
     def __init__(self, RSA_components: RSA_Components):
         super().__init__()
@@ -9,6 +9,7 @@ class Template(InterpolationBackbone):
     label = "Template"  # // label name here
     index = 1  # // determines the order in which the labels are displayed.
     version = 1  # // the version of RSAtrace3D
+    requires_volume = False  # // True if the volume is read in interpolate()
 
     # // the main function
     def interpolate(self, polyline: List[List[int]]):
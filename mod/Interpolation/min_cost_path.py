@@ -0,0 +1,178 @@
+import threading
+import weakref
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+
+from modules.lazy_import import lazy_import
+
+from .__backbone__ import InterpolationBackbone
+
+graph = lazy_import("skimage.graph")
+
+# // paths between node pairs are cached, since all segments of a root are
+# // interpolated again whenever a relay node is added
+# // Paths are keyed by the volume generation, since the array of a volume
+# // being loaded is the same object once it is loaded.
+_path_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_path_cache_lock = threading.Lock()
+_PATH_CACHE_SIZE = 256
+
+
+def _block_max(volume: np.ndarray, factor: int):
+    # // thin roots are kept by the maximum of each block
+    pad = [(0, -s % factor) for s in volume.shape]
+    volume = np.pad(volume, pad, mode="edge")
+    for axis in range(3):
+        index = [slice(None)] * 3
+        index[axis] = slice(0, None, factor)
+        reduced = volume[tuple(index)].copy()
+        for i in range(1, factor):
+            index[axis] = slice(i, None, factor)
+            np.maximum(reduced, volume[tuple(index)], out=reduced)
+        volume = reduced
+    return volume
+
+
+# // interpolation by minimum-cost path tracing
+class MinimumCostPath(InterpolationBackbone):
+    built_in = True
+    label = "Minimum-cost path"
+    status_tip = (
+        "Trace roots along bright voxels between nodes by a minimum-cost path."
+    )
+    index = 1
+    version = 1
+
+    tube_radius = 8  # // the minimum radius of the search tube
+    tube_ratio = 0.25  # // the tube radius relative to the segment length
+    intensity_weight = 50.0  # // the cost of dark voxels relative to bright
+    max_roi_voxels = 2 * 1024**2  # // larger regions are downsampled
+    refine_length = 24  # // the length of the pieces refined
+
+    # // the main function
+    def interpolate(self, polyline: List[List[int]]):
+        volume = self.RSA_components().volume.data
+        if volume is None or len(polyline) <= 1:
+            return polyline
+
+        traced = [list(polyline[0])]
+        for i in range(len(polyline) - 1):
+            path = self.segment(volume, polyline[i], polyline[i + 1])
+            traced.extend(path[1:])
+
+        return [[int(z), int(y), int(x)] for z, y, x in traced]
+
+    def segment(self, volume, start, end):
+        upper = np.array(volume.shape[:3]) - 1
+        start = np.clip(np.array(start, dtype=np.int64), 0, upper)
+        end = np.clip(np.array(end, dtype=np.int64), 0, upper)
+
+        key = (
+            self.RSA_components().volume.generation,
+            tuple(start),
+            tuple(end),
+            self.tube_radius,
+            self.tube_ratio,
+            self.intensity_weight,
+        )
+        with _path_cache_lock:
+            cached = _path_cache.get(key, None)
+            if cached is not None and cached[0]() is volume:
+                _path_cache.move_to_end(key)
+                return cached[1]
+
+        path = self.__trace(volume, start, end)
+
+        try:
+            ref = weakref.ref(volume)
+        except TypeError:
+            return path
+        with _path_cache_lock:
+            _path_cache[key] = (ref, path)
+            while len(_path_cache) > _PATH_CACHE_SIZE:
+                _path_cache.popitem(last=False)
+
+        return path
+
+    def radius_of(self, start, end):
+        length = np.sqrt(np.sum((end - start) ** 2))
+        return int(max(self.tube_radius, length * self.tube_ratio))
+
+    def __trace(self, volume, start, end):
+        if np.all(start == end):
+            return [start.tolist()]
+
+        # // the region of interest around the segment
+        radius = self.radius_of(start, end)
+        lower = np.maximum(np.minimum(start, end) - radius, 0)
+        upper = np.minimum(
+            np.maximum(start, end) + radius + 1, volume.shape[:3]
+        )
+
+        factor = 1
+        while np.prod(-(-(upper - lower) // factor)) > self.max_roi_voxels:
+            factor *= 2
+        if factor == 1:
+            return self.__trace_in(volume, start, end, radius, lower, upper)
+
+        # // long segments are traced on a downsampled region first, and the
+        # // coarse path is refined piece by piece between its waypoints
+        coarse = self.__trace_in(
+            volume, start, end, radius, lower, upper, factor=factor
+        )
+        step = max(1, self.refine_length // factor)
+        waypoints = [start] + coarse[step:-1:step] + [end]
+
+        path = [start.tolist()]
+        for a, b in zip(waypoints[:-1], waypoints[1:]):
+            path.extend(self.__trace(volume, np.array(a), np.array(b))[1:])
+        return path
+
+    def __trace_in(self, volume, start, end, radius, lower, upper, factor=1):
+        roi = np.asarray(
+            volume[
+                lower[0] : upper[0], lower[1] : upper[1], lower[2] : upper[2]
+            ]
+        )
+        if factor != 1:
+            roi = _block_max(roi, factor)
+        start, end = (start - lower) // factor, (end - lower) // factor
+        costs = self.cost_array(roi, start, end, radius / factor)
+
+        mcp = graph.MCP_Geometric(costs, fully_connected=True)
+        mcp.find_costs(starts=[tuple(start)], ends=[tuple(end)])
+        path = np.array(mcp.traceback(tuple(end)))
+
+        # // the centers of the blocks
+        path = path * factor + factor // 2 + lower
+        return np.minimum(path, upper - 1).tolist()
+
+    def cost_array(self, roi, start, end, radius):
+        # // costs per unit length; bright voxels are cheap, and the voxels
+        # // out of the tube around the segment are impassable
+        # // intensities are normalized between the background (median)
+        # // and the brightest voxel
+        roi = roi.astype(np.float32)
+        lo, hi = np.median(roi), roi.max()
+        normalized = np.clip((roi - lo) / max(hi - lo, 1e-6), 0, 1)
+        costs = 1.0 + self.intensity_weight * (1.0 - normalized) ** 2
+
+        z, y, x = np.ogrid[: roi.shape[0], : roi.shape[1], : roi.shape[2]]
+        direction = (end - start).astype(np.float32)
+        length2 = max(float(np.sum(direction**2)), 1.0)
+        t = (
+            (z - start[0]) * direction[0]
+            + (y - start[1]) * direction[1]
+            + (x - start[2]) * direction[2]
+        ) / length2
+        t = np.clip(t, 0, 1)
+        distance2 = (
+            (z - start[0] - t * direction[0]) ** 2
+            + (y - start[1] - t * direction[1]) ** 2
+            + (x - start[2] - t * direction[2]) ** 2
+        )
+        costs[distance2 > radius**2] = np.inf
+
+        return costs
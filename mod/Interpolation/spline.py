@@ -1,10 +1,13 @@
 from typing import List
 
 import numpy as np
-from scipy import interpolate
+
+from modules.lazy_import import lazy_import
 
 from .__backbone__ import InterpolationBackbone
 
+interpolate = lazy_import("scipy.interpolate")
+
 
 # // spline interpolation
 class Spline(InterpolationBackbone):
@@ -13,6 +16,7 @@ class Spline(InterpolationBackbone):
     status_tip = "Interpolate nodes to make a spline curve."
     index = -2
     version = 1
+    requires_volume = False
 
     # // the main function
     def interpolate(self, polyline: List[List[int]]):
@@ -8,6 +8,7 @@ class Straight(InterpolationBackbone):
     built_in = True
     label = "Straight"
     status_tip = "No interpolation, straight polylines."
+    requires_volume = False
 
     # // the main function
     def interpolate(self, polyline: List[List[int]]):
@@ -76,6 +76,14 @@ class RSATraitBackbone(object):
     def calculate(self, RSA_vector: RSA_Vector):
         return ""
 
+    @classmethod
+    def from_value(cls, value):
+        # // a trait of a value already calculated, e.g. in a trait store;
+        # // it is not updatable
+        trait = cls.__new__(cls)
+        trait.value = value
+        return trait
+
     def update(self):
         if self.updatable:
             self.value = self.calculate(self.__RSA_vector)
@@ -0,0 +1,119 @@
+# // a module of RSAtrace3D for calculating root diameter and volume
+
+import os
+import sys
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(__file__), "../.."))
+
+import numpy as np
+
+from DATA import ID_Object, RSA_Vector
+from mod.Traits.__backbone__ import RootTraitBackbone
+from mod.Traits.__test__ import ModuleTest
+from modules.root_radius import root_volume
+
+
+# // radii [voxel] measured by the distance transform of the first volume
+# // The radii are measured in the background when the roots are drawn, so
+# // that the traits are empty until then, and without the volume.
+def root_radii(RSA_vector: RSA_Vector, ID_string: ID_Object):
+    if not ID_string.is_root():
+        return None, None
+
+    RSA_components = RSA_vector.RSA_components()
+    if RSA_components is None:
+        return None, None
+
+    estimator = RSA_components.volumes[0].radius_estimator()
+    root_node = RSA_vector.root_node(ID_string=ID_string)
+    if estimator is None or root_node is None:
+        return None, None
+
+    polyline = root_node.completed_polyline()
+    radii = estimator.radii(polyline, cached_only=True)
+    if radii is None or np.all(np.isnan(radii)):
+        return None, None
+
+    return polyline, radii
+
+
+# // [single root] mean diameter
+class Root_MeanDiameter(RootTraitBackbone):
+    built_in = True
+    label = "mean diameter [mm]"
+    tool_tip = "Mean root diameter along the interpolated polyline."
+    index = 2
+    version = 1
+
+    # // the main function
+    def calculate(self, RSA_vector: RSA_Vector, ID_string: ID_Object):
+        _, radii = root_radii(RSA_vector, ID_string)
+        if radii is None:
+            return ""
+
+        resolution = RSA_vector.annotations.resolution()
+        return round(float(np.nanmean(radii)) * 2 * resolution, 3)
+
+    # // text to be shown
+    def str_value(self):
+        if type(self.value) is float:
+            return f"{self.value:5.2f}"
+        else:
+            return super().str_value()
+
+
+# // [single root] max diameter
+class Root_MaxDiameter(RootTraitBackbone):
+    built_in = True
+    label = "max diameter [mm]"
+    tool_tip = "Maximum root diameter along the interpolated polyline."
+    index = 3
+    version = 1
+
+    # // the main function
+    def calculate(self, RSA_vector: RSA_Vector, ID_string: ID_Object):
+        _, radii = root_radii(RSA_vector, ID_string)
+        if radii is None:
+            return ""
+
+        resolution = RSA_vector.annotations.resolution()
+        return round(float(np.nanmax(radii)) * 2 * resolution, 3)
+
+    # // text to be shown
+    def str_value(self):
+        if type(self.value) is float:
+            return f"{self.value:5.2f}"
+        else:
+            return super().str_value()
+
+
+# // [single root] root volume
+class Root_Volume(RootTraitBackbone):
+    built_in = True
+    label = "volume [mm\u00b3]"
+    tool_tip = "Root volume as cylinders along the interpolated polyline."
+    index = 4
+    version = 1
+
+    # // the main function
+    def calculate(self, RSA_vector: RSA_Vector, ID_string: ID_Object):
+        polyline, radii = root_radii(RSA_vector, ID_string)
+        if radii is None:
+            return ""
+
+        resolution = RSA_vector.annotations.resolution()
+        return round(root_volume(polyline, radii) * resolution**3, 3)
+
+    # // text to be shown
+    def str_value(self):
+        if type(self.value) is float:
+            return f"{self.value:6.1f}"
+        else:
+            return super().str_value()
+
+
+if __name__ == "__main__":
+    ModuleTest(Root_MeanDiameter)
+    ModuleTest(Root_MaxDiameter)
+    ModuleTest(Root_Volume)
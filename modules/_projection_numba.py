@@ -0,0 +1,31 @@
+import numba
+import numpy as np
+
+
+@numba.njit(parallel=True, nogil=True, cache=True)
+def max_projections(volume, block_count):
+    # // max projections along the three axes in one pass
+    # // Projections along z are kept per block to avoid races, and are
+    # // merged by the caller. Only unsigned volumes are supported, since
+    # // the outputs are initialized with zeros.
+    Z, Y, X = volume.shape
+    step = (Z + block_count - 1) // block_count
+    out0 = np.zeros((block_count, Y, X), dtype=volume.dtype)
+    out1 = np.zeros((Z, X), dtype=volume.dtype)
+    out2 = np.zeros((Z, Y), dtype=volume.dtype)
+
+    for b in numba.prange(block_count):
+        for z in range(b * step, min((b + 1) * step, Z)):
+            for y in range(Y):
+                row_max = volume[z, y, 0]
+                for x in range(X):
+                    v = volume[z, y, x]
+                    if v > out0[b, y, x]:
+                        out0[b, y, x] = v
+                    if v > out1[z, x]:
+                        out1[z, x] = v
+                    if v > row_max:
+                        row_max = v
+                out2[z, y] = row_max
+
+    return out0, out1, out2
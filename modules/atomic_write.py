@@ -0,0 +1,45 @@
+import os
+import tempfile
+from pathlib import Path
+from typing import IO, Callable, Union
+
+
+def _read_umask() -> int:
+    # // the umask can only be read by setting it; it is read once on import,
+    # // not to change it while other threads create files
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+_UMASK = _read_umask()
+
+
+def atomic_write(
+    path: Union[str, Path],
+    write: Callable[[IO], None],
+    mode: str = "w",
+    **open_kwargs,
+):
+    # // written to a temporary file in the same directory, and renamed, so
+    # // that the file is never left truncated
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, mode, **open_kwargs) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # // mkstemp creates the file readable by the owner only
+        if path.exists():
+            os.chmod(tmp_path, path.stat().st_mode & 0o777)
+        else:
+            os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
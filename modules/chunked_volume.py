@@ -0,0 +1,516 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from pathlib import Path
+from typing import Dict, Final, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from modules.lazy_import import lazy_import
+from modules.volume import (
+    VOLUME_INFO_FILE_NAME,
+    VolumeLoader,
+    _SliceVolumeLoader,
+    default_worker_count,
+)
+
+io = lazy_import("skimage.io")
+
+CHUNKED_VOLUME_FILE_NAME: Final[str] = ".chunked_volume.json"
+DEFAULT_CHUNKS: Final[Tuple[int, int, int]] = (16, 256, 256)
+DEFAULT_CACHE_BYTES: Final[int] = 1024**3
+
+
+def is_chunked_volume(volume_path: Union[str, Path]):
+    return Path(volume_path, CHUNKED_VOLUME_FILE_NAME).is_file()
+
+
+class ChunkCache(object):
+    # // a thread-safe LRU cache of decompressed chunks bounded in bytes
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.__chunks: OrderedDict = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        with self.__lock:
+            chunk = self.__chunks.get(key, None)
+            if chunk is not None:
+                self.__chunks.move_to_end(key)
+            return chunk
+
+    def put(self, key, chunk: np.ndarray):
+        chunk.setflags(write=False)
+        with self.__lock:
+            if key in self.__chunks:
+                self.nbytes -= self.__chunks.pop(key).nbytes
+            self.__chunks[key] = chunk
+            self.nbytes += chunk.nbytes
+            self.__evict()
+
+    def discard(self, key):
+        with self.__lock:
+            if key in self.__chunks:
+                self.nbytes -= self.__chunks.pop(key).nbytes
+
+    def set_max_bytes(self, max_bytes: int):
+        with self.__lock:
+            self.max_bytes = max_bytes
+            self.__evict()
+
+    def clear(self):
+        with self.__lock:
+            self.__chunks.clear()
+            self.nbytes = 0
+
+    def __evict(self):
+        while self.nbytes > self.max_bytes and len(self.__chunks) > 1:
+            _, chunk = self.__chunks.popitem(last=False)
+            self.nbytes -= chunk.nbytes
+
+
+# // shared by all chunked volumes, so that the memory use is bounded
+# // even when several volumes are opened
+shared_chunk_cache = ChunkCache()
+
+_chunk_executor: ThreadPoolExecutor = None
+_chunk_executor_lock = threading.Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    # // a pool shared for reading and writing chunks
+    global _chunk_executor
+    with _chunk_executor_lock:
+        if _chunk_executor is None:
+            _chunk_executor = ThreadPoolExecutor(
+                max_workers=default_worker_count(),
+                thread_name_prefix="chunked_volume",
+            )
+        return _chunk_executor
+
+
+def _map(func, items: list):
+    # // serial in the pool threads themselves to avoid a deadlock
+    name = threading.current_thread().name
+    if len(items) > 1 and not name.startswith("chunked_volume"):
+        return list(_executor().map(func, items))
+    return [func(item) for item in items]
+
+
+def _normalize_key(key, shape: Tuple[int, ...]):
+    # // returns ranges for each axis and the axes to be squeezed
+    if not isinstance(key, tuple):
+        key = (key,)
+    if any(k is Ellipsis for k in key):
+        i = [k is Ellipsis for k in key].index(True)
+        fill = (slice(None),) * (len(shape) - len(key) + 1)
+        key = key[:i] + fill + key[i + 1 :]
+    if len(key) > len(shape):
+        raise IndexError(f"too many indices: {len(key)}")
+    key = key + (slice(None),) * (len(shape) - len(key))
+
+    ranges: List[range] = []
+    squeezed: List[int] = []
+    for axis, (k, dim) in enumerate(zip(key, shape)):
+        if isinstance(k, (int, np.integer)):
+            k = int(k) + dim if k < 0 else int(k)
+            if not 0 <= k < dim:
+                raise IndexError(f"index {k} is out of bounds for {dim}")
+            ranges.append(range(k, k + 1))
+            squeezed.append(axis)
+        elif isinstance(k, slice):
+            ranges.append(range(*k.indices(dim)))
+        else:
+            raise IndexError(f"unsupported index: {k!r}")
+
+    return ranges, squeezed
+
+
+class ChunkedVolume(object):
+    # // a 3D volume stored as zlib-compressed chunks in a directory
+    # // (one file per chunk, named "z.y.x" by the chunk index).
+    # // It behaves as a read-only array for slicing, and only the chunks
+    # // overlapping the requested region are read and decompressed.
+    def __init__(
+        self, volume_path: Union[str, Path], cache: ChunkCache = None
+    ):
+        self.volume_path = Path(volume_path).resolve()
+        self.cache = cache or shared_chunk_cache
+
+        with open(Path(self.volume_path, CHUNKED_VOLUME_FILE_NAME)) as f:
+            header = json.load(f)
+
+        self.shape: Tuple[int, ...] = tuple(header["shape"])
+        self.dtype = np.dtype(header["dtype"])
+        self.chunks: Tuple[int, ...] = tuple(header["chunks"])
+        self.level: int = header.get("level", 1)
+
+    @classmethod
+    def create(
+        cls,
+        volume_path: Union[str, Path],
+        shape: Tuple[int, ...],
+        dtype,
+        chunks: Tuple[int, ...] = DEFAULT_CHUNKS,
+        level: int = 1,
+        cache: ChunkCache = None,
+    ):
+        assert len(shape) == 3 and len(chunks) == 3
+
+        os.makedirs(volume_path, exist_ok=True)
+        header = {
+            "shape": [int(i) for i in shape],
+            "dtype": np.dtype(dtype).str,
+            "chunks": [int(i) for i in chunks],
+            "compression": "zlib",
+            "level": level,
+        }
+        with open(Path(volume_path, CHUNKED_VOLUME_FILE_NAME), "w") as f:
+            json.dump(header, f)
+
+        return cls(volume_path, cache=cache)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    @property
+    def chunk_grid(self) -> Tuple[int, ...]:
+        return tuple(-(-s // c) for s, c in zip(self.shape, self.chunks))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return (
+            f"ChunkedVolume(shape={self.shape}, dtype={self.dtype}, "
+            f"chunks={self.chunks}, path={self.volume_path})"
+        )
+
+    def chunk_slices(self, chunk_index: Tuple[int, ...]):
+        return tuple(
+            slice(i * c, min((i + 1) * c, s))
+            for i, c, s in zip(chunk_index, self.chunks, self.shape)
+        )
+
+    def __chunk_file(self, chunk_index: Tuple[int, ...]):
+        return Path(self.volume_path, ".".join(str(i) for i in chunk_index))
+
+    def read_chunk(self, chunk_index: Tuple[int, ...]) -> np.ndarray:
+        key = (str(self.volume_path), tuple(chunk_index))
+        chunk = self.cache.get(key)
+        if chunk is not None:
+            return chunk
+
+        shape = tuple(s.stop - s.start for s in self.chunk_slices(chunk_index))
+        chunk_file = self.__chunk_file(chunk_index)
+        if chunk_file.is_file():
+            with open(chunk_file, "rb") as f:
+                buffer = zlib.decompress(f.read())
+            chunk = np.frombuffer(buffer, dtype=self.dtype).reshape(shape)
+        else:
+            # // chunks never written are filled with zero
+            chunk = np.zeros(shape, dtype=self.dtype)
+
+        self.cache.put(key, chunk)
+        return chunk
+
+    def write_chunk(self, chunk_index: Tuple[int, ...], chunk: np.ndarray):
+        shape = tuple(s.stop - s.start for s in self.chunk_slices(chunk_index))
+        assert chunk.shape == shape
+
+        buffer = zlib.compress(
+            np.ascontiguousarray(chunk, dtype=self.dtype).tobytes(),
+            self.level,
+        )
+
+        # // written atomically, as readers may be running
+        chunk_file = self.__chunk_file(chunk_index)
+        tmp_file = Path(f"{chunk_file}.tmp")
+        with open(tmp_file, "wb") as f:
+            f.write(buffer)
+        os.replace(tmp_file, chunk_file)
+
+        self.cache.discard((str(self.volume_path), tuple(chunk_index)))
+
+    def write_slab(self, z_start: int, slab: np.ndarray, parallel=True):
+        # // z_start has to be aligned to the chunk depth
+        assert z_start % self.chunks[0] == 0
+        assert slab.shape[1:] == self.shape[1:]
+
+        iz_start = z_start // self.chunks[0]
+        iz_stop = -(-(z_start + slab.shape[0]) // self.chunks[0])
+        chunk_indexes = list(
+            product(
+                range(iz_start, iz_stop),
+                range(self.chunk_grid[1]),
+                range(self.chunk_grid[2]),
+            )
+        )
+
+        def write(chunk_index):
+            slices = self.chunk_slices(chunk_index)
+            local = (
+                slice(slices[0].start - z_start, slices[0].stop - z_start),
+            ) + slices[1:]
+            self.write_chunk(chunk_index, slab[local])
+
+        if parallel:
+            _map(write, chunk_indexes)
+        else:
+            for chunk_index in chunk_indexes:
+                write(chunk_index)
+
+    def __getitem__(self, key) -> np.ndarray:
+        ranges, squeezed = _normalize_key(key, self.shape)
+
+        if any(len(r) == 0 for r in ranges):
+            out = np.empty([len(r) for r in ranges], dtype=self.dtype)
+            return out.squeeze(axis=tuple(squeezed))
+
+        # // the bounding box of the selection is assembled from chunks
+        lo = [min(r[0], r[-1]) for r in ranges]
+        hi = [max(r[0], r[-1]) + 1 for r in ranges]
+        box = np.empty([h - l for l, h in zip(lo, hi)], dtype=self.dtype)
+
+        chunk_ranges = [
+            range(l // c, (h - 1) // c + 1)
+            for l, h, c in zip(lo, hi, self.chunks)
+        ]
+
+        def copy(chunk_index):
+            chunk = self.read_chunk(chunk_index)
+            slices = self.chunk_slices(chunk_index)
+            src, dst = [], []
+            for s, l, h in zip(slices, lo, hi):
+                start, stop = max(s.start, l), min(s.stop, h)
+                src.append(slice(start - s.start, stop - s.start))
+                dst.append(slice(start - l, stop - l))
+            box[tuple(dst)] = chunk[tuple(src)]
+
+        _map(copy, list(product(*chunk_ranges)))
+
+        # // steps are applied to the bounding box
+        local = []
+        for r, l in zip(ranges, lo):
+            if r.step == 1:
+                local.append(slice(None))
+            else:
+                local.append(slice(r[0] - l, None, r.step))
+        out = box[tuple(local)]
+
+        return out.squeeze(axis=tuple(squeezed)) if squeezed else out
+
+    def __array__(self, dtype=None):
+        out = self[:]
+        return out if dtype is None else out.astype(dtype)
+
+    def iter_slabs(self) -> Iterator[Tuple[int, np.ndarray]]:
+        # // chunk-aligned z slabs, so that each chunk is read once
+        for z in range(0, self.shape[0], self.chunks[0]):
+            yield z, self[z : z + self.chunks[0]]
+
+    def __reduce(self, ufunc: np.ufunc, axis=None):
+        if axis is None:
+            return ufunc.reduce(
+                [
+                    ufunc.reduce(slab, axis=None)
+                    for _, slab in self.iter_slabs()
+                ]
+            )
+
+        axis = axis + self.ndim if axis < 0 else axis
+        out_shape = self.shape[:axis] + self.shape[axis + 1 :]
+        out = None
+        for z, slab in self.iter_slabs():
+            reduced = ufunc.reduce(slab, axis=axis)
+            if axis == 0:
+                out = reduced if out is None else ufunc(out, reduced)
+            else:
+                if out is None:
+                    out = np.empty(out_shape, dtype=reduced.dtype)
+                out[z : z + slab.shape[0]] = reduced
+
+        return out
+
+    def max(self, axis=None):
+        return self.__reduce(np.maximum, axis=axis)
+
+    def min(self, axis=None):
+        return self.__reduce(np.minimum, axis=axis)
+
+    def transpose(self, *axes):
+        if len(axes) == 1 and isinstance(axes[0], (list, tuple)):
+            axes = axes[0]
+        return TransposedVolume(self, tuple(axes) or (2, 1, 0))
+
+
+class TransposedVolume(object):
+    # // a lazy transposed view of a ChunkedVolume
+    def __init__(self, base: ChunkedVolume, axes: Tuple[int, ...]):
+        self.base = base
+        self.axes = axes
+        self.shape = tuple(base.shape[a] for a in axes)
+        self.dtype = base.dtype
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return self.base.size
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        base_key = [None] * self.ndim
+        for k, a in zip(key, self.axes):
+            base_key[a] = k
+        out = self.base[tuple(base_key)]
+
+        # // the remaining axes are reordered as this view
+        remaining = [a for k, a in zip(key, self.axes) if isinstance(k, slice)]
+        order = sorted(remaining)
+        return out.transpose([order.index(a) for a in remaining])
+
+    def __array__(self, dtype=None):
+        out = self[:]
+        return out if dtype is None else out.astype(dtype)
+
+    def __reduce(self, reduce, axis=None):
+        if axis is None:
+            return reduce(axis=None)
+        out = reduce(axis=self.axes[axis])
+
+        # // the remaining axes are reordered as this view
+        remaining = [a for i, a in enumerate(self.axes) if i != axis]
+        order = sorted(remaining)
+        return out.transpose([order.index(a) for a in remaining])
+
+    def max(self, axis=None):
+        return self.__reduce(self.base.max, axis=axis)
+
+    def min(self, axis=None):
+        return self.__reduce(self.base.min, axis=axis)
+
+    def transpose(self, *axes):
+        if len(axes) == 1 and isinstance(axes[0], (list, tuple)):
+            axes = axes[0]
+        axes = tuple(axes) or tuple(range(self.ndim))[::-1]
+        return TransposedVolume(self.base, tuple(self.axes[a] for a in axes))
+
+
+class ChunkedVolumeLoader(_SliceVolumeLoader):
+    # // nothing is decoded on loading; chunks are read on demand
+    def __init__(
+        self,
+        volume_path: Union[str, Path],
+        minimum_file_number: int = 64,
+        volume_info_file_name: str = VOLUME_INFO_FILE_NAME,
+        cache: ChunkCache = None,
+    ) -> None:
+        self.volume_path = Path(volume_path).resolve()
+        self.minimum_file_number = minimum_file_number
+        self.volume_info_path = Path(self.volume_path, volume_info_file_name)
+        self.cache = cache
+
+        assert is_chunked_volume(self.volume_path)
+
+    @property
+    def image_file_number(self):
+        with open(Path(self.volume_path, CHUNKED_VOLUME_FILE_NAME)) as f:
+            return json.load(f)["shape"][0]
+
+    def probe(self):
+        # // never decoded into memory, so that it is not stacked
+        return None
+
+    def load_iterably(
+        self, max_workers: int = None, on_slice=None, out: np.ndarray = None
+    ):
+        # // chunks are read on demand, so that on_slice is never called
+        self.np_volume = ChunkedVolume(self.volume_path, cache=self.cache)
+        yield self.np_volume.shape[0], self.np_volume.shape[0]
+
+
+class ChunkedVolumeSaver(object):
+    # // converts a slice directory (e.g. saved by VolumeSaver) into a
+    # // chunked volume, slab by slab, without loading the whole volume
+    def __init__(
+        self,
+        src_path: Union[str, Path],
+        chunks: Tuple[int, int, int] = DEFAULT_CHUNKS,
+        level: int = 1,
+        max_workers: int = None,
+    ):
+        self.volume_loader = VolumeLoader(src_path)
+        self.chunks = tuple(chunks)
+        self.level = level
+        self.max_workers = max_workers or default_worker_count()
+
+    def save_iterably(self, dst_path: Union[str, Path]):
+        image_files = self.volume_loader.image_files
+        total = len(image_files)
+        assert total > 0
+
+        first = io.imread(image_files[0])
+        volume = ChunkedVolume.create(
+            dst_path,
+            shape=(total,) + first.shape,
+            dtype=first.dtype,
+            chunks=self.chunks,
+            level=self.level,
+        )
+
+        depth = self.chunks[0]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for z in range(0, total, depth):
+                slab = np.stack(
+                    list(executor.map(io.imread, image_files[z : z + depth]))
+                )
+                volume.write_slab(z, slab)
+                yield min(z + depth, total), total
+
+        # // saving volume infomartion data
+        volume_info: Dict = self.volume_loader.load_volume_info()
+        with open(Path(dst_path, VOLUME_INFO_FILE_NAME), "w") as f:
+            json.dump(volume_info, f)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger("ChunkedVolumeSaver")
+
+    parser = argparse.ArgumentParser(
+        description="Convert a slice directory into a chunked volume."
+    )
+    parser.add_argument("src", type=str, help="source slice directory")
+    parser.add_argument("dst", type=str, help="destination directory")
+    parser.add_argument(
+        "--chunks", type=int, nargs=3, default=list(DEFAULT_CHUNKS)
+    )
+    parser.add_argument("--level", type=int, default=1)
+    args = parser.parse_args()
+
+    saver = ChunkedVolumeSaver(args.src, chunks=args.chunks, level=args.level)
+    for i, total in saver.save_iterably(args.dst):
+        logger.info(f"[converting] {i} / {total}")
+    logger.info(f"[Saving succeeded] {args.dst}")
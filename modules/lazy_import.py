@@ -0,0 +1,47 @@
+import importlib
+import sys
+import threading
+from types import ModuleType
+
+
+class LazyModule(ModuleType):
+    # // a module proxy which imports the real module on first attribute access
+    __lock = threading.RLock()
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_LazyModule__module"] = None
+
+    def __load(self) -> ModuleType:
+        module = self.__dict__["_LazyModule__module"]
+        if module is not None:
+            return module
+
+        with LazyModule.__lock:
+            module = self.__dict__["_LazyModule__module"]
+            if module is None:
+                module = importlib.import_module(self.__name__)
+                self.__dict__["_LazyModule__module"] = module
+
+        return module
+
+    def is_loaded(self) -> bool:
+        return self.__dict__["_LazyModule__module"] is not None
+
+    def __getattr__(self, attr: str):
+        return getattr(self.__load(), attr)
+
+    def __dir__(self):
+        return dir(self.__load())
+
+    def __repr__(self):
+        state = "loaded" if self.is_loaded() else "not loaded"
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+def lazy_import(name: str) -> ModuleType:
+    # // already imported modules are returned as they are
+    if name in sys.modules:
+        return sys.modules[name]
+
+    return LazyModule(name)
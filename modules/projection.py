@@ -0,0 +1,278 @@
+import argparse
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Final, List, Tuple
+
+import numpy as np
+
+from modules.volume import default_worker_count
+
+PROJECTION_METHODS: Final[Tuple[str, ...]] = ("max", "mean", "percentile")
+DEFAULT_SLAB_DEPTH: Final[int] = 16
+
+_numba_kernel = None
+
+
+def _get_numba_kernel():
+    # // numba is optional; it is imported on first use only
+    global _numba_kernel
+    if _numba_kernel is None:
+        try:
+            from modules._projection_numba import max_projections
+
+            _numba_kernel = max_projections
+        except ImportError:
+            _numba_kernel = False
+
+    return _numba_kernel or None
+
+
+def _z_blocks(depth: int, block_count: int, slab_depth: int):
+    # // contiguous z ranges aligned to slabs, one for each worker
+    slab_count = -(-depth // slab_depth)
+    per_block = -(-slab_count // block_count)
+    blocks = []
+    for start in range(0, depth, per_block * slab_depth):
+        blocks.append((start, min(start + per_block * slab_depth, depth)))
+    return blocks
+
+
+class ProjectionKernel(object):
+    # // projections along the three axes in a single blocked pass over
+    # // z slabs
+    # // Each worker walks over its own z range, so that every slab is read
+    # // once; projections along y and x are written into disjoint rows of
+    # // the outputs, and those along z are merged at the end.
+    def __init__(
+        self,
+        method: str = "max",
+        q: float = 50,
+        slab_depth: int = None,
+        max_workers: int = None,
+        use_numba: bool = True,
+    ):
+        assert method in PROJECTION_METHODS
+        self.method = method
+        self.q = q
+        self.slab_depth = slab_depth
+        self.max_workers = max_workers or default_worker_count()
+        self.use_numba = use_numba
+
+    def __slab_depth(self, volume):
+        if self.slab_depth is not None:
+            return self.slab_depth
+        # // chunked volumes are read chunk by chunk
+        chunks = getattr(volume, "chunks", None)
+        return chunks[0] if chunks is not None else DEFAULT_SLAB_DEPTH
+
+    def __map(self, func, items):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(func, items))
+
+    def __call__(self, volume) -> List[np.ndarray]:
+        if self.method == "max":
+            return self.max(volume)
+        if self.method == "mean":
+            return self.mean(volume)
+        return self.percentile(volume)
+
+    def max(self, volume) -> List[np.ndarray]:
+        kernel = None
+        if (
+            self.use_numba
+            and isinstance(volume, np.ndarray)
+            and np.issubdtype(volume.dtype, np.unsignedinteger)
+        ):
+            kernel = _get_numba_kernel()
+
+        if kernel is not None:
+            out0, out1, out2 = kernel(volume, self.max_workers)
+            return [out0.max(axis=0), out1, out2]
+
+        Z, Y, X = volume.shape
+        out1 = np.empty((Z, X), dtype=volume.dtype)
+        out2 = np.empty((Z, Y), dtype=volume.dtype)
+        slab_depth = self.__slab_depth(volume)
+
+        def project_block(block):
+            acc = None
+            for z in range(block[0], block[1], slab_depth):
+                slab = np.asarray(volume[z : min(z + slab_depth, block[1])])
+                d = slab.shape[0]
+                np.maximum.reduce(slab, axis=1, out=out1[z : z + d])
+                np.maximum.reduce(slab, axis=2, out=out2[z : z + d])
+                if acc is None:
+                    acc = np.maximum.reduce(slab, axis=0)
+                else:
+                    np.maximum(acc, np.maximum.reduce(slab, axis=0), out=acc)
+            return acc
+
+        blocks = _z_blocks(Z, self.max_workers, slab_depth)
+        out0 = np.maximum.reduce(self.__map(project_block, blocks))
+        return [out0, out1, out2]
+
+    def mean(self, volume) -> List[np.ndarray]:
+        Z, Y, X = volume.shape
+        out1 = np.empty((Z, X), dtype=np.float32)
+        out2 = np.empty((Z, Y), dtype=np.float32)
+        slab_depth = self.__slab_depth(volume)
+        sum_dtype = (
+            np.uint64
+            if np.issubdtype(volume.dtype, np.unsignedinteger)
+            else np.float64
+        )
+        # // sums of 8-bit rows are faster in integers and never overflow
+        row_dtype = (
+            np.uint32
+            if np.issubdtype(volume.dtype, np.unsignedinteger)
+            and volume.dtype.itemsize <= 1
+            else np.float64
+        )
+
+        def project_block(block):
+            acc = np.zeros((Y, X), dtype=sum_dtype)
+            for z in range(block[0], block[1], slab_depth):
+                slab = np.asarray(volume[z : min(z + slab_depth, block[1])])
+                d = slab.shape[0]
+                out1[z : z + d] = np.add.reduce(slab, axis=1, dtype=row_dtype)
+                out2[z : z + d] = np.add.reduce(slab, axis=2, dtype=row_dtype)
+                np.add(
+                    acc, np.add.reduce(slab, axis=0, dtype=sum_dtype), out=acc
+                )
+            return acc
+
+        blocks = _z_blocks(Z, self.max_workers, slab_depth)
+        out0 = np.add.reduce(self.__map(project_block, blocks))
+
+        out1 /= Y
+        out2 /= X
+        return [(out0 / Z).astype(np.float32), out1, out2]
+
+    def percentile(self, volume) -> List[np.ndarray]:
+        # // projections along y and x are computed slab by slab, and that
+        # // along z needs all slices of a pixel, so it is computed over
+        # // bands of rows in a second pass
+        Z, Y, X = volume.shape
+        out0 = np.empty((Y, X), dtype=np.float32)
+        out1 = np.empty((Z, X), dtype=np.float32)
+        out2 = np.empty((Z, Y), dtype=np.float32)
+        slab_depth = self.__slab_depth(volume)
+
+        def project_slab(z):
+            slab = np.asarray(volume[z : z + slab_depth])
+            d = slab.shape[0]
+            out1[z : z + d] = np.percentile(slab, self.q, axis=1)
+            out2[z : z + d] = np.percentile(slab, self.q, axis=2)
+
+        band = max(1, slab_depth * Y // max(Z, 1))
+
+        def project_band(y):
+            rows = np.asarray(volume[:, y : y + band])
+            out0[y : y + rows.shape[1]] = np.percentile(rows, self.q, axis=0)
+
+        self.__map(project_slab, list(range(0, Z, slab_depth)))
+        self.__map(project_band, list(range(0, Y, band)))
+        return [out0, out1, out2]
+
+
+def _lowest_value(dtype):
+    if np.issubdtype(dtype, np.integer):
+        return np.iinfo(dtype).min
+    return -np.inf
+
+
+class StreamingProjection(object):
+    # // max projections updated slice by slice while a volume is loaded
+    # // add_slice() is called from the decoding threads. Each thread
+    # // accumulates the projection along z on its own buffer, and the
+    # // buffers are merged by projections().
+    def __init__(self, shape: Tuple[int, int, int], dtype):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        Z, Y, X = self.shape
+        self.out1 = np.full((Z, X), _lowest_value(self.dtype), self.dtype)
+        self.out2 = np.full((Z, Y), _lowest_value(self.dtype), self.dtype)
+
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__accumulators: List[np.ndarray] = []
+
+    def add_slice(self, z: int, img: np.ndarray):
+        np.maximum.reduce(img, axis=0, out=self.out1[z])
+        np.maximum.reduce(img, axis=1, out=self.out2[z])
+
+        acc = getattr(self.__local, "acc", None)
+        if acc is None:
+            acc = np.full(img.shape, _lowest_value(self.dtype), self.dtype)
+            self.__local.acc = acc
+            with self.__lock:
+                self.__accumulators.append(acc)
+
+        np.maximum(acc, img, out=acc)
+
+    def projections(self) -> List[np.ndarray]:
+        with self.__lock:
+            accumulators = self.__accumulators.copy()
+
+        out0 = np.full(
+            self.shape[1:3], _lowest_value(self.dtype), dtype=self.dtype
+        )
+        for acc in accumulators:
+            np.maximum(out0, acc, out=out0)
+
+        return [out0, self.out1.copy(), self.out2.copy()]
+
+
+def project(volume, method: str = "max", **kwargs) -> List[np.ndarray]:
+    # // [projection along z, along y, along x]
+    return ProjectionKernel(method=method, **kwargs)(volume)
+
+
+def benchmark(shape=(512, 1024, 1024), repeat: int = 3):
+    logger = logging.getLogger("projection benchmark")
+    rng = np.random.default_rng(0)
+    volume = rng.integers(0, 256, size=shape, dtype=np.uint8)
+    logger.info(f"[volume] {shape} uint8, {volume.nbytes / 1024**2:.0f} MiB")
+
+    def measure(label, func):
+        func()  # // warming up, e.g. for JIT compilation
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = func()
+        elapsed = (time.perf_counter() - started) / repeat
+        logger.info(f"  {elapsed * 1000:8.1f} ms  {label}")
+        return result
+
+    reference = measure(
+        "numpy, one pass per axis",
+        lambda: [volume.max(axis=i) for i in range(3)],
+    )
+    candidates = {
+        "blocked, 1 thread": ProjectionKernel(max_workers=1, use_numba=False),
+        "blocked, threaded": ProjectionKernel(use_numba=False),
+    }
+    if _get_numba_kernel() is not None:
+        candidates["numba"] = ProjectionKernel(use_numba=True)
+
+    for label, kernel in candidates.items():
+        result = measure(label, lambda: kernel(volume))
+        assert all((r == e).all() for r, e in zip(result, reference))
+
+    measure("mean, blocked, threaded", lambda: project(volume, "mean"))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the projection kernel."
+    )
+    parser.add_argument(
+        "--shape", type=int, nargs=3, default=[512, 1024, 1024]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    benchmark(shape=tuple(args.shape), repeat=args.repeat)
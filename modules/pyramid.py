@@ -0,0 +1,141 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Final, Tuple
+
+import numpy as np
+
+from modules.volume import default_worker_count
+
+DEFAULT_FACTORS: Final[Tuple[int, ...]] = (2, 4, 8)
+DEFAULT_PYRAMID_BYTES: Final[int] = 1024**3
+
+
+def downsample(image: np.ndarray, factor: int, method: str = "mean"):
+    # // downsamples the last two axes (y, x) by an integer factor
+    # // edges are padded so that no pixel is dropped
+    assert method in ("mean", "max")
+    if factor == 1:
+        return image
+
+    h, w = image.shape[-2:]
+    pad_h, pad_w = (-h) % factor, (-w) % factor
+    if pad_h or pad_w:
+        pad = [(0, 0)] * (image.ndim - 2) + [(0, pad_h), (0, pad_w)]
+        image = np.pad(image, pad, mode="edge")
+
+    h, w = image.shape[-2:]
+    blocks = image.reshape(
+        image.shape[:-2] + (h // factor, factor, w // factor, factor)
+    )
+
+    if method == "max":
+        return blocks.max(axis=(-3, -1))
+
+    if np.issubdtype(image.dtype, np.integer):
+        summed = blocks.sum(axis=(-3, -1), dtype=np.uint64)
+        return (summed // (factor * factor)).astype(image.dtype)
+
+    return blocks.mean(axis=(-3, -1)).astype(image.dtype)
+
+
+def choose_level(factors, pixel_size: float) -> int:
+    # // the coarsest level still finer than a screen pixel
+    chosen = 1
+    for factor in sorted(factors):
+        if factor <= pixel_size:
+            chosen = factor
+    return chosen
+
+
+def build_image_pyramid(
+    image: np.ndarray, factors=DEFAULT_FACTORS, method: str = "mean"
+) -> Dict[int, np.ndarray]:
+    levels = {1: image}
+    previous = 1
+    for factor in sorted(factors):
+        if min(image.shape[-2:]) // factor < 1:
+            break
+        # // each level is derived from the previous one
+        levels[factor] = downsample(
+            levels[previous], factor // previous, method=method
+        )
+        previous = factor
+
+    return levels
+
+
+class VolumePyramid(object):
+    # // in-plane (y, x) downsampled copies of a volume
+    # // The z axis is kept, so that slice indexes are shared by all levels.
+    def __init__(
+        self,
+        factors: Tuple[int, ...] = DEFAULT_FACTORS,
+        method: str = "mean",
+        max_bytes: int = DEFAULT_PYRAMID_BYTES,
+        minimum_size: int = 32,
+    ):
+        assert all(f > 1 and f & (f - 1) == 0 for f in factors)
+        self.factors = tuple(sorted(factors))
+        self.method = method
+        self.max_bytes = max_bytes
+        self.minimum_size = minimum_size
+        self.levels: Dict[int, np.ndarray] = {}
+
+    def level_shape(self, shape: Tuple[int, ...], factor: int):
+        return shape[:1] + tuple(-(-s // factor) for s in shape[1:3])
+
+    def planned_factors(self, shape: Tuple[int, ...], itemsize: int = 1):
+        # // levels too small to be useful or too large for the budget
+        # // are not built
+        planned = []
+        nbytes = 0
+        for factor in self.factors:
+            if min(shape[1:3]) // factor < self.minimum_size:
+                break
+            level_bytes = int(np.prod(self.level_shape(shape, factor)))
+            nbytes += level_bytes * itemsize
+            if nbytes > self.max_bytes:
+                continue
+            planned.append(factor)
+        return planned
+
+    def build_iterably(
+        self, volume, slab_depth: int = 16, max_workers: int = None
+    ):
+        factors = self.planned_factors(volume.shape, volume.dtype.itemsize)
+        self.levels = {}
+        if len(factors) == 0:
+            return
+
+        levels = {
+            f: np.empty(self.level_shape(volume.shape, f), dtype=volume.dtype)
+            for f in factors
+        }
+
+        def build_slab(z):
+            previous, image = 1, volume[z : z + slab_depth]
+            for factor in factors:
+                image = downsample(
+                    image, factor // previous, method=self.method
+                )
+                levels[factor][z : z + slab_depth] = image
+                previous = factor
+
+        z_list = list(range(0, volume.shape[0], slab_depth))
+        max_workers = max_workers or default_worker_count()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for i, _ in enumerate(executor.map(build_slab, z_list)):
+                yield i + 1, len(z_list)
+
+        self.levels = levels
+
+    def build(self, volume, **kwargs):
+        for _ in self.build_iterably(volume, **kwargs):
+            pass
+        return self
+
+    def is_empty(self):
+        return len(self.levels) == 0
+
+    def level_for(self, pixel_size: float):
+        factor = choose_level(self.levels.keys(), pixel_size)
+        return factor, self.levels.get(factor, None)
@@ -0,0 +1,250 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Final, Iterable, List
+
+import numpy as np
+
+from modules.lazy_import import lazy_import
+from modules.volume import default_worker_count
+
+ndimage = lazy_import("scipy.ndimage")
+filters = lazy_import("skimage.filters")
+
+ROOT_RADIUS_VERSION: Final[int] = 1
+DEFAULT_TILE_SIZE: Final[int] = 32
+DEFAULT_MAX_RADIUS: Final[int] = 12
+DEFAULT_CACHE_BYTES: Final[int] = 256 * 1024**2
+
+
+def estimate_threshold(volume: np.ndarray, max_samples: int = 4 * 1024**2):
+    # // Otsu's threshold of voxels sampled evenly from the volume
+    # // The slices are sampled one by one, not to read chunked volumes
+    # // entirely.
+    size = int(np.prod(volume.shape[:3]))
+    step = max(1, int(np.ceil((size / max_samples) ** (1 / 3))))
+    sample = np.stack(
+        [
+            np.asarray(volume[z, ::step, ::step])
+            for z in range(0, volume.shape[0], step)
+        ]
+    )
+    if sample.min() == sample.max():
+        return float(sample.max())
+    return float(filters.threshold_otsu(sample))
+
+
+def _window_offsets(radius: int):
+    r = np.arange(-radius, radius + 1)
+    offsets = np.stack(np.meshgrid(r, r, r, indexing="ij"), axis=-1)
+    offsets = offsets.reshape(-1, 3)
+    return offsets[np.sum(offsets**2, axis=1) <= radius**2]
+
+
+class RootRadiusEstimator(object):
+    # // local root radii from the Euclidean distance transform (EDT) of the
+    # // thresholded volume
+    # // The EDT is computed on demand in tiles around the polylines, in
+    # // parallel, and the tiles are kept in an LRU cache. Each tile is
+    # // padded by max_radius, so that distances up to max_radius are exact.
+    def __init__(
+        self,
+        volume: np.ndarray,
+        threshold: float = None,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        max_radius: int = DEFAULT_MAX_RADIUS,
+        search_radius: int = 2,
+        cache_bytes: int = DEFAULT_CACHE_BYTES,
+        max_workers: int = None,
+    ):
+        self.volume = volume
+        self.shape = np.array(volume.shape[:3])
+        self.tile_size = tile_size
+        self.max_radius = max_radius
+        self.search_radius = search_radius
+        self.cache_bytes = cache_bytes
+        self.max_workers = max_workers or default_worker_count()
+
+        self.__threshold = threshold
+        self.__tiles: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self.__tile_bytes = 0
+        self.__radii: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__threshold_lock = threading.Lock()
+
+    def threshold(self):
+        with self.__threshold_lock:
+            if self.__threshold is None:
+                self.__threshold = estimate_threshold(self.volume)
+        return self.__threshold
+
+    def __tile(self, index: tuple):
+        lower = np.array(index) * self.tile_size
+        upper = np.minimum(lower + self.tile_size, self.shape)
+        lo = np.maximum(lower - self.max_radius, 0)
+        hi = np.minimum(upper + self.max_radius, self.shape)
+
+        mask = (
+            np.asarray(
+                self.volume[lo[0] : hi[0], lo[1] : hi[1], lo[2] : hi[2]]
+            )
+            > self.threshold()
+        )
+        if mask.all():
+            edt = np.full(mask.shape, self.max_radius, dtype=np.float32)
+        elif not mask.any():
+            edt = np.zeros(mask.shape, dtype=np.float32)
+        else:
+            edt = ndimage.distance_transform_edt(mask).astype(np.float32)
+
+        core = edt[
+            lower[0] - lo[0] : upper[0] - lo[0],
+            lower[1] - lo[1] : upper[1] - lo[1],
+            lower[2] - lo[2] : upper[2] - lo[2],
+        ]
+        return np.minimum(core, self.max_radius)
+
+    def tiles(
+        self,
+        indices: Iterable[tuple],
+        on_tile: Callable[[int, int], None] = None,
+    ) -> Dict[tuple, np.ndarray]:
+        # // the EDT tiles, computed in parallel if missing
+        indices = list(dict.fromkeys(indices))
+        tiles = {}
+        with self.__lock:
+            for index in indices:
+                tile = self.__tiles.get(index, None)
+                if tile is not None:
+                    self.__tiles.move_to_end(index)
+                    tiles[index] = tile
+        missing = [index for index in indices if index not in tiles]
+
+        total = len(missing)
+        if total != 0:
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_workers, total)
+            ) as executor:
+                for i, tile in enumerate(executor.map(self.__tile, missing)):
+                    tiles[missing[i]] = tile
+                    if on_tile is not None:
+                        on_tile(i + 1, total)
+
+            with self.__lock:
+                for index in missing:
+                    if index not in self.__tiles:
+                        self.__tiles[index] = tiles[index]
+                        self.__tile_bytes += tiles[index].nbytes
+                while (
+                    self.__tile_bytes > self.cache_bytes
+                    and len(self.__tiles) > 1
+                ):
+                    _, tile = self.__tiles.popitem(last=False)
+                    self.__tile_bytes -= tile.nbytes
+
+        return tiles
+
+    def key_of(self, polyline) -> str:
+        return hashlib.sha1(
+            np.asarray(polyline, dtype=np.int64).tobytes()
+        ).hexdigest()
+
+    def __window(self, polyline):
+        # // the voxels around each point, (points, window, zyx)
+        points = np.asarray(polyline, dtype=np.int64).reshape(-1, 3)
+        points = np.clip(points, 0, self.shape - 1)
+        voxels = points[:, None, :] + _window_offsets(self.search_radius)
+        return np.clip(voxels, 0, self.shape - 1)
+
+    def __tile_ids(self, voxels):
+        grid = -(-self.shape // self.tile_size)
+        return np.ravel_multi_index((voxels // self.tile_size).T, grid)
+
+    def __tile_index(self, tile_id):
+        grid = -(-self.shape // self.tile_size)
+        return tuple(int(i) for i in np.unravel_index(tile_id, grid))
+
+    def measure(
+        self,
+        polylines: List[List[List[int]]],
+        on_tile: Callable[[int, int], None] = None,
+    ):
+        # // the tiles of all polylines are computed at once
+        # // The corners of the windows cover their tiles, since the tiles
+        # // are larger than the windows.
+        polylines = [p for p in polylines if len(p) != 0]
+        if len(polylines) == 0:
+            return
+        points = np.concatenate(
+            [np.asarray(p, dtype=np.int64).reshape(-1, 3) for p in polylines]
+        )
+        r = self.search_radius
+        corners = np.array(
+            [[z, y, x] for z in (-r, r) for y in (-r, r) for x in (-r, r)]
+        )
+        voxels = np.clip(points[:, None, :] + corners, 0, self.shape - 1)
+        tile_ids = np.unique(self.__tile_ids(voxels.reshape(-1, 3)))
+        self.tiles([self.__tile_index(i) for i in tile_ids], on_tile=on_tile)
+
+        for polyline in polylines:
+            self.radii(polyline)
+
+    def radii(self, polyline, cached_only: bool = False):
+        # // the radius [voxel] at each point, or NaN out of the roots
+        # // The largest EDT value in a small window is taken, since
+        # // polylines are not always on the root centers.
+        key = self.key_of(polyline)
+        with self.__lock:
+            radii = self.__radii.get(key, None)
+            if radii is not None:
+                self.__radii.move_to_end(key)
+        if radii is not None or cached_only:
+            return radii
+
+        if len(polyline) == 0:
+            radii = np.zeros(0, dtype=np.float32)
+        else:
+            voxels = self.__window(polyline)
+            flat = voxels.reshape(-1, 3)
+            tile_ids, inverse = np.unique(
+                self.__tile_ids(flat), return_inverse=True
+            )
+            indices = [self.__tile_index(i) for i in tile_ids]
+            tiles = self.tiles(indices)
+
+            # // the voxels are grouped by their tiles
+            order = np.argsort(inverse, kind="stable")
+            bounds = np.searchsorted(
+                inverse[order], np.arange(len(tile_ids) + 1)
+            )
+            distances = np.zeros(len(flat), dtype=np.float32)
+            for i, index in enumerate(indices):
+                selected = order[bounds[i] : bounds[i + 1]]
+                local = flat[selected] - np.array(index) * self.tile_size
+                distances[selected] = tiles[index][
+                    local[:, 0], local[:, 1], local[:, 2]
+                ]
+
+            # // the distance from the center to the nearest background
+            edt = distances.reshape(voxels.shape[:2]).max(axis=1)
+            radii = np.where(edt > 0, edt, np.nan).astype(np.float32)
+
+        with self.__lock:
+            self.__radii[key] = radii
+            while len(self.__radii) > 4096:
+                self.__radii.popitem(last=False)
+
+        return radii
+
+
+def root_volume(polyline, radii) -> float:
+    # // [voxel^3] the sum of the cylinders between adjacent points
+    polyline = np.asarray(polyline, dtype=np.float64).reshape(-1, 3)
+    if len(polyline) <= 1:
+        return 0.0
+
+    lengths = np.sqrt(np.sum(np.diff(polyline, axis=0) ** 2, axis=1))
+    radii = np.nan_to_num(np.asarray(radii, dtype=np.float64), nan=0.0)
+    r = (radii[:-1] + radii[1:]) / 2
+    return float(np.sum(np.pi * r**2 * lengths))
@@ -0,0 +1,181 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from typing import Final, Iterator, List, Tuple
+
+import numpy as np
+
+from modules.lazy_import import lazy_import
+from modules.root_radius import estimate_threshold
+from modules.volume import default_worker_count
+
+morphology = lazy_import("skimage.morphology")
+spatial = lazy_import("scipy.spatial")
+
+DEFAULT_CHUNK_SIZE: Final[int] = 128
+DEFAULT_HALO: Final[int] = 8
+DEFAULT_MIN_OBJECT_SIZE: Final[int] = 64
+
+# // half of the 26-neighborhood, so that each edge is found once
+_FORWARD_OFFSETS: Final[np.ndarray] = np.array(
+    [
+        o
+        for o in product((-1, 0, 1), repeat=3)
+        if o > (0, 0, 0)  # // lexicographic
+    ]
+)
+
+
+class SkeletonGraph(object):
+    # // skeleton voxels as a sparse graph
+    # // nodes: (N, 3) [z, y, x] sorted by the linear index
+    # // edges: (E, 2) node indices of 26-connected voxels
+    def __init__(self, nodes: np.ndarray, edges: np.ndarray, shape: tuple):
+        self.nodes = nodes
+        self.edges = edges
+        self.shape = tuple(shape[:3])
+
+        # // nodes are sorted by z, so that a slice is a pair of offsets
+        self.offsets = np.searchsorted(
+            self.nodes[:, 0], np.arange(self.shape[0] + 1)
+        )
+        self.__tree = None
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def from_indices(cls, indices: np.ndarray, shape: tuple):
+        shape = tuple(shape[:3])
+        indices = np.unique(np.asarray(indices, dtype=np.int64))
+        nodes = np.stack(np.unravel_index(indices, shape), axis=1)
+        if len(indices) == 0:
+            return cls(
+                nodes.astype(np.int32), np.zeros((0, 2), np.int32), shape
+            )
+
+        edge_list = []
+        for offset in _FORWARD_OFFSETS:
+            neighbors = nodes + offset
+            valid = np.all((neighbors >= 0) & (neighbors < shape), axis=1)
+            source = np.flatnonzero(valid)
+            linear = np.ravel_multi_index(neighbors[valid].T, shape)
+            target = np.searchsorted(indices, linear)
+            target = np.minimum(target, len(indices) - 1)
+            found = indices[target] == linear
+            edge_list.append(np.stack([source[found], target[found]], axis=1))
+
+        edges = np.concatenate(edge_list)
+        return cls(nodes.astype(np.int32), edges.astype(np.int32), shape)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def nodes_at(self, z: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, stop = self.offsets[z], self.offsets[z + 1]
+        return self.nodes[start:stop, 1], self.nodes[start:stop, 2]
+
+    def degrees(self) -> np.ndarray:
+        return np.bincount(self.edges.ravel(), minlength=len(self.nodes))
+
+    def nearest_node(self, coordinate, max_distance: float):
+        # // [z, y, x] of the nearest node, or None if it is too far
+        if len(self.nodes) == 0:
+            return None
+
+        with self.__lock:
+            if self.__tree is None:
+                self.__tree = spatial.cKDTree(self.nodes)
+        distance, i = self.__tree.query(
+            coordinate, distance_upper_bound=max_distance
+        )
+        if not np.isfinite(distance):
+            return None
+        return [int(v) for v in self.nodes[i]]
+
+
+class VolumeSkeletonizer(object):
+    # // thresholds and skeletonizes a volume chunk by chunk
+    # // Each chunk is padded by a halo, so that the skeleton is continuous
+    # // across the chunks, and only its core is kept. The chunks are
+    # // processed by a thread pool with a bounded number in flight, so
+    # // that memory-mapped or chunked volumes larger than RAM are handled.
+    def __init__(
+        self,
+        volume,
+        threshold: float = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        halo: int = DEFAULT_HALO,
+        min_object_size: int = DEFAULT_MIN_OBJECT_SIZE,
+        max_workers: int = None,
+    ):
+        self.volume = volume
+        self.shape = tuple(volume.shape[:3])
+        self.threshold = threshold
+        self.chunk_size = chunk_size
+        self.halo = halo
+        self.min_object_size = min_object_size
+        self.max_workers = max_workers or default_worker_count()
+        self.graph: SkeletonGraph = None
+
+    def chunk_indices(self) -> List[Tuple[int, int, int]]:
+        grid = [range(0, s, self.chunk_size) for s in self.shape]
+        return list(product(*grid))
+
+    def __skeletonize(self, lower) -> np.ndarray:
+        lower = np.array(lower)
+        upper = np.minimum(lower + self.chunk_size, self.shape)
+        lo = np.maximum(lower - self.halo, 0)
+        hi = np.minimum(upper + self.halo, self.shape)
+
+        mask = (
+            np.asarray(
+                self.volume[lo[0] : hi[0], lo[1] : hi[1], lo[2] : hi[2]]
+            )
+            > self.threshold
+        )
+        if not mask.any():
+            return np.zeros(0, dtype=np.int64)
+
+        # // specks of noise are not skeletonized
+        mask = morphology.remove_small_objects(
+            mask, min_size=self.min_object_size
+        )
+        skeleton = morphology.skeletonize(mask, method="lee")
+
+        core = skeleton[
+            lower[0] - lo[0] : upper[0] - lo[0],
+            lower[1] - lo[1] : upper[1] - lo[1],
+            lower[2] - lo[2] : upper[2] - lo[2],
+        ]
+        z, y, x = np.nonzero(core)
+        return np.ravel_multi_index(
+            (z + lower[0], y + lower[1], x + lower[2]), self.shape
+        )
+
+    def run_iterably(self) -> Iterator[Tuple[int, int]]:
+        if self.threshold is None:
+            self.threshold = estimate_threshold(self.volume)
+
+        chunks = self.chunk_indices()
+        total = len(chunks)
+        results = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = []
+            for i, lower in enumerate(chunks):
+                pending.append(executor.submit(self.__skeletonize, lower))
+                if len(pending) < self.max_workers * 2:
+                    continue
+                results.append(pending.pop(0).result())
+                yield len(results), total
+
+            for future in pending:
+                results.append(future.result())
+                yield len(results), total
+
+        indices = np.concatenate(results) if results else np.zeros(0, np.int64)
+        self.graph = SkeletonGraph.from_indices(indices, self.shape)
+
+    def run(self) -> SkeletonGraph:
+        for _ in self.run_iterably():
+            pass
+
+        return self.graph
@@ -0,0 +1,139 @@
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict
+from importlib.abc import MetaPathFinder
+from typing import Dict, List
+
+
+class _TimedLoader(object):
+    # // wraps a module loader and measures the time spent in it
+    # // (create_module loads shared libraries of extension modules)
+    def __init__(self, loader, fullname: str, profiler: "StartupProfiler"):
+        self.__loader = loader
+        self.__fullname = fullname
+        self.__profiler = profiler
+
+    def __getattr__(self, attr):
+        return getattr(self.__loader, attr)
+
+    def create_module(self, spec):
+        self.__profiler.enter(self.__fullname)
+        try:
+            return self.__loader.create_module(spec)
+        finally:
+            self.__profiler.leave(self.__fullname)
+
+    def exec_module(self, module):
+        module.__loader__ = self.__loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self.__loader
+
+        self.__profiler.enter(self.__fullname)
+        try:
+            self.__loader.exec_module(module)
+        finally:
+            self.__profiler.leave(self.__fullname)
+
+
+class StartupProfiler(MetaPathFinder):
+    def __init__(self, top: int = 30):
+        super().__init__()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.top = top
+        self.started = time.perf_counter()
+        self.cumulative: Dict[str, float] = {}
+        self.own: Dict[str, float] = {}
+        self.__local = threading.local()
+
+    def __stack(self) -> List[List]:
+        if not hasattr(self.__local, "stack"):
+            self.__local.stack = []
+            self.__local.finding = False
+        return self.__local.stack
+
+    def install(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+        return self
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path, target=None):
+        self.__stack()
+        if self.__local.finding:
+            return None
+
+        self.__local.finding = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self.__local.finding = False
+
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, fullname, self)
+        return spec
+
+    def enter(self, fullname: str):
+        # // [name, start time, time spent in child imports]
+        self.__stack().append([fullname, time.perf_counter(), 0.0])
+
+    def leave(self, fullname: str):
+        stack = self.__stack()
+        name, started, children = stack.pop()
+        elapsed = time.perf_counter() - started
+
+        self.cumulative[name] = self.cumulative.get(name, 0.0) + elapsed
+        self.own[name] = self.own.get(name, 0.0) + elapsed - children
+        if len(stack) != 0:
+            stack[-1][2] += elapsed
+
+    def package_summary(self) -> Dict[str, float]:
+        summary = defaultdict(float)
+        for name, own in self.own.items():
+            summary[name.split(".")[0]] += own
+        return dict(summary)
+
+    def report(self, label: str = "startup"):
+        total = time.perf_counter() - self.started
+        imported = sum(self.own.values())
+
+        self.logger.info(
+            f"[{label}] {total * 1000:.0f} ms in total, "
+            f"{imported * 1000:.0f} ms for importing {len(self.own)} modules"
+        )
+
+        self.logger.info("[import cost per package] self time")
+        packages = sorted(
+            self.package_summary().items(), key=lambda x: x[1], reverse=True
+        )
+        for name, own in packages[: self.top]:
+            self.logger.info(f"  {own * 1000:8.1f} ms  {name}")
+
+        self.logger.info("[import cost per module] cumulative / self time")
+        modules = sorted(
+            self.cumulative.items(), key=lambda x: x[1], reverse=True
+        )
+        for name, cumulative in modules[: self.top]:
+            self.logger.info(
+                f"  {cumulative * 1000:8.1f} ms / "
+                f"{self.own[name] * 1000:8.1f} ms  {name}"
+            )
+
+        heavy = [
+            name
+            for name in ("polars", "pandas", "skimage", "scipy", "psutil")
+            if name in sys.modules
+        ]
+        if len(heavy):
+            self.logger.info(f"[loaded at {label}] {', '.join(heavy)}")
@@ -1,28 +1,252 @@
 import json
+import multiprocessing
 import os
+import tarfile
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 from dataclasses import dataclass
+from io import BytesIO
 from pathlib import Path
-from typing import Any, Dict, Final, List, Tuple, Union
+from typing import Any, Dict, Final, Iterator, List, Tuple, Union
 
 import numpy as np
-from skimage import io
+
+from modules.lazy_import import lazy_import
+
+chunked_volume = lazy_import("modules.chunked_volume")
+volume_cache = lazy_import("modules.volume_cache")
+io = lazy_import("skimage.io")
+tifffile = lazy_import("tifffile")
 
 VOLUME_INFO_FILE_NAME: Final[str] = ".volume_info.json"
+SLICE_EXTENSIONS: Final[Tuple] = (
+    ".cb",
+    ".png",
+    ".tif",
+    ".tiff",
+    ".jpg",
+    ".jpeg",
+)
+TAR_EXTENSIONS: Final[Tuple] = (".tar.gz", ".tgz", ".tar")
+TIFF_EXTENSIONS: Final[Tuple] = (".tif", ".tiff")
+
+
+def default_worker_count():
+    return min(8, os.cpu_count() or 1)
+
+
+def create_executor(max_workers: int = None) -> ProcessPoolExecutor:
+    # // spawned, since the GUI process runs Qt and decoding threads
+    return ProcessPoolExecutor(
+        max_workers=max_workers or default_worker_count(),
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+def is_volume_file(volume_path: Union[str, Path]):
+    return str(volume_path).lower().endswith(TAR_EXTENSIONS + TIFF_EXTENSIONS)
+
+
+def get_volume_loader(
+    volume_path: Union[str, Path], use_cache: bool = True, **kwargs
+):
+    # // a volume is a slice directory, a chunked volume directory,
+    # // a tar(.gz) slice bundle, or a multi-page TIFF file
+    # // A volume with an up-to-date cache (see modules.volume_cache) is
+    # // loaded from the cache.
+    volume_path = Path(volume_path)
+    if volume_path.is_dir() and chunked_volume.is_chunked_volume(volume_path):
+        return chunked_volume.ChunkedVolumeLoader(volume_path, **kwargs)
+
+    if use_cache and volume_path.exists():
+        info = volume_cache.load_cache_info(volume_path)
+        if info is not None:
+            return volume_cache.CachedVolumeLoader(
+                volume_path, info=info, **kwargs
+            )
+
+    if volume_path.is_dir():
+        return VolumeLoader(volume_path, **kwargs)
+
+    name = volume_path.name.lower()
+    if name.endswith(TAR_EXTENSIONS):
+        return TarVolumeLoader(volume_path, **kwargs)
+    if name.endswith(TIFF_EXTENSIONS):
+        return TiffVolumeLoader(volume_path, **kwargs)
+
+    raise Exception(f"Unsupported volume source: {volume_path}")
+
+
+def allocate_shared_buffers(
+    specs: List[Tuple[Tuple[int, ...], np.dtype]],
+) -> List[np.ndarray]:
+    # // volumes of equal shape and dtype (e.g. a CT volume and its
+    # // segmentation) are decoded into one stacked buffer; None is
+    # // returned for volumes which are not stacked
+    groups: Dict[Tuple, List[int]] = {}
+    for i, spec in enumerate(specs):
+        if spec is not None:
+            shape, dtype = spec
+            groups.setdefault((tuple(shape), np.dtype(dtype)), []).append(i)
+
+    buffers = [None] * len(specs)
+    for (shape, dtype), indexes in groups.items():
+        if len(indexes) < 2:
+            continue
+        stacked = np.zeros((len(indexes),) + shape, dtype=dtype)
+        for k, i in enumerate(indexes):
+            buffers[i] = stacked[k]
+
+    return buffers
+
+
+def _select_slice_files(names: List[str], extensions: Tuple) -> List[str]:
+    # // the most frequent extension is regarded as the slice format
+    ext_count = []
+    for ext in extensions:
+        ext_count.append(len([n for n in names if n.lower().endswith(ext)]))
+
+    target_extension = extensions[ext_count.index(max(ext_count))]
+    return sorted([n for n in names if n.lower().endswith(target_extension)])
+
+
+class _SliceVolumeLoader(object):
+    # // common part of the volume loaders
+    # // Subclasses yield encoded slices in storage order from
+    # // iter_encoded_slices(), and decode them in decode().
+    # // Slices are decoded by a thread pool into a preallocated array.
+    # // open_source() keeps the source open until all slices are decoded.
+    # // on_slice(index, img) is called for every decoded slice, in the
+    # // decoding threads.
+    # // The slices are decoded into out, if given, e.g. a part of a buffer
+    # // shared with other volumes (see allocate_shared_buffers()).
+    minimum_file_number = 64
+
+    @property
+    def DEFAULT_VOLUME_INFORMATION(self) -> Dict[Any, Any]:
+        return {"mm_resolution": 0.3}
+
+    @property
+    def image_file_number(self):
+        raise NotImplementedError
+
+    def is_valid_volume(self):
+        return self.image_file_number >= self.minimum_file_number
+
+    def open_source(self):
+        return nullcontext()
+
+    def iter_encoded_slices(self) -> Iterator[Tuple[int, Any]]:
+        raise NotImplementedError
+
+    def decode(self, encoded) -> np.ndarray:
+        raise NotImplementedError
+
+    def cached_projections(self):
+        # // [along z, along y, along x] saved with the volume, if any
+        return None
+
+    def cached_pyramid(self):
+        return None
+
+    def probe(self):
+        # // (shape, dtype) of the volume, from its first slice
+        with self.open_source():
+            slices = self.iter_encoded_slices()
+            try:
+                for _, encoded in slices:
+                    img = self.decode(encoded)
+                    return (self.image_file_number,) + img.shape, img.dtype
+            finally:
+                slices.close()
+
+    def __decode_into(self, index: int, encoded, on_slice=None):
+        img = self.decode(encoded)
+        self.np_volume[index] = img
+        if on_slice is not None:
+            on_slice(index, img)
+
+    def load_iterably(
+        self,
+        max_workers: int = None,
+        on_slice=None,
+        out: np.ndarray = None,
+    ):
+        max_workers = max_workers or default_worker_count()
+        total = self.image_file_number
+        self.np_volume: np.ndarray = out
+
+        # // encoded slices waiting for decoding are bounded
+        max_pending = max_workers * 4
+        done = 0
+
+        with self.open_source(), ThreadPoolExecutor(
+            max_workers=max_workers
+        ) as executor:
+            pending = set()
+            for index, encoded in self.iter_encoded_slices():
+                if self.np_volume is None:
+                    # // the first slice reveals the volume shape
+                    # // Slices not decoded yet are shown as zeros while
+                    # // loading.
+                    img = self.decode(encoded)
+                    self.np_volume = np.zeros(
+                        (total,) + img.shape, dtype=img.dtype
+                    )
+                    self.np_volume[index] = img
+                    if on_slice is not None:
+                        on_slice(index, img)
+                    done += 1
+                    yield done, total
+                    continue
+
+                pending.add(
+                    executor.submit(
+                        self.__decode_into, index, encoded, on_slice
+                    )
+                )
+                if len(pending) >= max_pending:
+                    finished, pending = wait(
+                        pending, return_when=FIRST_COMPLETED
+                    )
+                    for future in finished:
+                        future.result()
+                        done += 1
+                        yield done, total
+
+            for future in as_completed(pending):
+                future.result()
+                done += 1
+                yield done, total
+
+    def load(self, max_workers: int = None):
+        for _ in self.load_iterably(max_workers=max_workers):
+            pass
+
+        return self.np_volume
+
+    def load_volume_info(self):
+        volume_information = self.DEFAULT_VOLUME_INFORMATION
+
+        if self.volume_info_path.is_file():
+            with open(self.volume_info_path) as f:
+                volume_information.update(json.load(f))
+
+        return volume_information
 
 
-class VolumeLoader(object):
+class VolumeLoader(_SliceVolumeLoader):
     def __init__(
         self,
         volume_path: Union[str, Path],
         minimum_file_number: int = 64,
-        extensions: Tuple = (
-            ".cb",
-            ".png",
-            ".tif",
-            ".tiff",
-            ".jpg",
-            ".jpeg",
-        ),
+        extensions: Tuple = SLICE_EXTENSIONS,
         volume_info_file_name: str = VOLUME_INFO_FILE_NAME,
     ) -> None:
         self.volume_path = Path(volume_path).resolve()
@@ -34,51 +258,154 @@ class VolumeLoader(object):
 
         assert self.volume_path.is_dir()
 
-    @property
-    def DEFAULT_VOLUME_INFORMATION(self) -> Dict[Any, Any]:
-        return {"mm_resolution": 0.3}
-
     @property
     def image_files(self):
         if self.__image_files:
             return self.__image_files
 
-        files = [
-            Path(self.volume_path, f) for f in os.listdir(self.volume_path)
+        names = os.listdir(self.volume_path)
+        self.__image_files = [
+            Path(self.volume_path, f)
+            for f in _select_slice_files(names, self.extensions)
         ]
+        return self.__image_files
 
-        ext_count = []
-        for ext in self.extensions:
-            ext_count.append(
-                len([f for f in files if str(f).lower().endswith(ext)])
-            )
+    @property
+    def image_file_number(self):
+        return len(self.image_files)
+
+    def iter_encoded_slices(self):
+        # // files are read in the worker threads
+        yield from enumerate(self.image_files)
+
+    def decode(self, encoded):
+        return io.imread(encoded)
+
+
+class TarVolumeLoader(_SliceVolumeLoader):
+    # // slices are streamed out of the archive without extraction
+    def __init__(
+        self,
+        volume_path: Union[str, Path],
+        minimum_file_number: int = 64,
+        extensions: Tuple = SLICE_EXTENSIONS,
+        volume_info_file_name: str = VOLUME_INFO_FILE_NAME,
+    ) -> None:
+        self.volume_path = Path(volume_path).resolve()
+        self.minimum_file_number = minimum_file_number
+        self.extensions = extensions
+        self.volume_info_file_name = volume_info_file_name
+
+        self.__image_files: List[str] = None
+        self.__volume_info: Dict = {}
+
+        assert self.volume_path.is_file()
+
+    def __scan_members(self):
+        names = []
+        with tarfile.open(self.volume_path, "r|*") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                if Path(member.name).name == self.volume_info_file_name:
+                    self.__volume_info = json.load(tar.extractfile(member))
+                else:
+                    names.append(member.name)
+
+        self.__image_files = _select_slice_files(names, self.extensions)
+
+    @property
+    def image_files(self):
+        if self.__image_files is None:
+            self.__scan_members()
 
-        target_extension = self.extensions[ext_count.index(max(ext_count))]
-        self.__image_files = sorted(
-            [f for f in files if str(f).lower().endswith(target_extension)]
-        )
         return self.__image_files
 
     @property
     def image_file_number(self):
         return len(self.image_files)
 
-    def is_valid_volume(self):
-        return self.image_file_number >= self.minimum_file_number
+    def iter_encoded_slices(self):
+        # // members are read in the archive order, so that the compressed
+        # // stream is decompressed only once
+        z_index = {name: i for i, name in enumerate(self.image_files)}
+        with tarfile.open(self.volume_path, "r|*") as tar:
+            for member in tar:
+                index = z_index.get(member.name, None)
+                if index is None:
+                    continue
+
+                data = tar.extractfile(member).read()
+                yield index, (member.name, data)
 
-    def load(self):
-        return np.array([io.imread(f) for f in self.image_files])
+    def decode(self, encoded):
+        name, data = encoded
+        plugin = "tifffile" if name.lower().endswith(TIFF_EXTENSIONS) else None
+        return io.imread(BytesIO(data), plugin=plugin)
 
     def load_volume_info(self):
         volume_information = self.DEFAULT_VOLUME_INFORMATION
 
-        if self.volume_info_path.is_file():
-            with open(self.volume_info_path) as f:
-                volume_information.update(json.load(f))
+        if self.__image_files is None:
+            self.__scan_members()
+        volume_information.update(self.__volume_info)
 
         return volume_information
 
 
+class TiffVolumeLoader(_SliceVolumeLoader):
+    # // pages of a multi-page TIFF file are decoded in parallel
+    def __init__(
+        self,
+        volume_path: Union[str, Path],
+        minimum_file_number: int = 64,
+        volume_info_file_name: str = VOLUME_INFO_FILE_NAME,
+    ) -> None:
+        self.volume_path = Path(volume_path).resolve()
+        self.minimum_file_number = minimum_file_number
+
+        # // e.g. scan.tif -> scan.volume_info.json
+        stem = self.volume_path.name[: self.volume_path.name.index(".")]
+        self.volume_info_path = Path(
+            self.volume_path.parent, stem + volume_info_file_name
+        )
+
+        self.__page_number: int = None
+        self.__tif = None
+
+        assert self.volume_path.is_file()
+
+    @property
+    def image_file_number(self):
+        if self.__page_number is None:
+            with tifffile.TiffFile(self.volume_path) as tif:
+                self.__page_number = len(tif.pages)
+
+        return self.__page_number
+
+    @contextmanager
+    def open_source(self):
+        with tifffile.TiffFile(self.volume_path) as tif:
+            # // the file handle is shared by the decoding threads
+            tif.filehandle.set_lock(True)
+            self.__tif = tif
+            try:
+                yield tif
+            finally:
+                self.__tif = None
+
+    def iter_encoded_slices(self):
+        lock = self.__tif.filehandle.lock
+        for i in range(self.image_file_number):
+            with lock:
+                page = self.__tif.pages[i]
+            yield i, (page, lock)
+
+    def decode(self, encoded):
+        page, lock = encoded
+        return page.asarray(lock=lock, maxworkers=1)
+
+
 @dataclass
 class VolumeSaver(object):
     np_volume: Final[np.ndarray]
@@ -0,0 +1,173 @@
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Final, List, Union
+
+import numpy as np
+
+from modules.projection import project
+from modules.pyramid import VolumePyramid
+from modules.volume import (
+    VolumeLoader,
+    _SliceVolumeLoader,
+    get_volume_loader,
+)
+
+VOLUME_CACHE_VERSION: Final[int] = 1
+VOLUME_CACHE_SUFFIX: Final[str] = ".volume_cache"
+VOLUME_CACHE_INFO_FILE_NAME: Final[str] = "cache.json"
+
+
+def volume_cache_path(volume_path: Union[str, Path]) -> Path:
+    # // e.g. scan -> scan.volume_cache, scan.tif -> scan.tif.volume_cache
+    # // The full name is kept, so that e.g. plant.day01.tif and
+    # // plant.day02.tif have their own caches.
+    volume_path = Path(volume_path).resolve()
+    return Path(volume_path.parent, volume_path.name + VOLUME_CACHE_SUFFIX)
+
+
+def is_volume_cache(path: Union[str, Path]):
+    return str(path).endswith(VOLUME_CACHE_SUFFIX)
+
+
+def source_fingerprint(volume_path: Union[str, Path]) -> Dict:
+    # // the slice files are compared by number, total size, and the latest
+    # // modification, so that a volume still being written is detected
+    volume_path = Path(volume_path)
+    if volume_path.is_dir():
+        files = VolumeLoader(volume_path).image_files
+    else:
+        files = [volume_path]
+
+    stats = [os.stat(f) for f in files]
+    return {
+        "count": len(stats),
+        "size": sum(s.st_size for s in stats),
+        "mtime_ns": max((s.st_mtime_ns for s in stats), default=0),
+    }
+
+
+def load_cache_info(volume_path: Union[str, Path]):
+    # // None unless the cache is complete and up to date
+    info_path = Path(
+        volume_cache_path(volume_path), VOLUME_CACHE_INFO_FILE_NAME
+    )
+    if not info_path.is_file():
+        return None
+
+    try:
+        with open(info_path) as f:
+            info = json.load(f)
+        if info.get("version", None) != VOLUME_CACHE_VERSION:
+            return None
+        if info.get("source", None) != source_fingerprint(volume_path):
+            return None
+    except (OSError, ValueError):
+        return None
+
+    return info
+
+
+def is_cached(volume_path: Union[str, Path]):
+    return load_cache_info(volume_path) is not None
+
+
+def build_volume_cache(
+    volume_path: Union[str, Path], max_workers: int = None
+) -> Path:
+    # // the stack is saved as a .npy file, so that it is memory-mapped on
+    # // loading; the max projections and the pyramid levels are saved with
+    # // it. The info file is written last, which marks the cache ready.
+    volume_path = Path(volume_path).resolve()
+    cache_path = volume_cache_path(volume_path)
+    source = source_fingerprint(volume_path)
+
+    volume_loader = get_volume_loader(volume_path, use_cache=False)
+    np_volume = volume_loader.load(max_workers=max_workers)
+    volume_info = volume_loader.load_volume_info()
+
+    # // a stale cache is removed first, not to be loaded half-written
+    if cache_path.exists():
+        shutil.rmtree(cache_path)
+    os.makedirs(cache_path)
+
+    np.save(Path(cache_path, "volume.npy"), np.asarray(np_volume))
+    np.savez(
+        Path(cache_path, "projections.npz"),
+        *project(np_volume, "max", max_workers=max_workers),
+    )
+    pyramid = VolumePyramid().build(np_volume, max_workers=max_workers)
+    for factor, level in pyramid.levels.items():
+        np.save(Path(cache_path, f"pyramid_{factor}.npy"), level)
+
+    info = {
+        "version": VOLUME_CACHE_VERSION,
+        "source": source,
+        "shape": [int(i) for i in np_volume.shape],
+        "dtype": np_volume.dtype.str,
+        "pyramid": sorted(pyramid.levels.keys()),
+        "volume_info": volume_info,
+    }
+    tmp_path = Path(cache_path, f"{VOLUME_CACHE_INFO_FILE_NAME}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(info, f)
+    os.replace(tmp_path, Path(cache_path, VOLUME_CACHE_INFO_FILE_NAME))
+
+    return cache_path
+
+
+class CachedVolumeLoader(_SliceVolumeLoader):
+    # // the stack is memory-mapped, and nothing is decoded on loading
+    # // Pages are copied on write, so that the cache is never modified.
+    def __init__(
+        self,
+        volume_path: Union[str, Path],
+        minimum_file_number: int = 64,
+        info: Dict = None,
+    ) -> None:
+        self.volume_path = Path(volume_path).resolve()
+        self.minimum_file_number = minimum_file_number
+        self.cache_path = volume_cache_path(self.volume_path)
+        self.info = info or load_cache_info(self.volume_path)
+        self.__projections: List[np.ndarray] = None
+
+        assert self.info is not None
+
+    @property
+    def image_file_number(self):
+        return self.info["shape"][0]
+
+    def probe(self):
+        # // never decoded into memory, so that it is not stacked
+        return None
+
+    def load_iterably(
+        self, max_workers: int = None, on_slice=None, out: np.ndarray = None
+    ):
+        # // on_slice is never called; see cached_projections()
+        self.np_volume = np.load(
+            Path(self.cache_path, "volume.npy"), mmap_mode="c"
+        )
+        yield self.np_volume.shape[0], self.np_volume.shape[0]
+
+    def load_volume_info(self):
+        volume_information = self.DEFAULT_VOLUME_INFORMATION
+        volume_information.update(self.info.get("volume_info", {}))
+        return volume_information
+
+    def cached_projections(self) -> List[np.ndarray]:
+        if self.__projections is None:
+            with np.load(Path(self.cache_path, "projections.npz")) as f:
+                self.__projections = [f[f"arr_{i}"] for i in range(3)]
+        return self.__projections
+
+    def cached_pyramid(self) -> VolumePyramid:
+        pyramid = VolumePyramid()
+        pyramid.levels = {
+            factor: np.load(
+                Path(self.cache_path, f"pyramid_{factor}.npy"), mmap_mode="r"
+            )
+            for factor in self.info.get("pyramid", [])
+        }
+        return pyramid